@@ -0,0 +1,482 @@
+"""
+Offline micro-benchmarks for the ingestion and query hot paths.
+
+    python benchmark.py --docs 200 --output benchmark_results/baseline.json
+    python benchmark.py --docs 200 --compare benchmark_results/baseline.json
+
+A synthetic corpus is generated from sample_texts/. Chunking, NER, graph
+writes, embedding, Chroma writes, vector queries and prompt assembly are
+timed separately, each with its throughput and memory high-water marks.
+Graph writes go to an in-memory stand-in unless --neo4j-uri is given, and
+the LLM call goes to an in-process stand-in. Stages whose models are not
+installed are reported as skipped. --compare exits with status 1 when a
+stage's throughput drops or its peak memory grows past --threshold.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SAMPLES_DIR = os.environ.get(
+    "BENCHMARK_SAMPLES_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sample_texts"))
+NAMES = ["Ava", "Noah", "Priya", "Mateo", "Yuki", "Omar", "Lena", "Kofi", "Ines", "Ravi"]
+PLACES = ["Lisbon", "Denver", "Osaka", "Nairobi", "Oslo", "Austin", "Porto", "Lyon"]
+ITEMS = ["a bicycle", "a violin", "two lamps", "a sapling", "a camera", "old maps"]
+
+
+class InMemoryGraph:
+    """
+    Stand-in for the neo4j driver: sessions and explicit transactions with
+    run()/consume()/commit(), applying GraphStorage's UNWIND write
+    statements to plain dicts. Measures the Python side of a graph write
+    (row building, batching) without a database. Chunk text also goes into
+    a local inverted index that answers the full-text fallback query.
+    """
+
+    def __init__(self):
+        from storage import graph_storage as gs
+        from storage.inverted_index import InvertedIndex
+        self.fulltext = InvertedIndex()
+        self.owner_chunks = {}
+        self.documents, self.chunks, self.entities = {}, {}, {}
+        self.mentions, self.next_links, self.co_occurrences = set(), [], {}
+        self.adjacency = {}
+        self.statements = 0
+        self.handlers = {
+            gs.WRITE_DOCUMENTS: self._documents,
+            gs.WRITE_CHUNKS: self._chunks,
+            gs.WRITE_NEXT_LINKS: self._next_links,
+        }
+        # both entity scopes are applied alike, the stand-in keeps a single entity namespace
+        for scope in gs.ENTITY_SCOPES:
+            write_mentions, write_co_occurrences, write_adjacency = gs.ENTITY_WRITES[scope]
+            self.handlers[write_mentions] = self._mentions
+            self.handlers[write_co_occurrences] = self._co_occurrences
+            self.handlers[write_adjacency] = self._adjacency
+        self.readers = {gs.QUERY_BY_TEXT: self._query_by_text}
+
+    def _documents(self, rows):
+        for row in rows:
+            self.documents[row["document_id"]] = dict(row)
+
+    def _chunks(self, rows):
+        for row in rows:
+            self.chunks[row["chunk_id"]] = dict(row)
+            self.fulltext.add(row["chunk_id"], row["text"])
+            self.owner_chunks.setdefault(row["owner_key"], set()).add(row["chunk_id"])
+
+    def _next_links(self, rows):
+        self.next_links.extend((row["prev_id"], row["curr_id"]) for row in rows)
+
+    def _mentions(self, rows):
+        for row in rows:
+            self.entities.setdefault((row["name"], row["type"]), row["normalized"])
+            self.mentions.add((row["chunk_id"], row["name"], row["type"], row["position"]))
+
+    def _co_occurrences(self, rows):
+        for row in rows:
+            key = (row["e1_name"], row["e1_type"], row["e2_name"], row["e2_type"])
+            self.co_occurrences[key] = self.co_occurrences.get(key, 0) + row["count"]
+
+    def _adjacency(self, rows):
+        # same merge as WRITE_ADJACENCY: touched neighbors get their current totals, the rest keep theirs
+        for row in rows:
+            entity = (row["name"], row["type"])
+            merged = dict(self.adjacency.get(entity, []))
+            for nbr in row["neighbors"]:
+                other = (nbr["name"], nbr["type"])
+                merged[other] = (self.co_occurrences.get(entity + other, 0)
+                                 + self.co_occurrences.get(other + entity, 0))
+            ranked = sorted(merged.items(), key=lambda item: (-item[1], item[0][0]))
+            self.adjacency[entity] = ranked[:row["size"]]
+
+    def _query_by_text(self, user_id, owner_key, terms, candidates, limit, **_):
+        # the terms are already tokens, joined only so search() splits them back unchanged
+        hits = [(key, score) for key, score in self.fulltext.search(
+                    " ".join(terms), candidates, keys=self.owner_chunks.get(owner_key, ()))
+                if self.documents[self.chunks[key]["document_id"]]["user_id"] == user_id][:limit]
+        records = []
+        for key, score in hits:
+            chunk = self.chunks[key]
+            doc = self.documents[chunk["document_id"]]
+            records.append({
+                "c": {"id": key, "text": chunk["text"], "index": chunk["index"]},
+                "d": {"id": doc["document_id"], "name": doc["name"], "upload_time": None},
+                "direct_entities": [], "expanded_entities": [], "direct_score": score,
+            })
+        return records
+
+    def run(self, query: str, **params):
+        self.statements += 1
+        if query in self.readers:
+            return self.readers[query](**params)
+        handler = self.handlers.get(query)
+        if handler and "rows" in params:
+            handler(params["rows"])
+        return self
+
+    def consume(self):
+        return None
+
+    def single(self):
+        return None
+
+    def begin_transaction(self):
+        return self
+
+    def session(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        return iter(())
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "documents": len(self.documents),
+            "chunks": len(self.chunks),
+            "entities": len(self.entities),
+            "mentions": len(self.mentions),
+            "co_occurrences": len(self.co_occurrences),
+            "adjacency_entries": sum(len(nbrs) for nbrs in self.adjacency.values()),
+        }
+
+
+def synthetic_corpus(samples_dir: str, docs: int, doc_chars: int, seed: int) -> List[Dict[str, Any]]:
+    # sample sentences reshuffled into new documents, each salted with a few generated facts
+    rng = random.Random(seed)
+    sentences = []
+    for path in sorted(glob.glob(os.path.join(samples_dir, "*.txt"))):
+        with open(path, encoding="utf-8") as f:
+            sentences += [s.strip() for s in re.split(r"(?<=[.!?])\s+", f.read()) if s.strip()]
+    if not sentences:
+        raise SystemExit(f"no sample texts found in {samples_dir}")
+
+    corpus = []
+    for i in range(docs):
+        parts, size = [f"Report {i}."], 0
+        while size < doc_chars:
+            if rng.random() < 0.3:
+                sentence = (f"{rng.choice(NAMES)} met {rng.choice(NAMES)} in {rng.choice(PLACES)} "
+                            f"and bought {rng.choice(ITEMS)} for ${rng.randint(5, 900)}.")
+            else:
+                sentence = rng.choice(sentences)
+            parts.append(sentence)
+            size += len(sentence) + 1
+        corpus.append({"document_name": f"synthetic_{i:05d}.txt", "content": " ".join(parts),
+                       "metadata": {}})
+    return corpus
+
+
+def synthetic_questions(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed + 1)
+    templates = ["What did {name} buy in {place}?", "Who did {name} meet?",
+                 "How much did {name} pay for {item}?", "Where did {name} go on Saturday?"]
+    return [rng.choice(templates).format(name=rng.choice(NAMES), place=rng.choice(PLACES),
+                                         item=rng.choice(ITEMS)) for _ in range(count)]
+
+
+def _rss_high_water_mb() -> float:
+    # ru_maxrss is KB on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Bench:
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    @contextmanager
+    def _measure(self, result: Dict[str, Any]):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            result["seconds"] = round(time.perf_counter() - start, 4)
+            if self.trace_memory:
+                result["peak_python_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+                tracemalloc.stop()
+            result["rss_high_water_mb"] = _rss_high_water_mb()
+
+    def skip(self, name: str, reason: str):
+        self.stages[name] = {"skipped": reason}
+        print(f"{name:<24} skipped ({reason})")
+
+    def stage(self, name: str, fn: Callable[[], Dict[str, int]]):
+        """
+        fn does the work and returns item counts (docs, chunks, ...), each
+        becomes a <unit>_per_second rate. Missing models or services mark the
+        stage as skipped instead of failing the run.
+        """
+        result: Dict[str, Any] = {}
+        try:
+            with self._measure(result):
+                counts = fn()
+        except (ImportError, OSError, ConnectionError) as e:
+            self.skip(name, f"{type(e).__name__}: {e}")
+            return
+        for unit, count in counts.items():
+            result[unit] = count
+            if result["seconds"]:
+                result[f"{unit}_per_second"] = round(count / result["seconds"], 2)
+        self.stages[name] = result
+        rates = ", ".join(f"{k} {v}" for k, v in result.items() if k.endswith("_per_second"))
+        print(f"{name:<24} {result['seconds']:>8.3f}s  {rates}  "
+              f"peak {result.get('peak_python_mb', '-')}MB  rss {result['rss_high_water_mb']}MB")
+
+
+def bench_chunking(bench: Bench, corpus):
+    from storage.chunking import CHUNK_STRATEGIES, split_text
+    for strategy in CHUNK_STRATEGIES:
+        def run(strategy=strategy):
+            chunks = sum(len(split_text(doc["content"], strategy)) for doc in corpus)
+            return {"docs": len(corpus), "chunks": chunks}
+        bench.stage(f"chunking_{strategy}", run)
+
+
+def bench_graph(bench: Bench, corpus, questions, neo4j_uri: Optional[str]):
+    from storage.graph_storage import GraphStorage
+    from storage.chunking import assign_chunk_ids, split_text
+    import hashlib
+
+    if neo4j_uri:
+        storage = GraphStorage(uri=neo4j_uri)
+    else:
+        storage = GraphStorage(driver=InMemoryGraph())
+
+    documents = []
+    for doc in corpus:
+        content_hash = hashlib.sha256(doc["content"].encode()).hexdigest()
+        documents.append({**doc, "content_hash": content_hash,
+                          "chunks": assign_chunk_ids(split_text(doc["content"]), "bench", content_hash)})
+    chunks = [dict(chunk, document_id="bench") for doc in documents for chunk in doc["chunks"]]
+
+    if storage.model is None:
+        # prepare and write still run, with chunk rows only
+        for name in ("ner_pipe", "query_ner"):
+            bench.skip(name, "spaCy model en_core_web_md is not installed")
+    else:
+        bench.stage("ner_pipe", lambda: (storage._extract_from_chunks(chunks), {"chunks": len(chunks)})[1])
+        bench.stage("query_ner", lambda: ([storage._extract_entities(q) for q in questions],
+                                          {"queries": len(questions)})[1])
+
+    prepared = {}
+
+    def prepare():
+        prepared.update(storage._prepare_documents("bench", documents))
+        return {"docs": len(documents), "chunks": len(chunks)}
+
+    def write():
+        storage._write_plan(prepared["plan"], {})
+        return {"docs": len(documents), "rows": sum(len(rows) for _, _, rows in prepared["plan"])}
+
+    bench.stage("graph_prepare", prepare)
+    bench.stage("graph_write_neo4j" if neo4j_uri else "graph_write_in_memory", write)
+    if storage.model is None:
+        # without entities every query takes the full-text fallback
+        bench.stage("graph_query_fulltext", lambda: (
+            [storage.query("bench", q) for q in questions], {"queries": len(questions)})[1])
+    if not neo4j_uri:
+        print(f"{'':<24} in-memory graph: {storage.driver.counts()}")
+    storage.close()
+
+
+def bench_vector(bench: Bench, corpus, questions, workdir: str):
+    from chromadb.utils import embedding_functions
+    from storage.chunking import split_text
+    from storage.embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+    from storage.vector_storage import EMBEDDING_MODEL, QUERY_MODES, VectorStorage
+
+    texts = [chunk["text"] for doc in corpus for chunk in split_text(doc["content"])]
+    model = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
+    bench.stage("embedding", lambda: (model(texts), {"chunks": len(texts)})[1])
+
+    cached = CachedEmbeddingFunction(model, EMBEDDING_MODEL,
+                                     EmbeddingCache(os.path.join(workdir, "bench_cache.db")))
+    cached(texts)
+    bench.stage("embedding_cached", lambda: (cached(texts), {"chunks": len(texts)})[1])
+
+    storage = VectorStorage(persist_directory=os.path.join(workdir, "vector_db"))
+    documents = [{**doc, "content_hash": f"bench-{i}"} for i, doc in enumerate(corpus)]
+    bench.stage("chroma_write", lambda: {
+        "docs": len(documents),
+        "chunks": sum(d["chunks_processed"] for d in storage.add_documents("bench", documents)["documents"]),
+    })
+    for mode in QUERY_MODES:
+        bench.stage(f"vector_query_{mode}", lambda mode=mode: (
+            [storage.query("bench", q, 5, mode=mode) for q in questions], {"queries": len(questions)})[1])
+
+
+def bench_prompt(bench: Bench, corpus, questions):
+    import httpx
+    import prompt_service
+    from storage.chunking import split_text
+
+    rng = random.Random(0)
+    chunks = [chunk for doc in corpus[:50] for chunk in split_text(doc["content"])]
+    vector_results = [{"content": c["text"], "metadata": {"document_name": "bench", "chunk_id": str(i)},
+                       "distance": rng.random() * 1.5} for i, c in enumerate(chunks[:20])]
+    graph_results = [{"chunk": {"id": str(i), "text": c["text"]}, "document": {"name": "bench"},
+                      "entities": {"direct": [], "expanded": []}, "score": rng.randint(0, 3)}
+                     for i, c in enumerate(chunks[10:25], 10)]
+
+    bench.stage("rag_prompt_packing", lambda: (
+        [prompt_service.build_rag_messages(q, vector_results, graph_results) for q in questions],
+        {"queries": len(questions)})[1])
+
+    def llm_stand_in(request):
+        return httpx.Response(200, json={"choices": [{"message": {"content": "stand-in answer"}}]})
+
+    async def ask_all():
+        prompt_service._client = httpx.AsyncClient(
+            base_url="http://llm.local", transport=httpx.MockTransport(llm_stand_in))
+        try:
+            for q in questions:
+                messages, _ = prompt_service.build_rag_messages(q, vector_results, graph_results)
+                await prompt_service.complete(messages, 300, 0.1)
+        finally:
+            await prompt_service.aclose_client()
+
+    bench.stage("llm_roundtrip_stand_in", lambda: (asyncio.run(ask_all()), {"queries": len(questions)})[1])
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: str, threshold: float) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\nComparison with {baseline_path} (commit {baseline['meta'].get('commit')})")
+    for name, stage in current["stages"].items():
+        old = baseline["stages"].get(name)
+        if not old or "skipped" in stage or "skipped" in old:
+            continue
+        for key, new_value in stage.items():
+            old_value = old.get(key)
+            if not isinstance(new_value, (int, float)) or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            worse = (key.endswith("_per_second") and change < -threshold) or \
+                    (key == "peak_python_mb" and change > threshold)
+            if key.endswith("_per_second") or key == "peak_python_mb":
+                flag = "  REGRESSION" if worse else ""
+                print(f"{name:<24} {key:<22} {old_value:>12} → {new_value:<12} ({change:+.1%}){flag}")
+            if worse:
+                regressions.append(f"{name}.{key} {change:+.1%}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline ingestion and query micro-benchmarks")
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--doc-chars", type=int, default=4000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--samples-dir", default=SAMPLES_DIR)
+    parser.add_argument("--stages", nargs="+", default=["chunking", "graph", "vector", "prompt"],
+                        choices=["chunking", "graph", "vector", "prompt"])
+    parser.add_argument("--neo4j-uri", help="benchmark writes against a real Neo4j instead of the stand-in")
+    parser.add_argument("--no-trace-memory", action="store_true",
+                        help="skip tracemalloc, faster but without Python peak memory")
+    parser.add_argument("--verbose", action="store_true",
+                        help="keep the storage modules' INFO logs, they are part of the timed work")
+    parser.add_argument("--output", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="relative throughput drop or memory growth that counts as a regression")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    corpus = synthetic_corpus(args.samples_dir, args.docs, args.doc_chars, args.seed)
+    questions = synthetic_questions(args.queries, args.seed)
+    print(f"corpus: {len(corpus)} docs, {sum(len(d['content']) for d in corpus)} chars, {len(questions)} queries\n")
+
+    bench = Bench(trace_memory=not args.no_trace_memory)
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+        # caches read their settings at import, a persistent one would turn every run after the first into hits
+        os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embeddings.db")
+        os.environ["LEXICAL_INDEX_PATH"] = os.path.join(workdir, "lexical.db")
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+        groups = {
+            "chunking": lambda: bench_chunking(bench, corpus),
+            "graph": lambda: bench_graph(bench, corpus, questions, args.neo4j_uri),
+            "vector": lambda: bench_vector(bench, corpus, questions, workdir),
+            "prompt": lambda: bench_prompt(bench, corpus, questions),
+        }
+        for group in args.stages:
+            try:
+                groups[group]()
+            except ImportError as e:
+                bench.skip(group, f"ImportError: {e}")
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.now().isoformat(),
+            "python": sys.version.split()[0],
+            "docs": args.docs,
+            "doc_chars": args.doc_chars,
+            "queries": args.queries,
+            "seed": args.seed,
+            "graph_backend": "neo4j" if args.neo4j_uri else "in_memory",
+            "trace_memory": not args.no_trace_memory,
+        },
+        "stages": bench.stages,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved → {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nno regressions")
+
+
+if __name__ == "__main__":
+    main()
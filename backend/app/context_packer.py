@@ -0,0 +1,237 @@
+from typing import Any, Dict, List, Optional, Tuple
+import re
+import os
+
+from storage.chunking import count_tokens
+from storage.fusion import RRF_K, rrf_score
+
+# prompt context budget in tokens, 0 means no limit (results are still deduplicated and ranked)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2000))
+CONTEXT_VECTOR_WEIGHT = float(os.environ.get("CONTEXT_VECTOR_WEIGHT", 0.6))
+CONTEXT_GRAPH_WEIGHT = float(os.environ.get("CONTEXT_GRAPH_WEIGHT", 0.4))
+# word-set overlap above which two chunks count as the same text (neighbouring chunks share their overlap)
+CONTEXT_DUPLICATE_THRESHOLD = float(
+    os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", 0.8))
+# hybrid retrieval: "rrf" (reciprocal-rank fusion) or "weighted" (the normalized scores above)
+HYBRID_FUSION = os.environ.get("HYBRID_FUSION", "rrf")
+FUSION_METHODS = ("rrf", "weighted")
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _words(text: str) -> frozenset:
+    return frozenset(word.lower() for word in _WORD_RE.findall(text))
+
+
+def _overlap(a: frozenset, b: frozenset) -> float:
+    # share of the smaller chunk found in the larger one, catches containment as well as near copies
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def _entities(res: Dict[str, Any]) -> List[Dict[str, Any]]:
+    entities = res.get("entities", [])
+    if isinstance(entities, dict):
+        entities = entities.get("direct", []) + entities.get("expanded", [])
+    if not isinstance(entities, list):
+        return []
+    return [e for e in entities if isinstance(e, dict) and "name" in e]
+
+
+def _vector_candidates(vector_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    candidates = []
+    for rank, res in enumerate(vector_results):
+        metadata = res.get("metadata") or {}
+        if "distance" in res:
+            # chroma's default space is squared L2, for normalized MiniLM vectors that is 2 - 2cos
+            vector_score = max(0.0, 1.0 - res["distance"] / 2)
+        else:
+            # lexical hits carry BM25 relative to the best hit instead
+            vector_score = res.get("relevance", 0.0)
+        candidates.append({
+            "chunk_id": metadata.get("chunk_id"),
+            "document_id": metadata.get("document_id"),
+            "document_name": metadata.get("document_name", "unknown"),
+            "text": res.get("content", ""),
+            "vector_score": vector_score,
+            "graph_score": 0.0,
+            "vector_rank": rank,
+            "graph_rank": None,
+            "entities": [],
+            "prev_chunk": None,
+            "next_chunk": None,
+        })
+    return candidates
+
+
+def _graph_candidates(graph_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # entity-match counts or full-text BM25 scores, scaled to the best graph hit; unscored hits decay by rank
+    top = max((res.get("score") or 0 for res in graph_results), default=0)
+    candidates = []
+    for rank, res in enumerate(graph_results):
+        doc = res.get("document", {})
+        chunk = res.get("chunk", {})
+        ctx = res.get("context", {})
+        score = res.get("score") or 0
+        candidates.append({
+            "chunk_id": chunk.get("id"),
+            "document_id": doc.get("id"),
+            "document_name": doc.get("name", "unknown"),
+            "text": chunk.get("text") or doc.get("content_preview", ""),
+            "vector_score": 0.0,
+            "graph_score": score / top if top else 1.0 / (rank + 1),
+            "vector_rank": None,
+            "graph_rank": rank,
+            "entities": _entities(res),
+            "prev_chunk": ctx.get("prev_chunk"),
+            "next_chunk": ctx.get("next_chunk"),
+        })
+    return candidates
+
+
+def _best_rank(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _merge(into: Dict[str, Any], other: Dict[str, Any]):
+    into["vector_score"] = max(into["vector_score"], other["vector_score"])
+    into["graph_score"] = max(into["graph_score"], other["graph_score"])
+    into["vector_rank"] = _best_rank(into["vector_rank"], other["vector_rank"])
+    into["graph_rank"] = _best_rank(into["graph_rank"], other["graph_rank"])
+    into["document_id"] = into["document_id"] or other["document_id"]
+    names = {e["name"] for e in into["entities"]}
+    into["entities"] += [e for e in other["entities"] if e["name"] not in names]
+    into["prev_chunk"] = into["prev_chunk"] or other["prev_chunk"]
+    into["next_chunk"] = into["next_chunk"] or other["next_chunk"]
+    if len(other["text"]) > len(into["text"]):
+        into["text"] = other["text"]
+        into["words"] = other["words"]
+
+
+def _dedupe(candidates: List[Dict[str, Any]], threshold: float) -> Tuple[List[Dict[str, Any]], int]:
+    # both stores key chunks by the same content-addressed id, text overlap covers older data
+    unique, by_id, duplicates = [], {}, 0
+    for candidate in candidates:
+        candidate["words"] = _words(candidate["text"])
+        match = by_id.get(candidate["chunk_id"]) if candidate["chunk_id"] else None
+        if match is None:
+            match = next((kept for kept in unique
+                          if _overlap(kept["words"], candidate["words"]) >= threshold), None)
+        if match is None:
+            unique.append(candidate)
+            if candidate["chunk_id"]:
+                by_id[candidate["chunk_id"]] = candidate
+            continue
+        _merge(match, candidate)
+        duplicates += 1
+    return unique, duplicates
+
+
+def render_block(i: int, item: Dict[str, Any], with_context: bool = True) -> str:
+    lines = [f"[Source {i} from '{item['document_name']}']:", item["text"]]
+    if item["entities"]:
+        entity_text = ", ".join(
+            f"{e.get('name')} ({e.get('type')})" for e in item["entities"])
+        lines.append(f"Entities mentioned: {entity_text}")
+    if with_context and item["prev_chunk"]:
+        lines.append(f"[preceding context]: {item['prev_chunk']}")
+    if with_context and item["next_chunk"]:
+        lines.append(f"[following context]: {item['next_chunk']}")
+    return "\n".join(lines) + "\n"
+
+
+def fuse_results(
+    vector_results: List[Dict[str, Any]],
+    graph_results: List[Dict[str, Any]],
+    top_k: int,
+    method: Optional[str] = None,
+    vector_weight: float = CONTEXT_VECTOR_WEIGHT,
+    graph_weight: float = CONTEXT_GRAPH_WEIGHT,
+    rrf_k: int = RRF_K,
+    duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """
+    One ranked list out of both stores' hits. Hits are merged per chunk
+    (shared chunk id, text overlap for older data) and scored either by
+    reciprocal-rank fusion, sum of weight / (rrf_k + rank), or by the
+    weighted sum of normalized scores. Returns the top_k merged chunks,
+    each with its score, sources and per-store rank.
+    """
+    method = method or HYBRID_FUSION
+    if method not in FUSION_METHODS:
+        raise ValueError(
+            f"Unknown fusion method '{method}', expected one of {FUSION_METHODS}")
+    candidates, _ = _dedupe(
+        _vector_candidates(vector_results) + _graph_candidates(graph_results),
+        duplicate_threshold)
+    for candidate in candidates:
+        if method == "rrf":
+            candidate["score"] = rrf_score(
+                ((vector_weight, candidate["vector_rank"]),
+                 (graph_weight, candidate["graph_rank"])), rrf_k)
+        else:
+            candidate["score"] = (vector_weight * candidate["vector_score"]
+                                  + graph_weight * candidate["graph_score"])
+        candidate["sources"] = [store for store in ("vector", "graph")
+                                if candidate[f"{store}_rank"] is not None]
+        del candidate["words"]
+    candidates.sort(key=lambda c: c["score"], reverse=True)
+    return candidates[:top_k]
+
+
+def pack_context(
+    vector_results: List[Dict[str, Any]],
+    graph_results: List[Dict[str, Any]],
+    token_budget: Optional[int] = None,
+    vector_weight: float = CONTEXT_VECTOR_WEIGHT,
+    graph_weight: float = CONTEXT_GRAPH_WEIGHT,
+    duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD,
+    fused_results: Optional[List[Dict[str, Any]]] = None,
+) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Context assembly for the RAG prompt. Vector and graph hits are merged
+    into one candidate per chunk, ranked by the weighted sum of their
+    normalized scores and packed greedily into token_budget. A block that
+    does not fit is retried without its neighbouring-chunk context before
+    it is dropped, and smaller blocks further down can still fill the rest.
+    fused_results from fuse_results are packed in their own order instead.
+    Returns the rendered blocks and a report of packed and dropped tokens.
+    """
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    if fused_results is not None:
+        candidates, duplicates = fused_results, 0
+    else:
+        candidates, duplicates = _dedupe(
+            _vector_candidates(vector_results) + _graph_candidates(graph_results),
+            duplicate_threshold)
+        for candidate in candidates:
+            candidate["score"] = (vector_weight * candidate["vector_score"]
+                                  + graph_weight * candidate["graph_score"])
+        candidates.sort(key=lambda c: c["score"], reverse=True)
+
+    blocks, packed_tokens, dropped_tokens, dropped = [], 0, 0, 0
+    for candidate in candidates:
+        i = len(blocks) + 1
+        block = render_block(i, candidate)
+        tokens = count_tokens(block)
+        if token_budget and packed_tokens + tokens > token_budget:
+            trimmed = render_block(i, candidate, with_context=False)
+            trimmed_tokens = count_tokens(trimmed)
+            if packed_tokens + trimmed_tokens > token_budget:
+                dropped += 1
+                dropped_tokens += tokens
+                continue
+            dropped_tokens += tokens - trimmed_tokens
+            block, tokens = trimmed, trimmed_tokens
+        blocks.append(block)
+        packed_tokens += tokens
+
+    return blocks, {
+        "token_budget": token_budget,
+        "packed_tokens": packed_tokens,
+        "dropped_tokens": dropped_tokens,
+        "packed_items": len(blocks),
+        "dropped_items": dropped,
+        "duplicates_removed": duplicates,
+    }
@@ -0,0 +1,362 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import sqlite3
+import threading
+import json
+import time
+import re
+import os
+
+import numpy as np
+
+from logger import get_logger
+
+logger = get_logger("document_catalog")
+
+CATALOG_DB_PATH = os.environ.get("CATALOG_DB_PATH", "./app_data/catalog.db")
+CATALOG_PAGE_SIZE = int(os.environ.get("CATALOG_PAGE_SIZE", 50))
+CATALOG_MAX_PAGE_SIZE = int(os.environ.get("CATALOG_MAX_PAGE_SIZE", 500))
+
+# hamming distance between 64-bit SimHash signatures that still counts as the same document, 0 disables.
+# the 4 x 16-bit band index finds every match up to 3
+NEAR_DUPLICATE_MAX_DISTANCE = min(
+    3, int(os.environ.get("NEAR_DUPLICATE_MAX_DISTANCE", 3)))
+# shorter texts get no signature, a few edited words move their SimHash too far to be meaningful
+NEAR_DUPLICATE_MIN_WORDS = int(os.environ.get("NEAR_DUPLICATE_MIN_WORDS", 50))
+
+STORES = ("vector", "graph")
+SIMHASH_BANDS = 4
+SHINGLE_SIZE = 3
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+def _signed(value: int) -> int:
+    # sqlite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _bands(signature: int) -> List[int]:
+    return [(signature >> (16 * i)) & 0xFFFF for i in range(SIMHASH_BANDS)]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+class SimHasher:
+    """
+    64-bit SimHash over lowercased word 3-shingles. Text can be fed in
+    pieces (the streaming upload path), a word cut at the end of one piece
+    is held back and the last words start the shingles of the next.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(64, dtype=np.int64)
+        self.shingles = 0
+        self.words = 0
+        self.carry: List[str] = []
+        self.partial = ""
+
+    def feed(self, text: str):
+        text = self.partial + text
+        cut = re.search(r"\w+$", text)
+        self.partial = cut.group() if cut else ""
+        self._add(text[:cut.start()] if cut else text)
+
+    def _add(self, text: str):
+        words = [word.lower() for word in _WORD_RE.findall(text)]
+        if not words:
+            return
+        self.words += len(words)
+        words = self.carry + words
+        shingles = [" ".join(words[i:i + SHINGLE_SIZE])
+                    for i in range(len(words) - SHINGLE_SIZE + 1)]
+        self.carry = words[-(SHINGLE_SIZE - 1):]
+        if not shingles:
+            return
+        hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "little")
+                           for shingle in shingles], dtype=np.uint64)
+        bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+        self.counts += bits.sum(axis=0, dtype=np.int64)
+        self.shingles += len(shingles)
+
+    def digest(self, min_words: int = NEAR_DUPLICATE_MIN_WORDS) -> Optional[int]:
+        self._add(self.partial)
+        self.partial = ""
+        if self.words < min_words or not self.shingles:
+            return None
+        # a bit is set when most shingles set it
+        bits = self.counts * 2 > self.shingles
+        return int(sum(1 << i for i in np.flatnonzero(bits)))
+
+
+def simhash(text: str, min_words: int = NEAR_DUPLICATE_MIN_WORDS) -> Optional[int]:
+    hasher = SimHasher()
+    hasher.feed(text)
+    return hasher.digest(min_words)
+
+
+class DocumentCatalog:
+    """
+    One row per user document, written when a store finishes ingesting it and
+    removed on delete. Listing is an indexed range read instead of a scan of
+    every chunk in Chroma and every chunk and entity in Neo4j. Each store
+    reports in separately, in_vector and in_graph say which ones hold the
+    document. It is also the duplicate index for uploads: exact matches by
+    content hash, near duplicates by SimHash signature split into 16-bit
+    bands, so a lookup only compares against rows sharing a band. Users
+    listed in catalog_users have had their store contents backfilled, for
+    anyone else the catalog may be missing documents ingested before it.
+    """
+
+    def __init__(self, db_path: str = CATALOG_DB_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.backfilled = set()
+        self._init_schema()
+        logger.info(f"Document catalog ready at {db_path}")
+
+    def _init_schema(self):
+        with self.lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    user_id TEXT NOT NULL,
+                    document_id TEXT NOT NULL,
+                    document_name TEXT NOT NULL,
+                    original_filename TEXT,
+                    content_type TEXT,
+                    content_hash TEXT NOT NULL,
+                    description TEXT NOT NULL DEFAULT '',
+                    tags TEXT NOT NULL DEFAULT '[]',
+                    char_count INTEGER NOT NULL DEFAULT 0,
+                    chunk_count INTEGER NOT NULL DEFAULT 0,
+                    entity_count INTEGER NOT NULL DEFAULT 0,
+                    in_vector INTEGER NOT NULL DEFAULT 0,
+                    in_graph INTEGER NOT NULL DEFAULT 0,
+                    uploaded_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, document_id)
+                )
+                """
+            )
+            columns = {row["name"] for row in self.conn.execute(
+                "PRAGMA table_info(documents)")}
+            for column in ["simhash"] + [f"simhash_band{i}" for i in range(SIMHASH_BANDS)]:
+                if column not in columns:
+                    self.conn.execute(
+                        f"ALTER TABLE documents ADD COLUMN {column} INTEGER")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS document_tags (
+                    user_id TEXT NOT NULL,
+                    tag TEXT NOT NULL,
+                    document_id TEXT NOT NULL,
+                    PRIMARY KEY (user_id, tag, document_id)
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS catalog_users (
+                    user_id TEXT PRIMARY KEY,
+                    backfilled_at REAL NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS documents_uploaded ON documents (user_id, uploaded_at)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS documents_hash ON documents (user_id, content_hash)")
+            for i in range(SIMHASH_BANDS):
+                self.conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS documents_simhash_band{i} "
+                    f"ON documents (user_id, simhash_band{i})")
+
+    def is_backfilled(self, user_id: str) -> bool:
+        if user_id in self.backfilled:
+            return True
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM catalog_users WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            self.backfilled.add(user_id)
+        return row is not None
+
+    def mark_backfilled(self, user_id: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO catalog_users (user_id, backfilled_at) VALUES (?, ?)",
+                (user_id, time.time()))
+        self.backfilled.add(user_id)
+
+    def record(self, user_id: str, store: str, document_id: str, document_name: str,
+               content_hash: str, metadata: Dict[str, Any], char_count: int = 0,
+               chunk_count: int = 0, entity_count: int = 0, uploaded_at: Optional[float] = None,
+               simhash: Optional[int] = None):
+        """
+        Marks document_id as stored in store. The first store to report
+        creates the row, later ones set their flag and raise the counts
+        (both stores write the same chunks, only the graph counts entities,
+        as distinct entities the document mentions). uploaded_at defaults to
+        now, 0 records an unknown upload time.
+        """
+        if store not in STORES:
+            raise ValueError(f"Unknown store '{store}', expected one of {STORES}")
+        now = time.time()
+        tags = list(dict.fromkeys(metadata.get("tags") or []))
+        signature = [None] * (SIMHASH_BANDS + 1) if simhash is None else [
+            _signed(simhash), *_bands(simhash)]
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    f"""
+                    INSERT INTO documents (user_id, document_id, document_name, original_filename,
+                                           content_type, content_hash, description, tags, char_count,
+                                           chunk_count, entity_count, in_{store}, uploaded_at, updated_at,
+                                           simhash, simhash_band0, simhash_band1, simhash_band2,
+                                           simhash_band3)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id, document_id) DO UPDATE SET
+                        in_{store} = 1,
+                        char_count = MAX(char_count, excluded.char_count),
+                        chunk_count = MAX(chunk_count, excluded.chunk_count),
+                        entity_count = MAX(entity_count, excluded.entity_count),
+                        uploaded_at = MIN(uploaded_at, excluded.uploaded_at),
+                        updated_at = excluded.updated_at,
+                        simhash = COALESCE(simhash, excluded.simhash),
+                        simhash_band0 = COALESCE(simhash_band0, excluded.simhash_band0),
+                        simhash_band1 = COALESCE(simhash_band1, excluded.simhash_band1),
+                        simhash_band2 = COALESCE(simhash_band2, excluded.simhash_band2),
+                        simhash_band3 = COALESCE(simhash_band3, excluded.simhash_band3)
+                    """,
+                    (user_id, document_id, document_name,
+                     metadata.get("original_filename") or document_name,
+                     metadata.get("content_type") or "text/plain", content_hash,
+                     metadata.get("description") or "", json.dumps(tags), char_count,
+                     chunk_count, entity_count, now if uploaded_at is None else uploaded_at, now,
+                     *signature),
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO document_tags (user_id, tag, document_id) VALUES (?, ?, ?)",
+                    [(user_id, tag, document_id) for tag in tags],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, user_id: str, document_id: str) -> bool:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = self.conn.execute(
+                    "DELETE FROM documents WHERE user_id = ? AND document_id = ?",
+                    (user_id, document_id)).rowcount
+                self.conn.execute(
+                    "DELETE FROM document_tags WHERE user_id = ? AND document_id = ?",
+                    (user_id, document_id))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return deleted > 0
+
+    def find_duplicates(self, user_id: str, content_hash: str, simhash: Optional[int] = None,
+                        max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        For each store, the document it already holds with this content
+        ({"reason": "duplicate", ...}) or, failing that, the nearest one
+        within max_distance of simhash ({"reason": "near_duplicate", ...}),
+        None when the store has neither.
+        """
+        found: Dict[str, Optional[Dict[str, Any]]] = {store: None for store in STORES}
+        with self.lock:
+            exact = self.conn.execute(
+                "SELECT document_id, in_vector, in_graph FROM documents "
+                "WHERE user_id = ? AND content_hash = ?",
+                (user_id, content_hash)).fetchall()
+            candidates = []
+            if simhash is not None and max_distance > 0:
+                bands = _bands(simhash)
+                candidates = self.conn.execute(
+                    "SELECT document_id, simhash, in_vector, in_graph FROM documents WHERE user_id = ? AND ("
+                    + " OR ".join(f"simhash_band{i} = ?" for i in range(SIMHASH_BANDS)) + ")",
+                    (user_id, *bands)).fetchall()
+
+        for row in exact:
+            for store in STORES:
+                if row[f"in_{store}"] and found[store] is None:
+                    found[store] = {"reason": "duplicate", "document_id": row["document_id"]}
+
+        distances = [(hamming(simhash, row["simhash"]), row) for row in candidates]
+        near = sorted(((d, row) for d, row in distances if d <= max_distance), key=lambda t: t[0])
+        for distance, row in near:
+            for store in STORES:
+                if row[f"in_{store}"] and found[store] is None:
+                    found[store] = {"reason": "near_duplicate", "document_id": row["document_id"],
+                                    "distance": distance}
+        return found
+
+    @staticmethod
+    def _format_row(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "document_id": row["document_id"],
+            "document_name": row["document_name"],
+            "original_filename": row["original_filename"],
+            "content_type": row["content_type"],
+            "content_hash": row["content_hash"],
+            "description": row["description"],
+            "tags": json.loads(row["tags"]),
+            "char_count": row["char_count"],
+            "chunk_count": row["chunk_count"],
+            "entity_count": row["entity_count"],
+            "stores": [store for store in STORES if row[f"in_{store}"]],
+            "uploaded_at": _iso(row["uploaded_at"]),
+        }
+
+    def list(self, user_id: str, limit: int = CATALOG_PAGE_SIZE, offset: int = 0,
+             tags: Optional[List[str]] = None, uploaded_after: Optional[float] = None,
+             uploaded_before: Optional[float] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        # newest first, tags must all be present, returns the total match count and one page
+        clauses, params = ["d.user_id = ?"], [user_id]
+        if uploaded_after is not None:
+            clauses.append("d.uploaded_at >= ?")
+            params.append(uploaded_after)
+        if uploaded_before is not None:
+            clauses.append("d.uploaded_at < ?")
+            params.append(uploaded_before)
+        tags = list(dict.fromkeys(tags or []))
+        if tags:
+            clauses.append(
+                f"""d.document_id IN (
+                    SELECT document_id FROM document_tags
+                    WHERE user_id = ? AND tag IN ({', '.join('?' * len(tags))})
+                    GROUP BY document_id HAVING COUNT(*) = ?)""")
+            params.extend([user_id, *tags, len(tags)])
+        where = " AND ".join(clauses)
+        limit = max(1, min(limit, CATALOG_MAX_PAGE_SIZE))
+        with self.lock:
+            total = self.conn.execute(
+                f"SELECT COUNT(*) FROM documents d WHERE {where}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT * FROM documents d WHERE {where} "
+                "ORDER BY d.uploaded_at DESC, d.document_id LIMIT ? OFFSET ?",
+                (*params, limit, max(0, offset)),
+            ).fetchall()
+        return total, [self._format_row(row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
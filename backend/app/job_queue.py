@@ -0,0 +1,392 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+import sqlite3
+import threading
+import json
+import time
+import uuid
+import os
+
+from logger import get_logger
+
+logger = get_logger("job_queue")
+
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "./app_data/jobs.db")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_DELAY_SECONDS = float(os.environ.get("JOB_RETRY_DELAY_SECONDS", 5))
+JOB_POLL_INTERVAL_SECONDS = float(
+    os.environ.get("JOB_POLL_INTERVAL_SECONDS", 1))
+# finished jobs keep their metadata and stage results, the uploaded content is dropped.
+# a running job whose lease expired belongs to a crashed worker and is claimed again,
+# workers renew the lease of the job they run every third of it
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 900))
+
+STAGES = ("vector", "graph")
+DONE_STAGE_STATUSES = ("success", "skipped")
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class JobQueue:
+    def __init__(
+        self,
+        db_path: str = JOB_DB_PATH,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retry_delay: float = JOB_RETRY_DELAY_SECONDS,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+    ):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._init_schema()
+        logger.info(f"Job queue ready at {db_path}")
+
+    def _init_schema(self):
+        with self.lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    document_name TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stages TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    worker_id TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    next_run_at REAL NOT NULL,
+                    lease_expires_at REAL
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, next_run_at)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, created_at)")
+
+    def enqueue(self, user_id: str, document_name: str, content: str, metadata: Dict[str, Any]) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        stages = {stage: {"status": "pending"} for stage in STAGES}
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT INTO jobs (id, user_id, document_name, content, metadata, status, stages,
+                                  max_attempts, created_at, updated_at, next_run_at)
+                VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)
+                """,
+                (job_id, user_id, document_name, content, json.dumps(metadata),
+                 json.dumps(stages), self.max_attempts, now, now, now),
+            )
+        logger.info(f"Queued job {job_id} for '{document_name}' (user {user_id})")
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # a job that took its worker down on its last attempt is not handed to another one
+                exhausted = self.conn.execute(
+                    """
+                    UPDATE jobs
+                    SET status = 'failed', finished_at = ?, updated_at = ?, lease_expires_at = NULL,
+                        content = '', last_error = COALESCE(last_error, 'worker lost on the last attempt')
+                    WHERE status = 'running' AND lease_expires_at < ? AND attempts >= max_attempts
+                    """,
+                    (now, now, now),
+                ).rowcount
+                if exhausted:
+                    logger.warning(
+                        f"{exhausted} jobs failed after their lease expired on the last attempt")
+                row = self.conn.execute(
+                    """
+                    SELECT id, status FROM jobs
+                    WHERE (status = 'queued' AND next_run_at <= ?)
+                       OR (status = 'running' AND lease_expires_at < ?)
+                    ORDER BY next_run_at
+                    LIMIT 1
+                    """,
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                if row["status"] == "running":
+                    logger.warning(
+                        f"Job {row['id']} lease expired, resuming on {worker_id}")
+                self.conn.execute(
+                    """
+                    UPDATE jobs
+                    SET status = 'running', worker_id = ?, attempts = attempts + 1,
+                        lease_expires_at = ?, started_at = COALESCE(started_at, ?), updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (worker_id, now + self.lease_seconds, now, now, row["id"]),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"], include_content=True)
+
+    def extend_lease(self, job_id: str, worker_id: str) -> bool:
+        # False once the job is no longer running on worker_id, e.g. its lease expired and it was re-claimed
+        now = time.time()
+        with self.lock:
+            extended = self.conn.execute(
+                """
+                UPDATE jobs SET lease_expires_at = ?, updated_at = ?
+                WHERE id = ? AND status = 'running' AND worker_id = ?
+                """,
+                (now + self.lease_seconds, now, job_id, worker_id),
+            ).rowcount
+        return extended > 0
+
+    def update_stage(self, job_id: str, stage: str, state: Dict[str, Any]):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            stages = json.loads(row["stages"])
+            stages[stage] = state
+            self.conn.execute(
+                "UPDATE jobs SET stages = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(stages, default=str), time.time(), job_id),
+            )
+
+    def complete(self, job_id: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                """
+                UPDATE jobs SET status = 'succeeded', last_error = NULL, finished_at = ?,
+                                updated_at = ?, lease_expires_at = NULL, content = ''
+                WHERE id = ?
+                """,
+                (now, now, job_id),
+            )
+
+    def fail(self, job_id: str, error: str) -> str:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return "missing"
+            if row["attempts"] >= row["max_attempts"]:
+                status, next_run_at, finished_at = "failed", now, now
+            else:
+                # exponential backoff before the next attempt
+                status = "queued"
+                next_run_at = now + self.retry_delay * \
+                    2 ** (row["attempts"] - 1)
+                finished_at = None
+            self.conn.execute(
+                """
+                UPDATE jobs SET status = ?, last_error = ?, next_run_at = ?, finished_at = ?,
+                                updated_at = ?, lease_expires_at = NULL,
+                                content = CASE WHEN ? = 'failed' THEN '' ELSE content END
+                WHERE id = ?
+                """,
+                (status, error, next_run_at, finished_at, now, status, job_id),
+            )
+        return status
+
+    def release(self, job_id: str):
+        # graceful shutdown, the attempt doesn't count against the job
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                """
+                UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0),
+                                next_run_at = ?, updated_at = ?, lease_expires_at = NULL
+                WHERE id = ? AND status = 'running'
+                """,
+                (now, now, job_id),
+            )
+
+    @staticmethod
+    def _format_row(row, include_content: bool = False) -> Dict[str, Any]:
+        job = {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "document_name": row["document_name"],
+            "status": row["status"],
+            "stages": json.loads(row["stages"]),
+            "attempts": row["attempts"],
+            "max_attempts": row["max_attempts"],
+            "last_error": row["last_error"],
+            "worker_id": row["worker_id"],
+            "created_at": _iso(row["created_at"]),
+            "started_at": _iso(row["started_at"]),
+            "finished_at": _iso(row["finished_at"]),
+            "next_run_at": _iso(row["next_run_at"]) if row["status"] == "queued" else None,
+        }
+        if row["started_at"]:
+            job["queue_wait_ms"] = round(
+                (row["started_at"] - row["created_at"]) * 1000, 1)
+        if row["finished_at"] and row["started_at"]:
+            job["duration_ms"] = round(
+                (row["finished_at"] - row["started_at"]) * 1000, 1)
+        if include_content:
+            job["content"] = row["content"]
+            job["metadata"] = json.loads(row["metadata"])
+        return job
+
+    def get(self, job_id: str, include_content: bool = False) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._format_row(row, include_content) if row else None
+
+    def list(self, user_id: Optional[str] = None, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        if user_id:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [self._format_row(row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class JobWorkerPool:
+    def __init__(self, queue: JobQueue, repo, workers: int = JOB_WORKERS,
+                 poll_interval: float = JOB_POLL_INTERVAL_SECONDS):
+        self.queue = queue
+        self.repo = repo
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.tasks = []
+
+    def start(self):
+        for i in range(self.workers):
+            worker_id = f"worker-{i}-{uuid.uuid4().hex[:8]}"
+            self.tasks.append(asyncio.create_task(self._worker(worker_id)))
+        logger.info(f"Started {self.workers} ingestion workers")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _worker(self, worker_id: str):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim, worker_id)
+            except Exception as e:
+                logger.error(f"{worker_id} failed to claim a job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            heartbeat = asyncio.create_task(self._renew_lease(job["id"], worker_id))
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.queue.release, job["id"])
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} crashed: {e}", exc_info=True)
+                await asyncio.to_thread(self.queue.fail, job["id"], str(e))
+            finally:
+                heartbeat.cancel()
+
+    async def _renew_lease(self, job_id: str, worker_id: str):
+        # keeps a long job from being claimed by a second worker while this one still writes
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                extended = await asyncio.to_thread(self.queue.extend_lease, job_id, worker_id)
+            except Exception as e:
+                logger.error(f"{worker_id} failed to renew the lease of job {job_id}: {e}")
+                continue
+            if not extended:
+                logger.warning(f"{worker_id} lost the lease of job {job_id}")
+                return
+
+    async def _run(self, job: Dict[str, Any]):
+        logger.info(
+            f"Running job {job['id']} for '{job['document_name']}' (attempt {job['attempts']})")
+        runners = {
+            "vector": self.repo.aadd_to_vector,
+            "graph": self.repo.aadd_to_graph,
+        }
+        # stages finished by an earlier attempt are not redone
+        pending = [stage for stage in STAGES
+                   if job["stages"].get(stage, {}).get("status") not in DONE_STAGE_STATUSES]
+        if not pending:
+            await asyncio.to_thread(self.queue.complete, job["id"])
+            return
+        # chunked once for both stages, the job id doubles as document id so a
+        # stage retried on a later attempt lands under the same document
+        prepared = await self.repo.aprepare_document(
+            job["user_id"], job["content"], document_id=job["id"])
+        # an earlier attempt may have committed a stage without recording it
+        prepared["resume"] = job["attempts"] > 1
+        errors = await asyncio.gather(*(
+            self._run_stage(job, stage, runners[stage], prepared) for stage in pending))
+        errors = [error for error in errors if error]
+
+        if errors:
+            status = await asyncio.to_thread(self.queue.fail, job["id"], "; ".join(errors))
+            logger.warning(f"Job {job['id']} failed ({status}): {errors}")
+        else:
+            await asyncio.to_thread(self.queue.complete, job["id"])
+            logger.info(f"Job {job['id']} finished")
+
+    async def _run_stage(self, job: Dict[str, Any], stage: str, runner,
+                         prepared: Dict[str, Any]) -> Optional[str]:
+        await asyncio.to_thread(self.queue.update_stage, job["id"], stage, {"status": "running"})
+        start = time.perf_counter()
+        try:
+            result = await runner(job["user_id"], job["document_name"], job["content"],
+                                  job["metadata"], prepared)
+            state = {
+                "status": "skipped" if result.get("skipped") else "success",
+                "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                "result": result,
+            }
+            error = None
+        except Exception as e:
+            logger.error(
+                f"Job {job['id']} stage {stage} failed: {e}", exc_info=True)
+            error = f"{stage}: {e}"
+            state = {
+                "status": "error",
+                "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                "error": str(e),
+            }
+        await asyncio.to_thread(self.queue.update_stage, job["id"], stage, state)
+        return error
@@ -0,0 +1,136 @@
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import os
+
+from logger import get_logger
+
+logger = get_logger("llm_cache")
+
+# opt-in, a cached answer is replayed verbatim for identical prompts
+LLM_CACHE_ENABLED = os.environ.get(
+    "LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "./app_data/llm_cache.db")
+LLM_CACHE_TTL_SECONDS = float(
+    os.environ.get("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+# sampling above this temperature is meant to vary, those calls always go upstream
+LLM_CACHE_MAX_TEMPERATURE = float(
+    os.environ.get("LLM_CACHE_MAX_TEMPERATURE", 0.5))
+
+
+def completion_key(model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> str:
+    messages_hash = hashlib.sha256(json.dumps(
+        messages, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    return hashlib.sha256(
+        f"{model}\0{messages_hash}\0{max_tokens}\0{temperature!r}".encode()).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent completion cache in SQLite keyed by model id, a hash of the
+    messages, max_tokens and temperature. Entries expire after ttl_seconds,
+    past max_entries the least recently used ones are evicted.
+    """
+
+    def __init__(self, db_path: str = LLM_CACHE_PATH, ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, max_temperature: float = LLM_CACHE_MAX_TEMPERATURE):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_temperature = max_temperature
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used_at)")
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.expired = 0
+        self.evictions = 0
+        logger.info(f"LLM response cache ready at {db_path}")
+
+    def cacheable(self, temperature: float) -> bool:
+        if temperature > self.max_temperature:
+            with self.lock:
+                self.bypassed += 1
+            return False
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            content, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self.conn.execute(
+                    "DELETE FROM completions WHERE key = ?", (key,))
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE completions SET last_used_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return content
+
+    def put(self, key: str, model: str, content: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, content, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        self.conn.execute(
+            "DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self.conn.execute(
+            "SELECT COUNT(*) FROM completions").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY last_used_at LIMIT ?)",
+                (count - self.max_entries,))
+            self.evictions += count - self.max_entries
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            entries = self.conn.execute(
+                "SELECT COUNT(*) FROM completions").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": entries,
+                "max_temperature": self.max_temperature,
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,12 +1,19 @@
 from logger import get_logger
+import asyncio
+import json
 import time
-from fastapi import FastAPI, UploadFile, File, Form
-from typing import Optional, List
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from typing import Optional, List, Literal
 from datetime import datetime
 from contextlib import asynccontextmanager
 from storage_repository import StorageRepository
+from job_queue import JobQueue, JobWorkerPool
+from upload_stream import UPLOAD_STREAM_THRESHOLD_BYTES
+from document_catalog import CATALOG_PAGE_SIZE, CATALOG_MAX_PAGE_SIZE
 from models import *
-from prompt_service import router as prompt_router
+from prompt_service import router as prompt_router, aclose_client, llm_cache_stats
+from metrics import REQUEST_LATENCY, SLOW_REQUEST_MS, format_spans, server_timing, start_trace
 
 logger = get_logger("main")
 
@@ -15,8 +22,15 @@ logger = get_logger("main")
 async def lifespan(app: FastAPI):
     repo = StorageRepository()
     app.state.repo = repo
+    jobs = JobQueue()
+    app.state.jobs = jobs
+    workers = JobWorkerPool(jobs, repo)
+    workers.start()
     yield
-    repo.close()
+    await workers.stop()
+    jobs.close()
+    await repo.aclose()
+    await aclose_client()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -25,26 +39,113 @@ app.include_router(prompt_router)
 
 @app.middleware("http")
 async def log_requests(request, call_next):
-    start = time.time()
-    logger.info(f"→ {request.method} {request.url.path}")
-    response = await call_next(request)
-    duration = (time.time() - start) * 1000
-    logger.info(
-        f"{request.method} {request.url.path} {response.status_code} {duration:.1f}ms")
+    trace = start_trace()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        duration = time.perf_counter() - start
+        # route template instead of the raw path, ids in paths would explode the label set
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            request.method, route.path if route else "unmatched", status).observe(duration)
+    # streamed bodies are still running here, their spans only reach the histograms
+    response.headers["Server-Timing"] = server_timing(trace)
+    response.headers["X-Trace-Id"] = trace["id"]
+    if duration * 1000 >= SLOW_REQUEST_MS:
+        logger.warning("slow request %s %s %s %.1fms trace=%s %s", request.method, request.url.path,
+                       status, duration * 1000, trace["id"], format_spans(trace["spans"]))
+    else:
+        logger.debug("%s %s %s %.1fms trace=%s", request.method, request.url.path,
+                     status, duration * 1000, trace["id"])
     return response
 
 
+def _skip_message(result) -> str:
+    message = f"duplicate: {result.get('reason')}"
+    return f"{message} of {result['duplicate_of']}" if result.get("duplicate_of") else message
+
+
+def _vector_upload_response(user_id: str, vector_result) -> DocumentUploadResponse:
+    if vector_result.get("skipped"):
+        return DocumentUploadResponse(
+            document_id="skipped",
+            user_id=user_id,
+            kb_type=KnowledgeBaseType.VECTOR,
+            status="skipped",
+            message=_skip_message(vector_result),
+            timestamp=datetime.now(),
+            chunks_processed=0
+        )
+    return DocumentUploadResponse(
+        document_id=vector_result["document_id"],
+        user_id=user_id,
+        kb_type=KnowledgeBaseType.VECTOR,
+        status="success",
+        message="document added to vector database",
+        timestamp=datetime.now(),
+        chunks_processed=vector_result["chunks_processed"]
+    )
+
+
+def _graph_upload_response(user_id: str, graph_result) -> DocumentUploadResponse:
+    return DocumentUploadResponse(
+        document_id=graph_result["document_id"] or "skipped",
+        user_id=user_id,
+        kb_type=KnowledgeBaseType.GRAPH,
+        status="skipped" if graph_result.get("skipped") else "success",
+        message=(
+            _skip_message(graph_result) if graph_result.get("skipped")
+            else "document added to graph database"),
+        timestamp=datetime.now(),
+        entities_extracted=graph_result["entities_extracted"]
+    )
+
+
+def _upload_error_response(user_id: str, kb_type: KnowledgeBaseType, document_name: str, error: Exception) -> DocumentUploadResponse:
+    logger.error(
+        f"{kb_type.value} upload failed for '{document_name}': {error}",
+        exc_info=(type(error), error, error.__traceback__))
+    return DocumentUploadResponse(
+        document_id="error",
+        user_id=user_id,
+        kb_type=kb_type,
+        status="error",
+        message=str(error),
+        timestamp=datetime.now()
+    )
+
+
+def _upload_responses(user_id: str, document_name: str, vector_result, graph_result) -> List[DocumentUploadResponse]:
+    responses = []
+    if isinstance(vector_result, Exception):
+        responses.append(_upload_error_response(
+            user_id, KnowledgeBaseType.VECTOR, document_name, vector_result))
+    else:
+        responses.append(_vector_upload_response(user_id, vector_result))
+
+    if isinstance(graph_result, Exception):
+        responses.append(_upload_error_response(
+            user_id, KnowledgeBaseType.GRAPH, document_name, graph_result))
+    else:
+        responses.append(_graph_upload_response(user_id, graph_result))
+
+    return responses
+
+
 @app.post("/upload", response_model=List[DocumentUploadResponse])
 async def upload_to_both_dbs(
     user_id: str = Form(...),
     document_name: str = Form(...),
     file: UploadFile = File(...),
     tags: str = Form(""),
-    description: Optional[str] = Form(None)
+    description: Optional[str] = Form(None),
+    background_graph: bool = Form(False),
+    queued: bool = Form(False),
+    stream: bool = Form(False)
 ):
-    responses = []
-    content = await file.read()
-    text_content = content.decode('utf-8')
     tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()]
     logger.info(f"Received upload: {file.filename} from user {user_id}")
 
@@ -54,89 +155,236 @@ async def upload_to_both_dbs(
         "original_filename": file.filename,
         "content_type": file.content_type or "text/plain"
     }
+    repo = app.state.repo
 
-    try:
-        vector_result = app.state.repo.add_to_vector(
-            user_id=user_id,
-            document_name=document_name,
-            content=text_content,
-            metadata=metadata
-        )
-        if vector_result.get("skipped"):
-            responses.append(DocumentUploadResponse(
-                document_id="skipped",
-                user_id=user_id,
-                kb_type=KnowledgeBaseType.VECTOR,
-                status="skipped",
-                message=f"duplicate: {vector_result.get('reason')}",
-                timestamp=datetime.now(),
-                chunks_processed=0
-            ))
-        else:
-            responses.append(DocumentUploadResponse(
-                document_id=vector_result["document_id"],
+    if not (queued or background_graph) and (stream or (file.size or 0) > UPLOAD_STREAM_THRESHOLD_BYTES):
+        # incremental decode + chunk generator, the whole file is never held in memory
+        results = await repo.aadd_stream(user_id, document_name, file.file, metadata)
+        return _upload_responses(user_id, document_name, results["vector"], results["graph"])
+
+    content = await file.read()
+    text_content = content.decode('utf-8')
+
+    if queued:
+        # only enqueue, ingestion workers do the chunking, embedding, NER and writes
+        job_id = await asyncio.to_thread(
+            app.state.jobs.enqueue, user_id, document_name, text_content, metadata)
+        return [
+            DocumentUploadResponse(
+                document_id="queued",
                 user_id=user_id,
-                kb_type=KnowledgeBaseType.VECTOR,
-                status="success",
-                message="document added to vector database",
+                kb_type=kb_type,
+                status="queued",
+                message=f"queued as job {job_id}, poll /jobs/{job_id}",
                 timestamp=datetime.now(),
-                chunks_processed=vector_result["chunks_processed"]
-            ))
-    except Exception as e:
-        logger.error(
-            f"vector upload failed for '{document_name}': {e}", exc_info=True)
-        responses.append(DocumentUploadResponse(
-            document_id="error",
-            user_id=user_id,
-            kb_type=KnowledgeBaseType.VECTOR,
-            status="error",
-            message=str(e),
-            timestamp=datetime.now()
-        ))
+                job_id=job_id
+            )
+            for kb_type in (KnowledgeBaseType.VECTOR, KnowledgeBaseType.GRAPH)
+        ]
 
-    try:
-        graph_result = app.state.repo.add_to_graph(
-            user_id=user_id,
-            document_name=document_name,
-            content=text_content,
-            metadata=metadata
-        )
-        responses.append(DocumentUploadResponse(
-            document_id=graph_result["document_id"],
+    # chunked once, both stores get the same chunks and chunk ids
+    prepared = await repo.aprepare_document(user_id, text_content)
+
+    if background_graph:
+        # document is searchable once the vector write commits, graph ingest is polled
+        try:
+            vector_result = await repo.aadd_to_vector(user_id, document_name, text_content, metadata, prepared)
+            vector_response = _vector_upload_response(user_id, vector_result)
+        except Exception as e:
+            return [_upload_error_response(user_id, KnowledgeBaseType.VECTOR, document_name, e)]
+
+        ingest_id = repo.start_graph_ingest(
+            user_id, document_name, text_content, metadata, prepared)
+        return [vector_response, DocumentUploadResponse(
+            document_id="pending",
             user_id=user_id,
             kb_type=KnowledgeBaseType.GRAPH,
-            status="success",
-            message="document added to graph database",
+            status="pending",
+            message=f"graph ingest running in background, poll /upload/status/{ingest_id}",
             timestamp=datetime.now(),
-            entities_extracted=graph_result["entities_extracted"]
-        ))
-    except Exception as e:
-        logger.error(
-            f"graph upload failed for '{document_name}': {e}", exc_info=True)
-        responses.append(DocumentUploadResponse(
-            document_id="error",
-            user_id=user_id,
-            kb_type=KnowledgeBaseType.GRAPH,
-            status="error",
-            message=str(e),
-            timestamp=datetime.now()
-        ))
+            job_id=ingest_id
+        )]
 
-    return responses
+    vector_result, graph_result = await asyncio.gather(
+        repo.aadd_to_vector(user_id, document_name, text_content, metadata, prepared),
+        repo.aadd_to_graph(user_id, document_name, text_content, metadata, prepared),
+        return_exceptions=True
+    )
+
+    return _upload_responses(user_id, document_name, vector_result, graph_result)
+
+
+def _batch_document_result(result) -> BatchDocumentResult:
+    vector, graph = result["vector"] or {}, result["graph"] or {}
+    errors = [f"{store}: {outcome['error']}" for store, outcome in (
+        ("vector", vector), ("graph", graph)) if "error" in outcome]
+    skipped = [outcome for outcome in (vector, graph) if outcome.get("skipped")]
+
+    if errors:
+        status, message = "error", "; ".join(errors)
+    elif len(skipped) == 2:
+        status, message = "skipped", _skip_message(vector)
+    else:
+        status, message = "success", "document added to " + " and ".join(
+            f"{store} database" for store, outcome in (("vector", vector), ("graph", graph))
+            if not outcome.get("skipped"))
+
+    return BatchDocumentResult(
+        document_name=result["document_name"],
+        content_hash=result["content_hash"],
+        status=status,
+        message=message,
+        vector_document_id=vector.get("document_id"),
+        graph_document_id=graph.get("document_id"),
+        chunks_processed=vector.get("chunks_processed"),
+        entities_extracted=graph.get("entities_extracted"),
+    )
+
+
+@app.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_batch(
+    user_id: str = Form(...),
+    files: List[UploadFile] = File(default=[]),
+    jsonl: Optional[UploadFile] = File(None),
+    tags: str = Form(""),
+    description: Optional[str] = Form(None)
+):
+    """
+    Bulk ingestion for one user. Documents come from plain text files (named
+    after the file) and/or a JSONL stream with one
+    {"document_name", "content", "tags"?, "description"?} object per line.
+    """
+    tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()]
+    documents = []
+
+    for file in files:
+        content = (await file.read()).decode('utf-8')
+        documents.append({
+            "document_name": file.filename,
+            "content": content,
+            "metadata": {
+                "tags": tag_list,
+                "description": description or "",
+                "original_filename": file.filename,
+                "content_type": file.content_type or "text/plain"
+            }
+        })
+
+    if jsonl is not None:
+        for line_no, line in enumerate((await jsonl.read()).decode('utf-8').splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                name = record["document_name"]
+                content = record["content"]
+            except (ValueError, KeyError) as e:
+                raise HTTPException(
+                    status_code=400, detail=f"invalid JSONL record on line {line_no}: {e}")
+            documents.append({
+                "document_name": name,
+                "content": content,
+                "metadata": {
+                    "tags": record.get("tags") or tag_list,
+                    "description": record.get("description") or description or "",
+                    "original_filename": name,
+                    "content_type": "text/plain"
+                }
+            })
+
+    if not documents:
+        raise HTTPException(
+            status_code=400, detail="no documents in batch, send files and/or a jsonl stream")
+
+    logger.info(
+        f"Received batch upload of {len(documents)} documents from user {user_id}")
+    batch = await app.state.repo.aadd_batch(user_id, documents)
+    results = [_batch_document_result(result) for result in batch["results"]]
+
+    return BatchUploadResponse(
+        user_id=user_id,
+        documents_received=len(documents),
+        documents_stored=sum(r.status == "success" for r in results),
+        documents_skipped=sum(r.status == "skipped" for r in results),
+        documents_failed=sum(r.status == "error" for r in results),
+        timestamp=datetime.now(),
+        timings_ms=batch["timings_ms"],
+        results=results
+    )
+
+
+@app.get("/upload/status/{ingest_id}")
+async def upload_status(ingest_id: str):
+    status = app.state.repo.graph_ingest_status(ingest_id)
+    if status is None:
+        raise HTTPException(
+            status_code=404, detail=f"unknown ingest id '{ingest_id}'")
+    return status
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(app.state.jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"unknown job id '{job_id}'")
+    return job
+
+
+@app.get("/jobs")
+async def list_jobs(user_id: Optional[str] = None, status: Optional[str] = None, limit: int = 50):
+    jobs = await asyncio.to_thread(app.state.jobs.list, user_id, status, limit)
+    return {"jobs_count": len(jobs), "jobs": jobs}
 
 
 @app.get("/query/vector")
-async def query_vector_db(user_id: str, query: str, top_k: int = 5):
-    results = app.state.repo.query_vector(user_id, query, top_k)
+async def query_vector_db(
+    user_id: str,
+    query: str,
+    top_k: int = 5,
+    mode: Optional[Literal["batched", "per_term", "lexical", "fused"]] = None
+):
+    results = await app.state.repo.aquery_vector(user_id, query, top_k, mode)
     return {"user_id": user_id, "query": query, "results_count": len(results), "results": results}
 
 
+@app.get("/query/hybrid")
+async def query_hybrid(
+    user_id: str,
+    query: str,
+    top_k: int = 5,
+    mode: Optional[Literal["batched", "per_term", "lexical", "fused"]] = None,
+    fusion: Optional[Literal["rrf", "weighted"]] = None
+):
+    retrieved = await app.state.repo.ahybrid_retrieve(user_id, query, top_k, mode, fusion)
+    return {
+        "user_id": user_id,
+        "query": query,
+        "fusion": retrieved["fusion"],
+        "results_count": len(retrieved["results"]),
+        "results": retrieved["results"],
+        "errors": retrieved["errors"],
+        "timings_ms": retrieved["timings_ms"],
+    }
+
+
 @app.get("/query/graph")
 async def query_graph_db(user_id: str, query: str):
-    results = app.state.repo.query_graph(user_id, query)
+    results = await app.state.repo.aquery_graph(user_id, query)
     return {"user_id": user_id, "query": query, "results_count": len(results), "results": results}
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = await asyncio.to_thread(app.state.repo.cache_stats)
+    stats["llm"] = await asyncio.to_thread(llm_cache_stats)
+    return stats
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/")
 async def root():
     return {"message": "Multi-KB RAG API is running"}
@@ -151,12 +399,76 @@ async def health_check():
     }
 
 
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str, user_id: str):
+    deleted = await app.state.repo.adelete_document(user_id, document_id)
+    if not any(deleted.values()):
+        raise HTTPException(
+            status_code=404, detail=f"unknown document id '{document_id}'")
+    return {"user_id": user_id, "document_id": document_id, "deleted": deleted}
+
+
 @app.get("/list_documents")
-async def list_documents(user_id: str):
-    vector_docs = app.state.repo.vector.list_documents(user_id)
-    graph_docs = app.state.repo.graph.list_documents(user_id)
+async def list_documents(
+    user_id: str,
+    limit: int = Query(CATALOG_PAGE_SIZE, ge=1, le=CATALOG_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    tags: str = "",
+    uploaded_after: Optional[datetime] = None,
+    uploaded_before: Optional[datetime] = None
+):
+    """
+    Newest first from the document catalog. tags is comma separated, a
+    document must carry all of them. uploaded_after/uploaded_before take
+    ISO timestamps.
+    """
+    tag_list = [tag.strip() for tag in tags.split(",") if tag.strip()]
+    total, documents = await app.state.repo.alist_documents(
+        user_id, limit=limit, offset=offset, tags=tag_list,
+        uploaded_after=uploaded_after.timestamp() if uploaded_after else None,
+        uploaded_before=uploaded_before.timestamp() if uploaded_before else None)
     return {
         "user_id": user_id,
-        "vector_documents": vector_docs,
-        "graph_documents": graph_docs
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + len(documents) if offset + len(documents) < total else None,
+        "documents": documents
     }
+
+
+@app.post("/list_documents/rebuild")
+async def rebuild_document_catalog(user_id: str):
+    # one-off backfill from full store scans for documents uploaded before the catalog
+    listed = await app.state.repo.arebuild_catalog(user_id)
+    return {"user_id": user_id, "documents_scanned": listed}
+
+
+@app.post("/query/lexical/rebuild")
+async def rebuild_lexical_index(user_id: str):
+    # one-off backfill of the BM25 index from the user's vector store chunks
+    indexed = await app.state.repo.arebuild_lexical_index(user_id)
+    return {"user_id": user_id, "chunks_indexed": indexed}
+
+
+@app.post("/graph/adjacency/backfill")
+async def backfill_entity_adjacency():
+    # one-off migration, fills the neighbor lists query expansion reads for entities ingested before them
+    updated = await app.state.repo.abackfill_adjacency()
+    return {"entities_updated": updated}
+
+
+@app.post("/graph/chunk_owners/backfill")
+async def backfill_chunk_owners():
+    # one-off migration, chunks ingested before they carried an owner key are missing from the full-text fallback
+    updated = await app.state.repo.abackfill_chunk_owners()
+    return {"chunks_updated": updated}
+
+
+@app.post("/graph/entity_scope/migrate")
+async def migrate_entity_scope(user_id: Optional[str] = None):
+    # moves existing documents onto user-scoped entities, needs GRAPH_ENTITY_SCOPE=user
+    try:
+        return await app.state.repo.amigrate_entity_scope(user_id)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
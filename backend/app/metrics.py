@@ -0,0 +1,153 @@
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Dict, Iterator, List, Optional
+import asyncio
+import contextvars
+import time
+import uuid
+import weakref
+import os
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# requests slower than this are logged at WARNING together with their span breakdown
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 2000))
+# spans kept per request trace, the histograms see every span regardless
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", 200))
+
+# LLM calls sit at the far end of the default buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_LATENCY = Histogram(
+    "rag_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram(
+    "rag_stage_duration_seconds", "Latency of one storage or LLM stage",
+    ["stage"], buckets=LATENCY_BUCKETS)
+CHUNKS_INGESTED = Counter(
+    "rag_chunks_ingested_total", "Chunks written", ["store"])
+ENTITIES_INGESTED = Counter(
+    "rag_entities_ingested_total", "Entity mentions written to the graph")
+QUERY_CACHE_HITS = Counter(
+    "rag_query_cache_hits_total", "Query results served from the query cache", ["store"])
+QUERY_CACHE_MISSES = Counter(
+    "rag_query_cache_misses_total", "Query cache lookups that ran the query, stale entries included",
+    ["store"])
+POOL_SIZE = Gauge("rag_pool_size", "Workers or connections in a pool", ["pool"])
+POOL_BUSY = Gauge("rag_pool_busy", "Pool slots currently running work", ["pool"])
+POOL_QUEUED = Gauge("rag_pool_queued", "Work submitted to a pool and not started yet", ["pool"])
+
+_trace: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "rag_trace", default=None)
+_parent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "rag_span_parent", default=None)
+_pool_names: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+class Span:
+    def __init__(self, stage: str, attrs: Dict[str, Any]):
+        self.stage = stage
+        self.attrs = attrs
+        self.duration_ms = 0.0
+
+
+def start_trace() -> Dict[str, Any]:
+    # the trace dict is shared by reference, so spans recorded in copied contexts (tasks, pool threads) land in it
+    trace = {"id": uuid.uuid4().hex[:16], "started": time.perf_counter(), "spans": []}
+    _trace.set(trace)
+    return trace
+
+
+@contextmanager
+def span(stage: str, **attrs: Any) -> Iterator[Span]:
+    """
+    Times one stage into the stage histogram and, inside a request, appends
+    it to the request's trace with its parent stage and offset. The yielded
+    Span takes extra attributes and carries duration_ms once the block is done.
+    """
+    current = Span(stage, attrs)
+    parent = _parent.get()
+    token = _parent.set(stage)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        _parent.reset(token)
+        current.duration_ms = record_stage(stage, start, parent, **current.attrs)
+
+
+def record_stage(stage: str, start: float, parent: Optional[str] = None, **attrs: Any) -> float:
+    # for stages that cannot sit in a with block, e.g. spanning the yields of a streamed response
+    elapsed = time.perf_counter() - start
+    duration_ms = round(elapsed * 1000, 2)
+    STAGE_LATENCY.labels(stage).observe(elapsed)
+    trace = _trace.get()
+    if trace is not None and len(trace["spans"]) < TRACE_MAX_SPANS:
+        trace["spans"].append({
+            "stage": stage,
+            "parent": parent,
+            "offset_ms": round((start - trace["started"]) * 1000, 2),
+            "duration_ms": duration_ms,
+            **attrs,
+        })
+    return duration_ms
+
+
+def stage_totals(trace: Dict[str, Any]) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for s in trace["spans"]:
+        totals[s["stage"]] = round(totals.get(s["stage"], 0.0) + s["duration_ms"], 2)
+    return totals
+
+
+def server_timing(trace: Dict[str, Any]) -> str:
+    return ", ".join(f"{stage};dur={ms}" for stage, ms in stage_totals(trace).items())
+
+
+def format_spans(spans: List[Dict[str, Any]]) -> str:
+    return " ".join(
+        f"{s['stage']}@{s['offset_ms']:.0f}+{s['duration_ms']:.0f}ms" for s in spans)
+
+
+def register_pool(name: str, pool, size: int):
+    _pool_names[pool] = name
+    POOL_SIZE.labels(name).set(size)
+
+
+@contextmanager
+def pool_slot(name: str):
+    POOL_BUSY.labels(name).inc()
+    try:
+        yield
+    finally:
+        POOL_BUSY.labels(name).dec()
+
+
+async def run_in_executor(executor, fn, *args, **kwargs):
+    """
+    loop.run_in_executor with the caller's contextvars (asyncio.to_thread
+    copies them, run_in_executor does not), so spans recorded in the worker
+    join the request's trace. Registered pools report busy and queued work.
+    """
+    loop = asyncio.get_running_loop()
+    call = partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    name = _pool_names.get(executor) if executor is not None else None
+    if name is None:
+        return await loop.run_in_executor(executor, call)
+
+    queued = POOL_QUEUED.labels(name)
+    queued.inc()
+    started = False
+
+    def tracked():
+        nonlocal started
+        started = True
+        queued.dec()
+        with pool_slot(name):
+            return call()
+
+    future = executor.submit(tracked)
+    # cancelled before a worker picked it up, tracked() never runs
+    future.add_done_callback(lambda f: queued.dec() if not started else None)
+    return await asyncio.wrap_future(future)
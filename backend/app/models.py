@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from enum import Enum
 from datetime import datetime
 
@@ -27,3 +27,26 @@ class DocumentUploadResponse(BaseModel):
     timestamp: datetime
     chunks_processed: Optional[int] = None
     entities_extracted: Optional[int] = None
+    job_id: Optional[str] = None
+
+
+class BatchDocumentResult(BaseModel):
+    document_name: str
+    content_hash: str
+    status: str
+    message: str
+    vector_document_id: Optional[str] = None
+    graph_document_id: Optional[str] = None
+    chunks_processed: Optional[int] = None
+    entities_extracted: Optional[int] = None
+
+
+class BatchUploadResponse(BaseModel):
+    user_id: str
+    documents_received: int
+    documents_stored: int
+    documents_skipped: int
+    documents_failed: int
+    timestamp: datetime
+    timings_ms: Dict[str, Any] = Field(default_factory=dict)
+    results: List[BatchDocumentResult] = Field(default_factory=list)
@@ -1,22 +1,41 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import requests
+from typing import List, Optional, Dict, Any, Literal, Tuple
+import asyncio
+import httpx
+import json
+import time
 import os
 from dotenv import load_dotenv
 
+from logger import get_logger
+from context_packer import pack_context
+from llm_cache import LLMCache, LLM_CACHE_ENABLED, completion_key
+from metrics import POOL_BUSY, POOL_SIZE, pool_slot, record_stage, span
+
 load_dotenv()
 
 router = APIRouter()
+logger = get_logger("prompt_service")
 
 OPEN_ROUTER_KEY = os.environ.get("OPEN_ROUTER_KEY")
 MODEL_ID = "arcee-ai/trinity-large-preview:free"
+# any OpenAI-compatible endpoint, tests point this at a local stand-in
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", 30))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 20))
+
+_client: Optional[httpx.AsyncClient] = None
+_llm_cache: Optional[LLMCache] = None
 
 
 class QueryRequest(BaseModel):
     query: str
     max_tokens: int = 500
     temperature: float = 0.7
+    stream: bool = False
 
 
 class RAGQueryRequest(BaseModel):
@@ -25,98 +44,230 @@ class RAGQueryRequest(BaseModel):
     graph_results: Optional[List[Dict[str, Any]]] = []
     max_tokens: int = 500
     temperature: float = 0.3
+    stream: bool = False
+    context_token_budget: Optional[int] = None
 
 
-@router.post("/query")
-def query_model(req: QueryRequest):
-    headers = {
-        "Authorization": f"Bearer {OPEN_ROUTER_KEY}",
-        "Content-Type": "application/json"
-    }
+class RAGAskRequest(BaseModel):
+    user_id: str
+    query: str
+    top_k: int = 3
+    mode: Optional[Literal["batched", "per_term", "lexical", "fused"]] = None
+    use_vector: bool = True
+    use_graph: bool = True
+    max_tokens: int = 500
+    temperature: float = 0.3
+    stream: bool = False
+    include_context: bool = False
+    context_token_budget: Optional[int] = None
+    # set to fuse both stores into one ranked top_k list before packing
+    fusion: Optional[Literal["rrf", "weighted"]] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    # one pooled keep-alive client per process instead of a new connection per call
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=LLM_BASE_URL,
+            headers={
+                "Authorization": f"Bearer {OPEN_ROUTER_KEY}",
+                "Content-Type": "application/json"
+            },
+            timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        )
+        POOL_SIZE.labels("llm").set(LLM_MAX_CONNECTIONS)
+    return _client
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    global _llm_cache
+    if _llm_cache is None and LLM_CACHE_ENABLED:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def llm_cache_stats() -> Optional[Dict[str, Any]]:
+    cache = get_llm_cache()
+    return cache.stats() if cache else None
+
 
+async def aclose_client():
+    global _client, _llm_cache
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    if _llm_cache is not None:
+        _llm_cache.close()
+        _llm_cache = None
+
+
+async def _cache_lookup(messages: List[Dict[str, str]], max_tokens: int,
+                        temperature: float) -> Tuple[Optional[str], Optional[str], str]:
+    # (cache key, cached answer, status), the key is None when the answer must not be stored
+    cache = get_llm_cache()
+    if cache is None:
+        return None, None, "disabled"
+    if not cache.cacheable(temperature):
+        return None, None, "bypass"
+    key = completion_key(MODEL_ID, messages, max_tokens, temperature)
+    content = await asyncio.to_thread(cache.get, key)
+    return key, content, "hit" if content is not None else "miss"
+
+
+async def _cache_store(key: Optional[str], content: str):
+    if key is None:
+        return
+    try:
+        await asyncio.to_thread(get_llm_cache().put, key, MODEL_ID, content)
+    except Exception as e:
+        logger.error(f"Failed to store LLM response in cache: {e}")
+
+
+def _chat_payload(messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                  stream: bool = False) -> Dict[str, Any]:
     payload = {
         "model": MODEL_ID,
-        "messages": [
-            {"role": "user", "content": req.query}
-        ],
-        "max_tokens": req.max_tokens,
-        "temperature": req.temperature
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature
     }
+    if stream:
+        payload["stream"] = True
+    return payload
+
 
+async def complete(messages: List[Dict[str, str]], max_tokens: int,
+                   temperature: float) -> Tuple[str, str]:
+    # returns the answer and its cache status (hit, miss, bypass or disabled)
+    key, cached, status = await _cache_lookup(messages, max_tokens, temperature)
+    if cached is not None:
+        return cached, status
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
+        with span("llm"), pool_slot("llm"):
+            response = await get_client().post(
+                "/chat/completions", json=_chat_payload(messages, max_tokens, temperature))
         response.raise_for_status()
         result = response.json()
         answer = result["choices"][0]["message"]["content"]
-        return {"response": answer}
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(
-            status_code=500, detail=f"Error calling OpenRouter API: {e}")
+            status_code=500, detail=f"Error calling LLM API: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
 
-
-def _flatten_entities(entities) -> List[Dict[str, Any]]:
-    if isinstance(entities, dict):
-        flat = entities.get("direct", []) + entities.get("expanded", [])
-    elif isinstance(entities, list):
-        flat = entities
-    else:
-        return []
-
-    return [e for e in flat if isinstance(e, dict) and "name" in e]
+    await _cache_store(key, answer)
+    return answer, status
+
+
+def _sse(data: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+
+async def stream_completion(messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                            prelude: Optional[List[Dict[str, Any]]] = None) -> StreamingResponse:
+    """
+    Relays the upstream OpenAI-compatible SSE stream chunk by chunk. The
+    upstream status is checked before the response starts so a failed call
+    is still a plain HTTP error; failures mid-stream end the stream with an
+    error event. prelude events are sent ahead of the first upstream chunk.
+    A cached answer is replayed as a single chunk, a streamed miss is
+    stored once the upstream stream completes.
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    key, cached, _ = await _cache_lookup(messages, max_tokens, temperature)
+    if cached is not None:
+        async def replay():
+            for event in prelude or []:
+                yield _sse(event)
+            yield _sse({
+                "object": "chat.completion.chunk",
+                "model": MODEL_ID,
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": cached},
+                             "finish_reason": "stop"}],
+            })
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(replay(), media_type="text/event-stream", headers=headers)
+
+    client = get_client()
+    request = client.build_request(
+        "POST", "/chat/completions", json=_chat_payload(messages, max_tokens, temperature, stream=True))
+    started = time.perf_counter()
+    try:
+        with span("llm_first_byte"):
+            upstream = await client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error calling LLM API: {e}")
+    if upstream.is_error:
+        body = (await upstream.aread()).decode(errors="replace")
+        await upstream.aclose()
+        raise HTTPException(
+            status_code=500, detail=f"Error calling LLM API: {upstream.status_code} {body[:500]}")
+    async def relay():
+        # the connection stays checked out until the relay finishes, counted busy only once it starts
+        POOL_BUSY.labels("llm").inc()
+        parts, done = [], False
+        try:
+            for event in prelude or []:
+                yield _sse(event)
+            async for line in upstream.aiter_lines():
+                # comments and keep-alives (": ...") are not forwarded
+                if not line.startswith("data:"):
+                    continue
+                yield f"{line}\n\n"
+                if key is None:
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    done = True
+                    continue
+                try:
+                    for choice in json.loads(data).get("choices", []):
+                        parts.append((choice.get("delta") or {}).get("content") or "")
+                except ValueError:
+                    pass
+            if done:
+                await _cache_store(key, "".join(parts))
+        except httpx.HTTPError as e:
+            logger.error(f"LLM stream interrupted: {e}")
+            yield _sse({"error": {"message": f"upstream stream interrupted: {e}"}})
+            yield "data: [DONE]\n\n"
+        finally:
+            await upstream.aclose()
+            POOL_BUSY.labels("llm").dec()
+            record_stage("llm", started, stream=True)
+
+    # closes the upstream response when the client went away before the relay started,
+    # closing it a second time after the relay is a no-op
+    return StreamingResponse(relay(), media_type="text/event-stream", headers=headers,
+                             background=BackgroundTask(upstream.aclose))
 
 
-@router.post("/rag/query")
-def rag_query(req: RAGQueryRequest):
-    context_parts = []
-
-    if req.vector_results:
-        context_parts.append("DOCUMENT CHUNKS (VECTOR SEARCH)")
-        for i, res in enumerate(req.vector_results, 1):
-            doc_name = res.get("metadata", {}).get("document_name", "unknown")
-            content = res.get("content", "")
-            context_parts.append(
-                f"[Chunk {i} from '{doc_name}']:\n{content}\n")
-
-    if req.graph_results:
-        context_parts.append("ENTITIES AND RELATIONSHIPS (GRAPH SEARCH)")
-        for i, res in enumerate(req.graph_results, 1):
-            doc = res.get("document", {})
-            doc_name = doc.get("name", "unknown")
-
-            chunk = res.get("chunk", {})
-            chunk_text = chunk.get("text") or doc.get("content_preview", "")
-
-            context_parts.append(f"[Graph result {i} from '{doc_name}']:")
-
-            if chunk_text:
-                context_parts.append(f"Content: {chunk_text}")
-
-            entities = _flatten_entities(res.get("entities", []))
-            if entities:
-                entity_text = ", ".join(
-                    f"{e.get('name')} ({e.get('type')})" for e in entities
-                )
-                context_parts.append(f"Entities mentioned: {entity_text}")
-
-            ctx = res.get("context", {})
-            if ctx.get("prev_chunk"):
-                context_parts.append(
-                    f"[preceding context]: {ctx['prev_chunk']}")
-            if ctx.get("next_chunk"):
-                context_parts.append(
-                    f"[following context]: {ctx['next_chunk']}")
-
-            context_parts.append("")
-
-    context = "\n".join(context_parts)
+@router.post("/query")
+async def query_model(req: QueryRequest):
+    messages = [
+        {"role": "user", "content": req.query}
+    ]
+    if req.stream:
+        return await stream_completion(messages, req.max_tokens, req.temperature)
+
+    answer, cache_status = await complete(messages, req.max_tokens, req.temperature)
+    return {"response": answer, "llm_cache": cache_status}
+
+
+def build_rag_messages(query: str, vector_results: List[Dict[str, Any]],
+                       graph_results: List[Dict[str, Any]],
+                       token_budget: Optional[int] = None,
+                       fused_results: Optional[List[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    # deduplicated, ranked and packed into the token budget, the report says what was left out
+    blocks, packing = pack_context(
+        vector_results, graph_results, token_budget, fused_results=fused_results)
+    context = "\n".join(blocks)
 
     system_prompt = """You are a helpful assistant that answers questions based ONLY on the provided context.
 If the context doesn't contain the answer, say "I don't have enough information to answer that."
@@ -125,46 +276,89 @@ Be concise and accurate. Always cite which document your information comes from.
     user_prompt = f"""CONTEXT:
 {context}
 
-QUESTION: {req.query}
+QUESTION: {query}
 
 Answer based only on the context above:"""
 
-    headers = {
-        "Authorization": f"Bearer {OPEN_ROUTER_KEY}",
-        "Content-Type": "application/json"
-    }
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ], packing
 
-    payload = {
-        "model": MODEL_ID,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        "max_tokens": req.max_tokens,
-        "temperature": req.temperature
-    }
 
-    try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        response.raise_for_status()
-        result = response.json()
-        answer = result["choices"][0]["message"]["content"]
+@router.post("/rag/query")
+async def rag_query(req: RAGQueryRequest):
+    messages, packing = build_rag_messages(
+        req.query, req.vector_results or [], req.graph_results or [], req.context_token_budget)
+    context_used = {
+        "vector_results_count": len(req.vector_results or []),
+        "graph_results_count": len(req.graph_results or []),
+        "packing": packing,
+    }
+    if req.stream:
+        return await stream_completion(messages, req.max_tokens, req.temperature,
+                                       prelude=[{"context_used": context_used}])
+
+    answer, cache_status = await complete(messages, req.max_tokens, req.temperature)
+    return {
+        "response": answer,
+        "context_used": context_used,
+        "llm_cache": cache_status
+    }
 
-        return {
-            "response": answer,
-            "context_used": {
-                "vector_results_count": len(req.vector_results),
-                "graph_results_count": len(req.graph_results),
-            }
-        }
 
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(
-            status_code=500, detail=f"Error calling OpenRouter API: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
+@router.post("/rag/ask")
+async def rag_ask(req: RAGAskRequest, request: Request):
+    """
+    Retrieval and generation in one call: vector and graph search run
+    concurrently in the server and their results go straight into the
+    prompt, so context is never serialized out to the client and back.
+    """
+    started = time.perf_counter()
+    repo = request.app.state.repo
+    if req.fusion:
+        retrieved = await repo.ahybrid_retrieve(
+            req.user_id, req.query, top_k=req.top_k, mode=req.mode, fusion=req.fusion,
+            use_vector=req.use_vector, use_graph=req.use_graph)
+    else:
+        retrieved = await repo.aretrieve(
+            req.user_id, req.query, top_k=req.top_k, mode=req.mode,
+            use_vector=req.use_vector, use_graph=req.use_graph)
+
+    messages, packing = build_rag_messages(
+        req.query, retrieved["vector_results"], retrieved["graph_results"], req.context_token_budget,
+        fused_results=retrieved.get("results"))
+    context_used = {
+        "vector_results_count": len(retrieved["vector_results"]),
+        "graph_results_count": len(retrieved["graph_results"]),
+        "packing": packing,
+        "cached": retrieved["cached"],
+        "errors": retrieved["errors"],
+    }
+    if req.fusion:
+        context_used["fusion"] = retrieved["fusion"]
+        context_used["fused_results_count"] = len(retrieved["results"])
+    timings = retrieved["timings_ms"]
+
+    if req.stream:
+        # generation time is not known when the stream starts, only retrieval stages are reported
+        return await stream_completion(messages, req.max_tokens, req.temperature,
+                                       prelude=[{"context_used": context_used, "timings_ms": timings}])
+
+    start = time.perf_counter()
+    answer, cache_status = await complete(messages, req.max_tokens, req.temperature)
+    timings["llm"] = round((time.perf_counter() - start) * 1000, 2)
+    timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+
+    response = {
+        "response": answer,
+        "context_used": context_used,
+        "timings_ms": timings,
+        "llm_cache": cache_status,
+    }
+    if req.include_context:
+        response["vector_results"] = retrieved["vector_results"]
+        response["graph_results"] = retrieved["graph_results"]
+        if req.fusion:
+            response["fused_results"] = retrieved["results"]
+    return response
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+import copy
+import re
+import threading
+import time
+import os
+
+from logger import get_logger
+from metrics import QUERY_CACHE_HITS, QUERY_CACHE_MISSES
+
+logger = get_logger("query_cache")
+
+QUERY_CACHE_ENABLED = os.environ.get(
+    "QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_TTL_SECONDS = float(os.environ.get("QUERY_CACHE_TTL_SECONDS", 300))
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", 2048))
+
+
+def normalize_query(query_text: str) -> str:
+    # whitespace only, case is kept because spaCy NER on the graph side is case sensitive
+    return re.sub(r"\s+", " ", query_text).strip()
+
+
+class QueryCache:
+    """
+    Per-user query results under a TTL with LRU eviction. Every user has a
+    version counter that writes and deletes bump, and every store one that
+    invalidate_store() bumps for results that also depend on other users'
+    data. An entry remembers the versions it was computed under and is
+    dropped once they are no longer current, so results never outlive a
+    change to the data they were read from.
+    """
+
+    def __init__(self, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+                 max_entries: int = QUERY_CACHE_MAX_ENTRIES, enabled: bool = QUERY_CACHE_ENABLED):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.entries: "OrderedDict[Tuple, Tuple[int, float, Any]]" = OrderedDict()
+        self.versions: Dict[str, int] = {}
+        self.store_versions: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(user_id: str, store: str, query_text: str, **params: Hashable) -> Tuple:
+        return (user_id, store, normalize_query(query_text), tuple(sorted(params.items())))
+
+    def _current(self, key: Tuple) -> Tuple[int, int]:
+        return self.versions.get(key[0], 0), self.store_versions.get(key[1], 0)
+
+    def version(self, key: Tuple) -> Tuple[int, int]:
+        with self.lock:
+            return self._current(key)
+
+    def invalidate(self, user_id: str):
+        with self.lock:
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+        logger.debug(f"query cache invalidated for user {user_id}")
+
+    def invalidate_store(self, store: str):
+        with self.lock:
+            self.store_versions[store] = self.store_versions.get(store, 0) + 1
+        logger.debug(f"query cache invalidated for every user's {store} results")
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                QUERY_CACHE_MISSES.labels(key[1]).inc()
+                return None
+            version, stored_at, value = entry
+            if version != self._current(key) or time.monotonic() - stored_at > self.ttl_seconds:
+                del self.entries[key]
+                self.stale += 1
+                self.misses += 1
+                QUERY_CACHE_MISSES.labels(key[1]).inc()
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            QUERY_CACHE_HITS.labels(key[1]).inc()
+        return copy.deepcopy(value)
+
+    def put(self, key: Tuple, version: Tuple[int, int], value: Any):
+        # version is read before the query ran, a write that finished meanwhile makes the entry stale
+        if not self.enabled:
+            return
+        value = copy.deepcopy(value)
+        with self.lock:
+            if version != self._current(key):
+                return
+            self.entries[key] = (version, time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self.entries),
+            }
@@ -0,0 +1,294 @@
+from typing import Any, Callable, Dict, List, Optional
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+import hashlib
+import os
+import re
+
+# one chunking stage shared by the vector and graph stores, every strategy
+# streams: feed() text as it arrives, finish() at the end of the document
+CHUNK_STRATEGIES = ("character", "sentence", "token")
+CHUNK_STRATEGY = os.environ.get("CHUNK_STRATEGY", "sentence")
+
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 512))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 64))
+TOKEN_CHUNK_SIZE = int(os.environ.get("TOKEN_CHUNK_SIZE", 128))
+TOKEN_CHUNK_OVERLAP = int(os.environ.get("TOKEN_CHUNK_OVERLAP", 16))
+
+# characters the character strategy buffers before splitting a window
+CHARACTER_WINDOW = 16 * CHUNK_SIZE
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+_WORD_RE = re.compile(r"\S+")
+_LAST_SPACE_RE = re.compile(r"\s\S*$")
+
+
+def count_tokens(text: str) -> int:
+    # word-piece approximation, close enough to MiniLM's tokenizer for budgeting
+    return len(_TOKEN_RE.findall(text))
+
+
+def chunk_id(user_id: str, content_hash: str, index: int) -> str:
+    # content-addressed and shared by both stores, a user can't upload the same content twice
+    return hashlib.sha256(f"{user_id}:{content_hash}:{index}".encode()).hexdigest()[:32]
+
+
+def assign_chunk_ids(chunks: List[Dict[str, Any]], user_id: str, content_hash: str) -> List[Dict[str, Any]]:
+    for chunk in chunks:
+        chunk["id"] = chunk_id(user_id, content_hash, chunk["index"])
+    return chunks
+
+
+class SentenceChunkStream:
+    """
+    Overlapping chunks of about chunk_size characters, cut at the last
+    sentence end (or space) in the second half of the window. Whitespace is
+    normalized as text arrives and chunks are emitted as soon as their
+    boundaries are known, so only the unfinished tail is held in memory.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.buffer = ""
+        self.base = 0
+        self.start = 0
+        self.index = 0
+        self.started = False
+        self.last_char = ""
+
+    def feed(self, piece: str) -> List[Dict[str, Any]]:
+        piece = re.sub(r'\s+', ' ', piece)
+        if not self.started:
+            piece = piece.lstrip()
+            if not piece:
+                return []
+            self.started = True
+        if self.last_char == ' ' and piece.startswith(' '):
+            piece = piece[1:]
+        if not piece:
+            return []
+        self.buffer += piece
+        self.last_char = piece[-1]
+        return self._drain(final=False)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        self.buffer = self.buffer.rstrip()
+        return self._drain(final=True)
+
+    def _drain(self, final: bool) -> List[Dict[str, Any]]:
+        text, base = self.buffer, self.base
+        text_len = base + len(text)
+        # a trailing space may still be stripped, so it doesn't count until the end
+        known_len = text_len if final else base + len(text.rstrip())
+
+        chunks = []
+        while self.start < text_len:
+            end = self.start + self.chunk_size
+
+            if end < known_len:
+                lo = self.start + self.chunk_size // 2 - base
+                boundary = text.rfind('.', lo, end - base)
+                if boundary == -1:
+                    boundary = text.rfind(' ', lo, end - base)
+                if boundary != -1:
+                    end = base + boundary + 1
+            elif not final:
+                break
+
+            chunk_text = text[self.start - base:end - base].strip()
+            if chunk_text:
+                chunks.append({
+                    "index": self.index,
+                    "text": chunk_text,
+                    "start_char": self.start,
+                    "end_char": end,
+                })
+                self.index += 1
+
+            self.start = end - self.chunk_overlap
+
+        consumed = min(max(self.start - base, 0), len(text))
+        self.buffer = text[consumed:]
+        self.base = base + consumed
+        return chunks
+
+
+class CharacterChunkStream:
+    """
+    langchain's recursive character splitter (paragraph, line, sentence, word).
+    Text is buffered into windows cut at paragraph or line breaks, each window
+    is split on its own.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                 window: int = CHARACTER_WINDOW):
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            separators=["\n\n", "\n", ".", " ", ""]
+        )
+        self.window = max(window, 2 * chunk_size)
+        self.buffer = ""
+        self.base = 0
+        self.index = 0
+
+    def _split(self, text: str) -> List[Dict[str, Any]]:
+        chunks, search_from = [], 0
+        for piece in self.splitter.split_text(text):
+            pos = text.find(piece, search_from)
+            if pos == -1:
+                pos = search_from
+            chunks.append({
+                "index": self.index,
+                "text": piece,
+                "start_char": self.base + pos,
+                "end_char": self.base + pos + len(piece),
+            })
+            self.index += 1
+            search_from = pos + 1
+        return chunks
+
+    def feed(self, piece: str) -> List[Dict[str, Any]]:
+        self.buffer += piece
+        chunks = []
+        while len(self.buffer) >= self.window:
+            head = self.buffer[:self.window]
+            cut = max(head.rfind("\n\n"), head.rfind("\n"))
+            if cut < self.window // 2:
+                cut = head.rfind(" ")
+            if cut <= 0:
+                cut = self.window
+            chunks.extend(self._split(self.buffer[:cut]))
+            self.buffer = self.buffer[cut:]
+            self.base += cut
+        return chunks
+
+    def finish(self) -> List[Dict[str, Any]]:
+        chunks = self._split(self.buffer)
+        self.base += len(self.buffer)
+        self.buffer = ""
+        return chunks
+
+
+class TokenChunkStream:
+    """
+    Sentence packing under a token budget: whole sentences are added until
+    the next one would exceed chunk_tokens, the following chunk starts with
+    the trailing sentences that fit in overlap_tokens. Sentences longer than
+    the budget are cut on word boundaries, an unfinished one as soon as its
+    complete words exceed the budget, so text without sentence ends is not
+    buffered whole.
+    """
+
+    def __init__(self, chunk_tokens: int = TOKEN_CHUNK_SIZE, overlap_tokens: int = TOKEN_CHUNK_OVERLAP,
+                 count: Callable[[str], int] = count_tokens):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count = count
+        self.buffer = ""
+        self.base = 0
+        self.index = 0
+        self.current = []  # (start, end, text, tokens) of sentences in the open chunk
+        self.splitting = False  # the unfinished sentence is oversized and being cut into words
+
+    def _sentences(self, text: str, final: bool):
+        pos, spans = 0, []
+        for match in _SENTENCE_END_RE.finditer(text):
+            spans.append((pos, match.start()))
+            pos = match.end()
+        if final:
+            spans.append((pos, len(text)))
+        return spans, pos
+
+    def _emit(self) -> Dict[str, Any]:
+        start, end = self.current[0][0], self.current[-1][1]
+        chunk = {
+            "index": self.index,
+            "text": " ".join(s[2] for s in self.current),
+            "start_char": start,
+            "end_char": end,
+        }
+        self.index += 1
+        overlap, tokens = [], 0
+        for sentence in reversed(self.current):
+            if tokens + sentence[3] > self.overlap_tokens:
+                break
+            overlap.insert(0, sentence)
+            tokens += sentence[3]
+        self.current = overlap if len(overlap) < len(self.current) else []
+        return chunk
+
+    def _add(self, start: int, end: int, text: str) -> List[Dict[str, Any]]:
+        chunks = []
+        tokens = self.count(text)
+        if tokens > self.chunk_tokens and _LAST_SPACE_RE.search(text):
+            # an oversized sentence is cut into word runs that fit the budget
+            return self._add_words(start, text)
+        if self.current and sum(s[3] for s in self.current) + tokens > self.chunk_tokens:
+            chunks.append(self._emit())
+            if sum(s[3] for s in self.current) + tokens > self.chunk_tokens:
+                self.current = []
+        self.current.append((start, end, text, tokens))
+        return chunks
+
+    def _add_words(self, start: int, text: str) -> List[Dict[str, Any]]:
+        chunks = []
+        for match in _WORD_RE.finditer(text):
+            chunks.extend(self._add(start + match.start(),
+                          start + match.end(), match.group()))
+        return chunks
+
+    def _drain(self, final: bool) -> List[Dict[str, Any]]:
+        spans, consumed = self._sentences(self.buffer, final)
+        chunks = []
+        for start, end in spans:
+            sentence = self.buffer[start:end].strip()
+            if sentence:
+                offset = self.buffer.index(sentence, start)
+                if self.splitting:
+                    # the rest of a sentence whose first words were already cut off
+                    chunks.extend(self._add_words(self.base + offset, sentence))
+                else:
+                    chunks.extend(self._add(self.base + offset, self.base +
+                                  offset + len(sentence), sentence))
+            self.splitting = False
+        if not final:
+            # complete words of an oversized unfinished sentence, the last word may still grow
+            tail = _LAST_SPACE_RE.search(self.buffer, consumed)
+            if tail and (self.splitting or self.count(self.buffer[consumed:tail.start()]) > self.chunk_tokens):
+                chunks.extend(self._add_words(self.base + consumed, self.buffer[consumed:tail.start()]))
+                consumed = tail.start()
+                self.splitting = True
+        consumed = len(self.buffer) if final else consumed
+        self.buffer = self.buffer[consumed:]
+        self.base += consumed
+        if final and self.current:
+            chunks.append(self._emit())
+            self.current = []
+        return chunks
+
+    def feed(self, piece: str) -> List[Dict[str, Any]]:
+        self.buffer += piece
+        return self._drain(final=False)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        return self._drain(final=True)
+
+
+def make_chunk_stream(strategy: Optional[str] = None):
+    strategy = strategy or CHUNK_STRATEGY
+    if strategy == "sentence":
+        return SentenceChunkStream()
+    if strategy == "character":
+        return CharacterChunkStream()
+    if strategy == "token":
+        return TokenChunkStream()
+    raise ValueError(
+        f"Unknown chunk strategy '{strategy}', expected one of {CHUNK_STRATEGIES}")
+
+
+def split_text(text: str, strategy: Optional[str] = None) -> List[Dict[str, Any]]:
+    stream = make_chunk_stream(strategy)
+    return stream.feed(text) + stream.finish()
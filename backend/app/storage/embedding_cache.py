@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import hashlib
+import sqlite3
+import threading
+import time
+import os
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from logger import get_logger
+
+logger = get_logger("embedding_cache")
+
+EMBEDDING_CACHE_ENABLED = os.environ.get(
+    "EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH", "./app_data/embeddings.db")
+# vectors kept in the in-memory LRU layer, MiniLM vectors are 384 float32s (1.5KB)
+EMBEDDING_CACHE_MEMORY_SIZE = int(
+    os.environ.get("EMBEDDING_CACHE_MEMORY_SIZE", 50000))
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed by model name and text hash. A bounded LRU in memory
+    sits in front of a SQLite table holding every vector ever computed as
+    float32 bytes, so cached vectors survive restarts.
+    """
+
+    def __init__(self, db_path: str = EMBEDDING_CACHE_PATH, memory_size: int = EMBEDDING_CACHE_MEMORY_SIZE):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.memory_size = memory_size
+        self.memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        logger.info(f"Embedding cache ready at {db_path}")
+
+    def _remember(self, key: str, vector: List[float]):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found, missing = {}, []
+        with self.lock:
+            for key in keys:
+                vector = self.memory.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self.memory.move_to_end(key)
+                    found[key] = vector
+            self.memory_hits += len(found)
+
+            # sqlite caps bound parameters per statement, 500 stays well below it
+            for i in range(0, len(missing), 500):
+                batch = missing[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                    self._remember(key, vector)
+                    found[key] = vector
+                    self.disk_hits += 1
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model_name: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            array = np.asarray(vector, dtype=np.float32)
+            rows.append((key, model_name, array.shape[0], array.tobytes(), now))
+        with self.lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, created_at) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            stored = self.conn.execute(
+                "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "stored_entries": stored,
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    Chroma embedding function that answers from the cache and sends only
+    the texts it has never seen to the wrapped model, in one encoder call.
+    Used for both collection writes and query embeddings.
+    """
+
+    def __init__(self, embedding_function: EmbeddingFunction, model_name: str,
+                 cache: Optional[EmbeddingCache] = None):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.cache = cache or EmbeddingCache()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [embedding_key(self.model_name, text) for text in input]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        # repeated texts within one call are embedded once
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = self.embedding_function(list(missing.values()))
+            # float32 round trip so fresh and cached vectors are identical
+            computed = {key: np.asarray(vector, dtype=np.float32).tolist()
+                        for key, vector in zip(missing, vectors)}
+            self.cache.put_many(self.model_name, computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def stats(self) -> Dict[str, float]:
+        return {"model": self.model_name, **self.cache.stats()}
@@ -0,0 +1,11 @@
+from typing import Iterable, Optional, Tuple
+import os
+
+# reciprocal-rank fusion constant, larger values flatten the gap between the top and lower ranks
+RRF_K = int(os.environ.get("RRF_K", 60))
+
+
+def rrf_score(ranks: Iterable[Tuple[float, Optional[int]]], k: int = RRF_K) -> float:
+    # (weight, rank) per ranked list, ranks are 0-based and None where the list missed the hit,
+    # so the best hit of a list adds weight / (k + 1)
+    return sum(weight / (k + rank + 1) for weight, rank in ranks if rank is not None)
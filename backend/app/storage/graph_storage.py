@@ -1,18 +1,530 @@
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, AsyncGraphDatabase
 from typing import List, Dict, Any, Optional, Tuple
+from collections import Counter
 import uuid
 import hashlib
 import spacy
+import time
 import os
-import re
 
 from logger import get_logger
+from storage.chunking import split_text, assign_chunk_ids
+from storage.inverted_index import tokenize
+from metrics import CHUNKS_INGESTED, ENTITIES_INGESTED, run_in_executor, span
 
 PASSWORD = os.environ.get("NEO4J_PASSWORD")
 logger = get_logger("graph_storage")
 
-CHUNK_SIZE = 512
-CHUNK_OVERLAP = 64
+WRITE_BATCH_SIZE = int(os.environ.get("GRAPH_WRITE_BATCH_SIZE", 500))
+NER_BATCH_SIZE = int(os.environ.get("NER_BATCH_SIZE", 64))
+NER_N_PROCESS = int(os.environ.get("NER_N_PROCESS", 1))
+DOCS_PER_TRANSACTION = int(os.environ.get("GRAPH_DOCS_PER_TRANSACTION", 50))
+QUERY_LIMIT = int(os.environ.get("GRAPH_QUERY_LIMIT", 15))
+# full-text hits read per fallback query, the lookup itself is restricted to the user's chunks
+FULLTEXT_CANDIDATES = int(os.environ.get("GRAPH_FULLTEXT_CANDIDATES", 200))
+# chunk text plus the owner key, so a lookup never competes with other tenants' hits
+FULLTEXT_INDEX = "chunk_text"
+# neighbors kept per entity in its nbr_* adjacency lists, highest co-occurrence count first
+ADJACENCY_SIZE = int(os.environ.get("GRAPH_ADJACENCY_SIZE", 25))
+# neighbors read per mentioned entity when a query expands a matched chunk
+EXPANSION_FANOUT = int(os.environ.get("GRAPH_EXPANSION_FANOUT", 5))
+# global: one Entity node per (name, type) shared by all users, with co-occurrence counts summed over every tenant
+# user: entities and their CO_OCCURS_WITH edges are keyed (user_id, name, type), queries only see their owner's graph
+ENTITY_SCOPES = ("global", "user")
+ENTITY_SCOPE = os.environ.get("GRAPH_ENTITY_SCOPE", "global")
+
+# ner and sentence splitting only need tok2vec, parser and ner
+NER_DISABLED_PIPES = ["tagger", "attribute_ruler", "lemmatizer"]
+
+WRITE_DOCUMENTS = """
+UNWIND $rows AS row
+MERGE (u:User {id: row.user_id})
+CREATE (d:Document {
+    id: row.document_id,
+    name: row.name,
+    content_hash: row.content_hash,
+    upload_time: datetime(),
+    tags: row.tags,
+    description: row.description,
+    char_count: row.char_count
+})
+MERGE (u)-[:UPLOADED]->(d)
+"""
+
+WRITE_CHUNKS = """
+UNWIND $rows AS row
+MATCH (d:Document {id: row.document_id})
+CREATE (c:Chunk {
+    id: row.chunk_id,
+    document_id: row.document_id,
+    index: row.index,
+    text: row.text,
+    owner_key: row.owner_key,
+    start_char: row.start_char,
+    end_char: row.end_char
+})
+CREATE (d)-[:HAS_CHUNK {index: row.index}]->(c)
+"""
+
+WRITE_NEXT_LINKS = """
+UNWIND $rows AS row
+MATCH (prev:Chunk {id: row.prev_id})
+MATCH (curr:Chunk {id: row.curr_id})
+CREATE (prev)-[:NEXT]->(curr)
+"""
+
+WRITE_MENTIONS = """
+UNWIND $rows AS row
+MERGE (e:Entity {name: row.name, type: row.type})
+ON CREATE SET
+    e.normalized = row.normalized,
+    e.created_at = datetime()
+WITH e, row
+MATCH (c:Chunk {id: row.chunk_id})
+MATCH (d:Document {id: row.document_id})
+MERGE (c)-[:MENTIONS {position: row.position}]->(e)
+MERGE (d)-[:MENTIONS]->(e)
+"""
+
+WRITE_MENTIONS_BY_USER = """
+UNWIND $rows AS row
+MERGE (e:Entity {user_id: row.user_id, name: row.name, type: row.type})
+ON CREATE SET
+    e.normalized = row.normalized,
+    e.created_at = datetime()
+WITH e, row
+MATCH (c:Chunk {id: row.chunk_id})
+MATCH (d:Document {id: row.document_id})
+MERGE (c)-[:MENTIONS {position: row.position}]->(e)
+MERGE (d)-[:MENTIONS]->(e)
+"""
+
+WRITE_CO_OCCURRENCES = """
+UNWIND $rows AS row
+MERGE (e1:Entity {name: row.e1_name, type: row.e1_type})
+MERGE (e2:Entity {name: row.e2_name, type: row.e2_type})
+MERGE (e1)-[r:CO_OCCURS_WITH]->(e2)
+ON CREATE SET r.count = row.count, r.first_seen = datetime()
+ON MATCH SET r.count = r.count + row.count
+"""
+
+WRITE_CO_OCCURRENCES_BY_USER = """
+UNWIND $rows AS row
+MERGE (e1:Entity {user_id: row.user_id, name: row.e1_name, type: row.e1_type})
+MERGE (e2:Entity {user_id: row.user_id, name: row.e2_name, type: row.e2_type})
+MERGE (e1)-[r:CO_OCCURS_WITH]->(e2)
+ON CREATE SET r.count = row.count, r.first_seen = datetime()
+ON MATCH SET r.count = r.count + row.count
+"""
+
+# shared tail of the adjacency writes, after e is locked and the touched neighbors' totals are read
+_MERGE_ADJACENCY = """
+WITH e, row, updated,
+     coalesce(e.nbr_names, []) AS names,
+     coalesce(e.nbr_types, []) AS types,
+     coalesce(e.nbr_counts, []) AS counts
+WITH e, row, updated + [i IN range(0, size(names) - 1)
+                        WHERE NOT {name: names[i], type: types[i]} IN
+                              [u IN updated | {name: u.name, type: u.type}]
+                        | {name: names[i], type: types[i], count: counts[i]}] AS merged
+CALL {
+    WITH merged
+    UNWIND merged AS m
+    WITH m ORDER BY m.count DESC, m.name
+    RETURN collect(m) AS ranked
+}
+WITH e, ranked[..row.size] AS top
+SET e.nbr_names = [m IN top | m.name],
+    e.nbr_types = [m IN top | m.type],
+    e.nbr_counts = [m IN top | m.count]
+REMOVE e._lock
+"""
+
+# runs after WRITE_CO_OCCURRENCES in the same transaction: the touched neighbors are
+# re-read with their updated totals (edges in either direction) and merged into the
+# entity's top-N lists, so hub entities never have all their edges read at query time.
+# SET e._lock takes the entity's write lock before its lists are read, so a concurrent
+# upload touching the same entity waits for this commit instead of overwriting its merge
+WRITE_ADJACENCY = """
+UNWIND $rows AS row
+MATCH (e:Entity {name: row.name, type: row.type})
+SET e._lock = true
+WITH e, row
+CALL {
+    WITH e, row
+    UNWIND row.neighbors AS nbr
+    MATCH (n:Entity {name: nbr.name, type: nbr.type})
+    MATCH (e)-[r:CO_OCCURS_WITH]-(n)
+    WITH n, sum(r.count) AS count
+    RETURN collect({name: n.name, type: n.type, count: count}) AS updated
+}""" + _MERGE_ADJACENCY
+
+WRITE_ADJACENCY_BY_USER = """
+UNWIND $rows AS row
+MATCH (e:Entity {user_id: row.user_id, name: row.name, type: row.type})
+SET e._lock = true
+WITH e, row
+CALL {
+    WITH e, row
+    UNWIND row.neighbors AS nbr
+    MATCH (n:Entity {user_id: row.user_id, name: nbr.name, type: nbr.type})
+    MATCH (e)-[r:CO_OCCURS_WITH]-(n)
+    WITH n, sum(r.count) AS count
+    RETURN collect({name: n.name, type: n.type, count: count}) AS updated
+}""" + _MERGE_ADJACENCY
+
+# mentions, co-occurrences, adjacency
+ENTITY_WRITES = {
+    "global": (WRITE_MENTIONS, WRITE_CO_OCCURRENCES, WRITE_ADJACENCY),
+    "user": (WRITE_MENTIONS_BY_USER, WRITE_CO_OCCURRENCES_BY_USER, WRITE_ADJACENCY_BY_USER),
+}
+
+# any entity written in the user scope, the global scope cannot start while one exists
+# (the existence checks on every key property let the entity_user_key index answer it)
+USER_SCOPED_ENTITY = """
+MATCH (e:Entity)
+WHERE e.user_id IS NOT NULL AND e.name IS NOT NULL AND e.type IS NOT NULL
+RETURN e.user_id as user_id
+LIMIT 1
+"""
+
+# entity scope migration: documents still linked to global entities, their chunks, and the
+# links to drop once the chunks have been re-extracted into the owner's entities
+LEGACY_ENTITY_DOCUMENTS = """
+MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document)
+WHERE EXISTS { (d)-[:MENTIONS]->(e:Entity) WHERE e.user_id IS NULL }
+RETURN d.id as document_id
+"""
+
+DOCUMENT_CHUNKS = """
+MATCH (d:Document {id: $document_id})-[:HAS_CHUNK]->(c:Chunk)
+RETURN c.id as id, c.text as text, c.index as index
+ORDER BY c.index
+"""
+
+DELETE_LEGACY_MENTIONS = """
+UNWIND $rows AS row
+MATCH (d:Document {id: row.document_id})
+CALL {
+    WITH d
+    MATCH (d)-[m:MENTIONS]->(e:Entity)
+    WHERE e.user_id IS NULL
+    DELETE m
+}
+CALL {
+    WITH d
+    MATCH (d)-[:HAS_CHUNK]->(:Chunk)-[m:MENTIONS]->(e:Entity)
+    WHERE e.user_id IS NULL
+    DELETE m
+}
+"""
+
+# global entities no document mentions anymore, with their global co-occurrence edges
+DELETE_ORPHANED_GLOBAL_ENTITIES = """
+MATCH (e:Entity)
+WHERE e.user_id IS NULL AND NOT EXISTS { (e)<-[:MENTIONS]-() }
+WITH e LIMIT $batch_size
+DETACH DELETE e
+RETURN count(*) as deleted
+"""
+
+# fills the adjacency lists of entities written before they existed, one batch per call,
+# locked like WRITE_ADJACENCY so an upload's merge is not overwritten by a stale recount
+BACKFILL_ADJACENCY = """
+MATCH (e:Entity)
+WHERE e.nbr_names IS NULL
+WITH e LIMIT $batch_size
+SET e._lock = true
+WITH e
+CALL {
+    WITH e
+    OPTIONAL MATCH (e)-[r:CO_OCCURS_WITH]-(n:Entity)
+    WITH n, sum(r.count) AS count
+    ORDER BY count DESC, n.name
+    RETURN collect(CASE WHEN n IS NULL THEN NULL ELSE {name: n.name, type: n.type, count: count} END) AS ranked
+}
+WITH e, ranked[..$size] AS top
+SET e.nbr_names = [m IN top | m.name],
+    e.nbr_types = [m IN top | m.type],
+    e.nbr_counts = [m IN top | m.count]
+REMOVE e._lock
+RETURN count(e) AS updated
+"""
+
+
+DOCUMENT_EXISTS = """
+MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document {content_hash: $content_hash})
+RETURN d.id as document_id, d.name as document_name
+LIMIT 1
+"""
+
+# what an earlier attempt already committed under this document id
+STORED_DOCUMENT = """
+MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document {id: $document_id})
+RETURN d.id as document_id,
+       COUNT { (d)-[:HAS_CHUNK]->(:Chunk) } as chunks_stored,
+       COUNT { (d)-[:HAS_CHUNK]->(:Chunk)-[:MENTIONS]->(:Entity) } as entities_extracted,
+       COUNT { (d)-[:MENTIONS]->(:Entity) } as entity_count
+"""
+
+QUERY_BY_ENTITIES = """
+MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document)-[:HAS_CHUNK]->(c:Chunk)
+MATCH (c)-[:MENTIONS]->(e:Entity)
+WHERE e.name IN $entity_names OR e.normalized IN $entity_normalized
+WITH c, d, COLLECT(DISTINCT e) as direct_entities, COUNT(DISTINCT e) as direct_score
+ORDER BY direct_score DESC
+LIMIT $limit
+
+// expansion reads the precomputed top neighbors of each entity in the chunk, $fanout per entity
+OPTIONAL MATCH (c)-[:MENTIONS]->(e2:Entity)
+WITH c, d, direct_entities, direct_score, COLLECT(DISTINCT e2) as mentioned
+WITH c, d, direct_entities, direct_score,
+     reduce(acc = [], e2 IN mentioned |
+            acc + [i IN range(0, size(coalesce(e2.nbr_names, [])) - 1)[..$fanout] |
+                   {name: e2.nbr_names[i], type: e2.nbr_types[i]}]) as expanded_entities
+
+RETURN c, d,
+       direct_entities,
+       expanded_entities,
+       direct_score
+ORDER BY direct_score DESC
+"""
+
+# any of the terms (Lucene's default OR) inside the user's own chunks
+QUERY_BY_TEXT = """
+WITH "owner_key:" + $owner_key + " AND text:(" +
+     reduce(q = "", term IN $terms | q + " " + term) + ")" AS lucene_query
+CALL db.index.fulltext.queryNodes($index, lucene_query, {limit: $candidates})
+YIELD node AS c, score
+MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document)-[:HAS_CHUNK]->(c)
+WITH c, d, score
+ORDER BY score DESC
+LIMIT $limit
+OPTIONAL MATCH (c)-[:MENTIONS]->(e:Entity)
+WITH c, d, score, COLLECT(DISTINCT e) as direct_entities
+RETURN c, d, direct_entities, [] as expanded_entities, score as direct_score
+ORDER BY direct_score DESC
+"""
+
+# chunks written before they carried owner_key, one batch at a time
+CHUNKS_WITHOUT_OWNER = """
+MATCH (u:User)-[:UPLOADED]->(:Document)-[:HAS_CHUNK]->(c:Chunk)
+WHERE c.owner_key IS NULL
+RETURN elementId(c) as chunk, u.id as user_id
+LIMIT $batch_size
+"""
+
+SET_CHUNK_OWNERS = """
+UNWIND $rows AS row
+MATCH (c:Chunk) WHERE elementId(c) = row.chunk
+SET c.owner_key = row.owner_key
+"""
+
+SET_CHAR_COUNT = """
+MATCH (d:Document {id: $document_id})
+SET d.char_count = $char_count
+"""
+
+LIST_DOCUMENTS = """
+MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document)
+OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:Chunk)
+OPTIONAL MATCH (d)-[:MENTIONS]->(e:Entity)
+WITH d,
+     COUNT(DISTINCT c) as chunk_count,
+     COUNT(DISTINCT e) as entity_count
+RETURN d, chunk_count, entity_count
+ORDER BY d.upload_time DESC
+LIMIT coalesce($limit, 1000000000)
+"""
+
+
+def _batched(rows: List[Dict[str, Any]], size: int):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _format_time(value) -> str:
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def owner_key(user_id: str) -> str:
+    # one lowercase alphanumeric token, the standard analyzer keeps it intact and it needs no escaping
+    return "u" + hashlib.sha1(user_id.encode()).hexdigest()
+
+
+def _chunk_row(user_id: str, chunk: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "owner_key": owner_key(user_id),
+        "document_id": chunk["document_id"],
+        "chunk_id": chunk["id"],
+        "index": chunk["index"],
+        "text": chunk["text"],
+        "start_char": chunk["start_char"],
+        "end_char": chunk["end_char"],
+    }
+
+
+def _mention_rows(user_id: str, chunk: Dict[str, Any], entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "user_id": user_id,
+            "document_id": chunk["document_id"],
+            "chunk_id": chunk["id"],
+            "name": ent["text"],
+            "type": ent["label"],
+            "normalized": ent["normalized"],
+            "position": ent["start"],
+        }
+        for ent in entities
+    ]
+
+
+def _count_co_occurrences(counter: Counter, relations: List[Tuple[str, str, str, str, str]]):
+    for e1_text, e1_type, _, e2_text, e2_type in relations:
+        counter[(e1_text, e1_type, e2_text, e2_type)] += 1
+
+
+def _fulltext_terms(query_text: str) -> List[str]:
+    # plain lowercased word tokens only, so no Lucene syntax (quotes, wildcards, AND/OR/NOT) leaks in from the question
+    return list(dict.fromkeys(tokenize(query_text)))
+
+
+def _count_ingested(plan):
+    rows = {phase: len(rows) for phase, _, rows in plan}
+    CHUNKS_INGESTED.labels("graph").inc(rows.get("chunks", 0))
+    ENTITIES_INGESTED.inc(rows.get("mentions", 0))
+
+
+def _co_occurrence_rows(user_id: str, counter: Counter) -> List[Dict[str, Any]]:
+    return [
+        {"user_id": user_id, "e1_name": e1_name, "e1_type": e1_type,
+         "e2_name": e2_name, "e2_type": e2_type, "count": count}
+        for (e1_name, e1_type, e2_name, e2_type), count in counter.items()
+    ]
+
+
+def _adjacency_rows(user_id: str, counter: Counter, size: int) -> List[Dict[str, Any]]:
+    # one row per entity touched by the co-occurrence rows, with the neighbors whose counts changed,
+    # sorted so concurrent uploads take the entity locks in the same order
+    neighbors: Dict[Tuple[str, str], Dict[Tuple[str, str], None]] = {}
+    for e1_name, e1_type, e2_name, e2_type in counter:
+        if (e1_name, e1_type) == (e2_name, e2_type):
+            continue
+        neighbors.setdefault((e1_name, e1_type), {})[(e2_name, e2_type)] = None
+        neighbors.setdefault((e2_name, e2_type), {})[(e1_name, e1_type)] = None
+    return [
+        {"user_id": user_id, "name": name, "type": type_, "size": size,
+         "neighbors": [{"name": n_name, "type": n_type} for n_name, n_type in nbrs]}
+        for (name, type_), nbrs in sorted(neighbors.items())
+    ]
+
+
+class GraphDocumentWriter:
+    """
+    Streams one document into the graph: chunks from the shared chunker are
+    parsed, then written as UNWIND batches in one transaction per window.
+    No transaction stays open while NER runs, so the MERGE locks on shared
+    entities are held for one window's writes only. Like the vector writer,
+    abort() deletes whatever windows were already committed.
+    """
+
+    def __init__(self, storage: "GraphStorage", user_id: str, document_id: str, document_name: str,
+                 content_hash: str, metadata: Dict[str, Any]):
+        self.storage = storage
+        self.user_id = user_id
+        self.document_id = document_id
+        self.document_name = document_name
+        self.timings = Counter()
+        self.started = time.perf_counter()
+        self.prev_chunk_id = None
+        self.chunks_stored = 0
+        self.entities_extracted = 0
+        self.entities = set()
+
+        self.session = storage.driver.session()
+        self._commit([("documents", WRITE_DOCUMENTS, [{
+            "user_id": user_id,
+            "document_id": self.document_id,
+            "name": document_name,
+            "content_hash": content_hash,
+            "tags": metadata.get("tags") or [],
+            "description": metadata.get("description") or "",
+            "char_count": 0,
+        }])])
+
+    def _commit(self, plan):
+        with self.session.begin_transaction() as tx:
+            for phase, query, rows in plan:
+                with span("graph_write", phase=phase) as s:
+                    for batch in _batched(rows, self.storage.batch_size):
+                        tx.run(query, rows=batch).consume()
+                self.timings[phase] += s.duration_ms
+            start = time.perf_counter()
+            tx.commit()
+            self.timings["commit"] += _elapsed_ms(start)
+
+    def write(self, chunks: List[Dict[str, Any]]):
+        if not chunks:
+            return
+        chunks = [dict(chunk, document_id=self.document_id) for chunk in chunks]
+
+        start = time.perf_counter()
+        mention_rows, co_occurrences = [], Counter()
+        for chunk, (entities, relations) in zip(chunks, self.storage._extract_from_chunks(chunks)):
+            mention_rows.extend(_mention_rows(self.user_id, chunk, entities))
+            _count_co_occurrences(co_occurrences, relations)
+        self.timings["extraction"] += _elapsed_ms(start)
+
+        ids = [self.prev_chunk_id] + [chunk["id"] for chunk in chunks]
+        next_rows = [{"prev_id": prev, "curr_id": curr}
+                     for prev, curr in zip(ids, ids[1:]) if prev]
+        self.prev_chunk_id = ids[-1]
+
+        write_mentions, write_co_occurrences, write_adjacency = self.storage.entity_writes
+        self._commit([
+            ("chunks", WRITE_CHUNKS, [_chunk_row(self.user_id, c) for c in chunks]),
+            ("next_links", WRITE_NEXT_LINKS, next_rows),
+            ("mentions", write_mentions, mention_rows),
+            ("co_occurrences", write_co_occurrences, _co_occurrence_rows(self.user_id, co_occurrences)),
+            ("adjacency", write_adjacency,
+             _adjacency_rows(self.user_id, co_occurrences, self.storage.adjacency_size)),
+        ])
+        self.chunks_stored += len(chunks)
+        self.entities_extracted += len(mention_rows)
+        self.entities.update((row["name"], row["type"]) for row in mention_rows)
+
+    def close(self, char_count: int) -> Dict[str, Any]:
+        try:
+            self.session.run(SET_CHAR_COUNT, document_id=self.document_id,
+                             char_count=char_count).consume()
+        finally:
+            self.session.close()
+        CHUNKS_INGESTED.labels("graph").inc(self.chunks_stored)
+        ENTITIES_INGESTED.inc(self.entities_extracted)
+
+        timings = {phase: round(ms, 2) for phase, ms in self.timings.items()}
+        timings["total"] = _elapsed_ms(self.started)
+        logger.info(
+            f"Streamed '{self.document_name}': {self.chunks_stored} chunks, "
+            f"{self.entities_extracted} entity links in {timings['total']:.1f}ms")
+        return {
+            "document_id": self.document_id,
+            "chunks_stored": self.chunks_stored,
+            "entities_extracted": self.entities_extracted,
+            "entity_count": len(self.entities),
+            "skipped": False,
+            "timings_ms": timings,
+        }
+
+    def abort(self):
+        try:
+            self.session.close()
+        finally:
+            self.storage.delete_document(self.user_id, self.document_id)
 
 
 class GraphStorage:
@@ -21,11 +533,40 @@ class GraphStorage:
         uri: str = "bolt://neo4j:7687",
         username: str = "neo4j",
         password: str = PASSWORD,
+        batch_size: int = WRITE_BATCH_SIZE,
+        ner_batch_size: int = NER_BATCH_SIZE,
+        ner_n_process: int = NER_N_PROCESS,
+        docs_per_transaction: int = DOCS_PER_TRANSACTION,
+        adjacency_size: int = ADJACENCY_SIZE,
+        expansion_fanout: int = EXPANSION_FANOUT,
+        entity_scope: str = ENTITY_SCOPE,
+        driver=None,
     ):
-        self.driver = GraphDatabase.driver(uri, auth=(username, password))
+        if entity_scope not in ENTITY_SCOPES:
+            raise ValueError(
+                f"Unknown entity scope '{entity_scope}', expected one of {ENTITY_SCOPES}")
+        # driver can be swapped for a stand-in with the same session/transaction API (see benchmark.py)
+        self.driver = driver or GraphDatabase.driver(
+            uri, auth=(username, password))
+        self.async_driver = AsyncGraphDatabase.driver(
+            uri, auth=(username, password))
+        self.batch_size = batch_size
+        self.ner_batch_size = ner_batch_size
+        self.ner_n_process = ner_n_process
+        self.docs_per_transaction = docs_per_transaction
+        self.adjacency_size = adjacency_size
+        self.expansion_fanout = expansion_fanout
+        self.entity_scope = entity_scope
+        self.entity_writes = ENTITY_WRITES[entity_scope]
+        self.disabled_pipes = []
+        self.query_disabled_pipes = []
 
         try:
             self.model = spacy.load("en_core_web_md")
+            self.disabled_pipes = [
+                p for p in NER_DISABLED_PIPES if p in self.model.pipe_names]
+            self.query_disabled_pipes = [
+                p for p in NER_DISABLED_PIPES + ["parser"] if p in self.model.pipe_names]
             logger.info("spaCy model 'en_core_web_md' loaded successfully")
         except Exception as e:
             logger.warning(
@@ -39,12 +580,31 @@ class GraphStorage:
             "CREATE CONSTRAINT user_id IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE",
             "CREATE CONSTRAINT doc_id IF NOT EXISTS FOR (d:Document) REQUIRE d.id IS UNIQUE",
             "CREATE CONSTRAINT chunk_id IF NOT EXISTS FOR (c:Chunk) REQUIRE c.id IS UNIQUE",
-            "CREATE CONSTRAINT entity_key IF NOT EXISTS FOR (e:Entity) REQUIRE (e.name, e.type) IS NODE KEY",
             "CREATE INDEX doc_hash IF NOT EXISTS FOR (d:Document) ON (d.content_hash)",
             "CREATE INDEX entity_name IF NOT EXISTS FOR (e:Entity) ON (e.name)",
             "CREATE INDEX chunk_doc IF NOT EXISTS FOR (c:Chunk) ON (c.document_id)",
+            f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX} IF NOT EXISTS FOR (c:Chunk) ON EACH [c.text, c.owner_key]",
+        ]
+        # the per-user key tolerates global entities without user_id, so it is kept in both scopes
+        constraints_and_indexes += [
+            "CREATE CONSTRAINT entity_user_key IF NOT EXISTS FOR (e:Entity) "
+            "REQUIRE (e.user_id, e.name, e.type) IS UNIQUE",
+            "CREATE INDEX entity_user_normalized IF NOT EXISTS FOR (e:Entity) ON (e.user_id, e.normalized)",
         ]
+        if self.entity_scope == "user":
+            # the global (name, type) key would forbid two users' copies of an entity
+            constraints_and_indexes.append("DROP CONSTRAINT entity_key IF EXISTS")
+        else:
+            # recreated when switching back from the user scope
+            constraints_and_indexes.append(
+                "CREATE CONSTRAINT entity_key IF NOT EXISTS FOR (e:Entity) REQUIRE (e.name, e.type) IS NODE KEY")
         with self.driver.session() as session:
+            if self.entity_scope == "global" and session.run(USER_SCOPED_ENTITY).single():
+                # the global key cannot be created over users' copies, and the global
+                # MERGEs would match them without it
+                raise RuntimeError(
+                    "GRAPH_ENTITY_SCOPE=global but the graph holds user-scoped entities, "
+                    "keep GRAPH_ENTITY_SCOPE=user")
             for stmt in constraints_and_indexes:
                 try:
                     session.run(stmt)
@@ -53,42 +613,8 @@ class GraphStorage:
                         f"Schema statement skipped (may already exist): {e}")
         logger.info("Neo4j schema initialized")
 
-    def _chunk_text(self, text: str) -> List[Dict[str, Any]]:
-        # splits to overlapping chunks, sentences if possible
-        text = re.sub(r'\s+', ' ', text).strip()
-
-        chunks = []
-        start = 0
-        chunk_index = 0
-
-        while start < len(text):
-            end = start + CHUNK_SIZE
-
-            if end < len(text):
-                boundary = text.rfind('.', start + CHUNK_SIZE // 2, end)
-                if boundary == -1:
-                    boundary = text.rfind(' ', start + CHUNK_SIZE // 2, end)
-                if boundary != -1:
-                    end = boundary + 1
-
-            chunk_text = text[start:end].strip()
-            if chunk_text:
-                chunks.append({
-                    "index": chunk_index,
-                    "text": chunk_text,
-                    "start_char": start,
-                    "end_char": end,
-                })
-                chunk_index += 1
-
-            start = end - CHUNK_OVERLAP
-
-        return chunks
-
-    def _extract_entities(self, text: str) -> List[Dict[str, Any]]:
-        if self.model is None:
-            return []
-        doc = self.model(text)
+    @staticmethod
+    def _entities_from_doc(doc) -> List[Dict[str, Any]]:
         seen = set()
         entities = []
         for ent in doc.ents:
@@ -105,13 +631,9 @@ class GraphStorage:
             })
         return entities
 
-    def _extract_entity_relations(self, text: str) -> List[Tuple[str, str, str, str, str]]:
-        if self.model is None:
-            return []
-
-        doc = self.model(text)
+    @staticmethod
+    def _relations_from_doc(doc) -> List[Tuple[str, str, str, str, str]]:
         relations = []
-
         for sent in doc.sents:
             sent_ents = [e for e in sent.ents]
             for i, e1 in enumerate(sent_ents):
@@ -122,28 +644,222 @@ class GraphStorage:
                             "CO_OCCURS_WITH",
                             e2.text.strip(), e2.label_,
                         ))
-
         return relations
 
-    def _document_exists(self, user_id: str, content_hash: str) -> bool:
+    def _extract_entities(self, text: str) -> List[Dict[str, Any]]:
+        if self.model is None:
+            return []
+        # queries only need entities, so the parser is skipped as well
+        doc = self.model(text, disable=self.query_disabled_pipes)
+        return self._entities_from_doc(doc)
+
+    def _extract_from_chunks(
+        self, chunks: List[Dict[str, Any]]
+    ) -> List[Tuple[List[Dict[str, Any]], List[Tuple[str, str, str, str, str]]]]:
+        # one nlp.pipe pass over every chunk, each doc yields entities and co-occurrences
+        if self.model is None:
+            return [([], []) for _ in chunks]
+        with span("ner", chunks=len(chunks)):
+            docs = self.model.pipe(
+                (chunk["text"] for chunk in chunks),
+                batch_size=self.ner_batch_size,
+                n_process=self.ner_n_process,
+                disable=self.disabled_pipes,
+            )
+            return [(self._entities_from_doc(doc), self._relations_from_doc(doc)) for doc in docs]
+
+    @staticmethod
+    def _log_duplicate(content_hash: str, record) -> bool:
+        if not record:
+            return False
+        logger.warning(
+            f"Duplicate: hash {content_hash[:12]}... already exists "
+            f"as '{record['document_name']}' (id: {record['document_id']})"
+        )
+        return True
+
+    def document_exists(self, user_id: str, content_hash: str) -> bool:
         with self.driver.session() as session:
             result = session.run(
-                """
-                MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document {content_hash: $content_hash})
-                RETURN d.id as document_id, d.name as document_name
-                LIMIT 1
-                """,
-                user_id=user_id,
-                content_hash=content_hash,
-            )
-            record = result.single()
-            if record:
-                logger.warning(
-                    f"Duplicate: hash {content_hash[:12]}... already exists "
-                    f"as '{record['document_name']}' (id: {record['document_id']})"
-                )
-                return True
-        return False
+                DOCUMENT_EXISTS, user_id=user_id, content_hash=content_hash)
+            return self._log_duplicate(content_hash, result.single())
+
+    async def adocument_exists(self, user_id: str, content_hash: str) -> bool:
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                DOCUMENT_EXISTS, user_id=user_id, content_hash=content_hash)
+            return self._log_duplicate(content_hash, await result.single())
+
+    def _prepare_documents(self, user_id: str, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # chunking and NER only, no database access, so it can run in a worker pool.
+        # documents carry document_name, content, metadata and content_hash,
+        # optionally document_id and chunks from the shared chunker
+        timings = {}
+
+        start = time.perf_counter()
+        prepared, all_chunks = [], []
+        for document in documents:
+            # chunks and document id come from the shared upload pipeline when present
+            document_id = document.get("document_id") or str(uuid.uuid4())
+            chunks = document.get("chunks")
+            if chunks is None:
+                chunks = assign_chunk_ids(split_text(
+                    document["content"]), user_id, document["content_hash"])
+            chunks = [dict(chunk, document_id=document_id) for chunk in chunks]
+            all_chunks.extend(chunks)
+            prepared.append({
+                "document_id": document_id,
+                "document_name": document["document_name"],
+                "content_hash": document["content_hash"],
+                "chunks": chunks,
+                "chunks_stored": len(chunks),
+                "entities_extracted": 0,
+                "entity_count": 0,
+            })
+            logger.info(
+                f"Created {len(chunks)} chunks for '{document['document_name']}'")
+        timings["chunking"] = _elapsed_ms(start)
+
+        # every chunk of every document goes through a single nlp.pipe stream
+        start = time.perf_counter()
+        extractions = iter(self._extract_from_chunks(all_chunks))
+        mention_rows = []
+        co_occurrences = Counter()
+        for doc in prepared:
+            distinct = set()
+            for chunk in doc["chunks"]:
+                entities, relations = next(extractions)
+                mention_rows.extend(_mention_rows(user_id, chunk, entities))
+                _count_co_occurrences(co_occurrences, relations)
+                doc["entities_extracted"] += len(entities)
+                distinct.update((ent["text"], ent["label"]) for ent in entities)
+            doc["entity_count"] = len(distinct)
+        timings["extraction"] = _elapsed_ms(start)
+
+        document_rows = [
+            {
+                "user_id": user_id,
+                "document_id": doc["document_id"],
+                "name": document["document_name"],
+                "content_hash": document["content_hash"],
+                "tags": document["metadata"].get("tags") or [],
+                "description": document["metadata"].get("description") or "",
+                "char_count": len(document["content"]),
+            }
+            for doc, document in zip(prepared, documents)
+        ]
+        chunk_rows = [_chunk_row(user_id, chunk) for chunk in all_chunks]
+        next_rows = [
+            {"prev_id": prev["id"], "curr_id": curr["id"]}
+            for doc in prepared
+            for prev, curr in zip(doc["chunks"], doc["chunks"][1:])
+        ]
+        co_occurrence_rows = _co_occurrence_rows(user_id, co_occurrences)
+        adjacency_rows = _adjacency_rows(user_id, co_occurrences, self.adjacency_size)
+        write_mentions, write_co_occurrences, write_adjacency = self.entity_writes
+
+        for doc in prepared:
+            del doc["chunks"]
+
+        return {
+            "documents": prepared,
+            "chunks_stored": len(all_chunks),
+            "entities_extracted": len(mention_rows),
+            "timings": timings,
+            "plan": [
+                ("documents", WRITE_DOCUMENTS, document_rows),
+                ("chunks", WRITE_CHUNKS, chunk_rows),
+                ("next_links", WRITE_NEXT_LINKS, next_rows),
+                ("mentions", write_mentions, mention_rows),
+                ("co_occurrences", write_co_occurrences, co_occurrence_rows),
+                ("adjacency", write_adjacency, adjacency_rows),
+            ],
+        }
+
+    def _write_plan(self, plan, timings: Dict[str, float]):
+        # one explicit transaction, each phase sent as UNWIND batches
+        with span("graph_write"), self.driver.session() as session:
+            with session.begin_transaction() as tx:
+                for phase, query, rows in plan:
+                    start = time.perf_counter()
+                    for batch in _batched(rows, self.batch_size):
+                        tx.run(query, rows=batch).consume()
+                    timings[phase] = _elapsed_ms(start)
+                start = time.perf_counter()
+                tx.commit()
+                timings["commit"] = _elapsed_ms(start)
+        _count_ingested(plan)
+
+    async def _awrite_plan(self, plan, timings: Dict[str, float]):
+        with span("graph_write"):
+            async with self.async_driver.session() as session:
+                async with await session.begin_transaction() as tx:
+                    for phase, query, rows in plan:
+                        start = time.perf_counter()
+                        for batch in _batched(rows, self.batch_size):
+                            result = await tx.run(query, rows=batch)
+                            await result.consume()
+                        timings[phase] = _elapsed_ms(start)
+                    start = time.perf_counter()
+                    await tx.commit()
+                    timings["commit"] = _elapsed_ms(start)
+        _count_ingested(plan)
+
+    @staticmethod
+    def _skipped_result() -> Dict[str, Any]:
+        return {
+            "document_id": None,
+            "chunks_stored": 0,
+            "entities_extracted": 0,
+            "entity_count": 0,
+            "skipped": True,
+            "reason": "duplicate",
+        }
+
+    @staticmethod
+    def _resumed_result(stored, started: float) -> Dict[str, Any]:
+        # the write committed on an earlier attempt, reported as stored instead of
+        # failing on the document id constraint
+        logger.info(f"Document {stored['document_id']} was already written, not writing it again")
+        return {
+            "document_id": stored["document_id"],
+            "chunks_stored": stored["chunks_stored"],
+            "entities_extracted": stored["entities_extracted"],
+            "entity_count": stored["entity_count"],
+            "skipped": False,
+            "timings_ms": {"total": _elapsed_ms(started)},
+        }
+
+    @staticmethod
+    def _stored_result(prepared: Dict[str, Any], started: float) -> Dict[str, Any]:
+        doc = prepared["documents"][0]
+        timings = prepared["timings"]
+        timings["total"] = _elapsed_ms(started)
+        logger.info(
+            f"Stored '{doc['document_name']}': {doc['chunks_stored']} chunks, "
+            f"{doc['entities_extracted']} entity links in {timings['total']:.1f}ms"
+        )
+        return {
+            "document_id": doc["document_id"],
+            "chunks_stored": doc["chunks_stored"],
+            "entities_extracted": doc["entities_extracted"],
+            "entity_count": doc["entity_count"],
+            "skipped": False,
+            "timings_ms": timings,
+        }
+
+    @staticmethod
+    def _document_input(document_name: str, content: str, metadata: Dict[str, Any],
+                        prepared: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        prepared = prepared or {}
+        return {
+            "document_name": document_name,
+            "content": content,
+            "metadata": metadata,
+            "content_hash": prepared.get("content_hash") or hashlib.sha256(content.encode()).hexdigest(),
+            "document_id": prepared.get("document_id"),
+            "chunks": prepared.get("chunks"),
+        }
 
     def add_document(
         self,
@@ -151,225 +867,207 @@ class GraphStorage:
         document_name: str,
         content: str,
         metadata: Dict[str, Any],
+        prepared: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
-
-        content_hash = hashlib.sha256(content.encode()).hexdigest()
+        started = time.perf_counter()
+        document = self._document_input(
+            document_name, content, metadata, prepared)
+        content_hash = document["content_hash"]
         logger.info(
             f"adding '{document_name}' for user {user_id}, hash: {content_hash[:12]}")
 
-        if self._document_exists(user_id, content_hash):
-            return {
-                "document_id": None,
-                "chunks_stored": 0,
-                "entities_extracted": 0,
-                "skipped": True,
-                "reason": "duplicate",
-            }
+        # the repository's duplicate index has already been consulted for prepared uploads
+        if not (prepared or {}).get("deduplicated") and self.document_exists(user_id, content_hash):
+            return self._skipped_result()
+        if (prepared or {}).get("resume"):
+            with self.driver.session() as session:
+                stored = session.run(STORED_DOCUMENT, user_id=user_id,
+                                     document_id=document["document_id"]).single()
+            if stored:
+                return self._resumed_result(stored, started)
 
-        document_id = str(uuid.uuid4())
+        prepared = self._prepare_documents(user_id, [document])
+        self._write_plan(prepared["plan"], prepared["timings"])
+        return self._stored_result(prepared, started)
 
-        with self.driver.session() as session:
-            session.run(
-                """
-                MERGE (u:User {id: $user_id})
-                CREATE (d:Document {
-                    id: $document_id,
-                    name: $document_name,
-                    content_hash: $content_hash,
-                    upload_time: datetime(),
-                    tags: $tags,
-                    description: $description,
-                    char_count: $char_count
-                })
-                MERGE (u)-[:UPLOADED]->(d)
-                """,
-                user_id=user_id,
-                document_id=document_id,
-                document_name=document_name,
-                content_hash=content_hash,
-                tags=metadata.get("tags") or [],
-                description=metadata.get("description") or "",
-                char_count=len(content),
-            )
+    async def aadd_document(
+        self,
+        user_id: str,
+        document_name: str,
+        content: str,
+        metadata: Dict[str, Any],
+        executor=None,
+        prepared: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        started = time.perf_counter()
+        document = self._document_input(
+            document_name, content, metadata, prepared)
+        content_hash = document["content_hash"]
+        logger.info(
+            f"adding '{document_name}' for user {user_id}, hash: {content_hash[:12]}")
 
-        chunks = self._chunk_text(content)
-        logger.info(f"Created {len(chunks)} chunks for '{document_name}'")
+        if not (prepared or {}).get("deduplicated") and await self.adocument_exists(user_id, content_hash):
+            return self._skipped_result()
+        if (prepared or {}).get("resume"):
+            async with self.async_driver.session() as session:
+                result = await session.run(STORED_DOCUMENT, user_id=user_id,
+                                           document_id=document["document_id"])
+                stored = await result.single()
+            if stored:
+                return self._resumed_result(stored, started)
 
-        with self.driver.session() as session:
-            for chunk in chunks:
-                chunk_id = str(uuid.uuid4())
-                session.run(
-                    """
-                    MATCH (d:Document {id: $document_id})
-                    CREATE (c:Chunk {
-                        id: $chunk_id,
-                        document_id: $document_id,
-                        index: $chunk_index,
-                        text: $text,
-                        start_char: $start_char,
-                        end_char: $end_char
-                    })
-                    CREATE (d)-[:HAS_CHUNK {index: $chunk_index}]->(c)
-                    """,
-                    document_id=document_id,
-                    chunk_id=chunk_id,
-                    chunk_index=chunk["index"],
-                    text=chunk["text"],
-                    start_char=chunk["start_char"],
-                    end_char=chunk["end_char"],
-                )
+        prepared = await run_in_executor(
+            executor, self._prepare_documents, user_id, [document])
+        await self._awrite_plan(prepared["plan"], prepared["timings"])
+        return self._stored_result(prepared, started)
 
-                if chunk["index"] > 0:
-                    session.run(
-                        """
-                        MATCH (d:Document {id: $document_id})-[:HAS_CHUNK {index: $prev_index}]->(prev:Chunk)
-                        MATCH (d)-[:HAS_CHUNK {index: $curr_index}]->(curr:Chunk)
-                        CREATE (prev)-[:NEXT]->(curr)
-                        """,
-                        document_id=document_id,
-                        prev_index=chunk["index"] - 1,
-                        curr_index=chunk["index"],
-                    )
-
-        total_entities = 0
-        with self.driver.session() as session:
-            for chunk in chunks:
-                entities = self._extract_entities(chunk["text"])
-                for ent in entities:
-                    session.run(
-                        """
-                        MERGE (e:Entity {name: $name, type: $type})
-                        ON CREATE SET
-                            e.normalized = $normalized,
-                            e.created_at = datetime()
-                        WITH e
-                        MATCH (d:Document {id: $document_id})-[:HAS_CHUNK {index: $chunk_index}]->(c:Chunk)
-                        MERGE (c)-[:MENTIONS {position: $position}]->(e)
-                        MERGE (d)-[:MENTIONS]->(e)
-                        """,
-                        name=ent["text"],
-                        type=ent["label"],
-                        normalized=ent["normalized"],
-                        document_id=document_id,
-                        chunk_index=chunk["index"],
-                        position=ent["start"],
-                    )
-                    total_entities += 1
-
-                relations = self._extract_entity_relations(chunk["text"])
-                for e1_text, e1_type, rel_type, e2_text, e2_type in relations:
-                    session.run(
-                        """
-                        MERGE (e1:Entity {name: $e1_name, type: $e1_type})
-                        MERGE (e2:Entity {name: $e2_name, type: $e2_type})
-                        MERGE (e1)-[r:CO_OCCURS_WITH]->(e2)
-                        ON CREATE SET r.count = 1, r.first_seen = datetime()
-                        ON MATCH SET r.count = r.count + 1
-                        """,
-                        e1_name=e1_text,
-                        e1_type=e1_type,
-                        e2_name=e2_text,
-                        e2_type=e2_type,
-                    )
+    def open_writer(self, user_id: str, document_id: str, document_name: str, content_hash: str,
+                    metadata: Dict[str, Any]) -> GraphDocumentWriter:
+        return GraphDocumentWriter(self, user_id, document_id, document_name, content_hash, metadata)
+
+    async def aadd_documents(
+        self,
+        user_id: str,
+        documents: List[Dict[str, Any]],
+        executor=None,
+    ) -> Dict[str, Any]:
+        """
+        Bulk ingest of already deduplicated documents (each with document_name,
+        content, metadata and content_hash). NER runs as one nlp.pipe stream per
+        transaction group of docs_per_transaction documents. A failed group is
+        rolled back on its own, its documents' results carry the error and the
+        groups before and after it are stored normally.
+        """
+        started = time.perf_counter()
+        stored, timings = [], Counter()
+
+        for group in _batched(documents, self.docs_per_transaction):
+            try:
+                prepared = await run_in_executor(
+                    executor, self._prepare_documents, user_id, group)
+                await self._awrite_plan(prepared["plan"], prepared["timings"])
+            except Exception as e:
+                logger.error(
+                    f"Graph write of {len(group)} documents failed for user {user_id}: {e}", exc_info=True)
+                stored.extend({
+                    "document_id": None,
+                    "document_name": document["document_name"],
+                    "content_hash": document["content_hash"],
+                    "chunks_stored": 0,
+                    "entities_extracted": 0,
+                    "entity_count": 0,
+                    "error": str(e),
+                } for document in group)
+                continue
+            stored.extend(prepared["documents"])
+            timings.update(prepared["timings"])
 
+        timings = {phase: round(ms, 2) for phase, ms in timings.items()}
+        timings["total"] = _elapsed_ms(started)
         logger.info(
-            f"Stored '{document_name}': {len(chunks)} chunks, {total_entities} entity links"
+            f"Stored {sum(1 for d in stored if 'error' not in d)} documents for user {user_id}: "
+            f"{sum(d['chunks_stored'] for d in stored)} chunks in {timings['total']:.1f}ms"
         )
+        return {"documents": stored, "timings_ms": timings}
+
+    @staticmethod
+    def _format_query_record(record) -> Dict[str, Any]:
+        chunk = record["c"]
+        doc = record["d"]
+        direct_ents = record["direct_entities"]
+        expanded_ents = record["expanded_entities"]
+
         return {
-            "document_id": document_id,
-            "chunks_stored": len(chunks),
-            "entities_extracted": total_entities,
-            "skipped": False,
+            "chunk": {
+                "id": chunk["id"],
+                "text": chunk["text"],
+                "index": chunk["index"],
+            },
+            "document": {
+                "id": doc["id"],
+                "name": doc["name"],
+                "upload_time": _format_time(doc["upload_time"]),
+            },
+            "entities": {
+                "direct": [
+                    {"name": e["name"], "type": e["type"]}
+                    for e in direct_ents if e is not None
+                ],
+                # neighbor lists of several entities in the chunk can overlap
+                "expanded": [
+                    {"name": name, "type": type_}
+                    for name, type_ in dict.fromkeys(
+                        (e["name"], e["type"]) for e in expanded_ents if e is not None)
+                ],
+            },
+            "score": record["direct_score"],
+        }
+
+    def _query_statement(self, user_id: str, query_text: str, query_entities: List[Dict[str, Any]]):
+        if query_entities:
+            return QUERY_BY_ENTITIES, {
+                "user_id": user_id,
+                "entity_names": [e["text"] for e in query_entities],
+                "entity_normalized": [e["normalized"] for e in query_entities],
+                "limit": QUERY_LIMIT,
+                "fanout": self.expansion_fanout,
+            }
+        terms = _fulltext_terms(query_text)
+        if not terms:
+            return None, {}
+        return QUERY_BY_TEXT, {
+            "user_id": user_id,
+            "index": FULLTEXT_INDEX,
+            "owner_key": owner_key(user_id),
+            "terms": terms,
+            "candidates": max(FULLTEXT_CANDIDATES, QUERY_LIMIT),
+            "limit": QUERY_LIMIT,
         }
 
-    def query(self, user_id: str, query_text: str) -> List[Dict[str, Any]]:
+    def query(self, user_id: str, query_text: str,
+              timings: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
         """
         Query strategy:
         1. extract entities from the query
         2. if entities found, match chunks that mention those entities,
-        3. expand with CO_OCCURS_WITH to find related entities and more chunks
-        3. if no entities, fall back to text containment search on chunks
-        returns chunks
+        3. expand with the top co-occurring neighbors precomputed on each entity
+        3. if no entities, fall back to the BM25-ranked full-text index on chunk text
+        returns chunks, timings (if given) gets graph_entities and graph_search in ms
         """
-        query_entities = self._extract_entities(query_text)
+        timings = {} if timings is None else timings
+        with span("graph_entities") as s:
+            query_entities = self._extract_entities(query_text)
+        timings["graph_entities"] = s.duration_ms
+        statement, params = self._query_statement(
+            user_id, query_text, query_entities)
+        if statement is None:
+            return []
 
-        with self.driver.session() as session:
-            if query_entities:
-                entity_names = [e["text"] for e in query_entities]
-                entity_normalized = [e["normalized"] for e in query_entities]
+        with span("graph_search", entities=len(query_entities)) as s:
+            with self.driver.session() as session:
+                result = session.run(statement, **params)
+                records = [self._format_query_record(record) for record in result]
+        timings["graph_search"] = s.duration_ms
+        return records
 
-                result = session.run(
-                    """
-                    MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                    MATCH (c)-[:MENTIONS]->(e:Entity)
-                    WHERE e.name IN $entity_names OR e.normalized IN $entity_normalized
-                    WITH c, d, COLLECT(DISTINCT e) as direct_entities, COUNT(DISTINCT e) as direct_score
-
-                    OPTIONAL MATCH (c)-[:MENTIONS]->(e2:Entity)-[:CO_OCCURS_WITH]-(related:Entity)
-                    WITH c, d, direct_entities, direct_score,
-                         COLLECT(DISTINCT related) as expanded_entities
-
-                    RETURN c, d,
-                           direct_entities,
-                           expanded_entities,
-                           direct_score
-                    ORDER BY direct_score DESC
-                    LIMIT 15
-                    """,
-                    user_id=user_id,
-                    entity_names=entity_names,
-                    entity_normalized=entity_normalized,
-                )
-            else:
-                result = session.run(
-                    """
-                    MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document)-[:HAS_CHUNK]->(c:Chunk)
-                    WHERE toLower(c.text) CONTAINS toLower($query_text)
-                    OPTIONAL MATCH (c)-[:MENTIONS]->(e:Entity)
-                    WITH c, d, COLLECT(DISTINCT e) as direct_entities
-                    RETURN c, d, direct_entities, [] as expanded_entities, 0 as direct_score
-                    LIMIT 15
-                    """,
-                    user_id=user_id,
-                    query_text=query_text,
-                )
-
-            results = []
-            for record in result:
-                chunk = record["c"]
-                doc = record["d"]
-                direct_ents = record["direct_entities"]
-                expanded_ents = record["expanded_entities"]
-
-                results.append({
-                    "chunk": {
-                        "id": chunk["id"],
-                        "text": chunk["text"],
-                        "index": chunk["index"],
-                    },
-                    "document": {
-                        "id": doc["id"],
-                        "name": doc["name"],
-                        "upload_time": (
-                            doc["upload_time"].isoformat()
-                            if hasattr(doc["upload_time"], "isoformat")
-                            else str(doc["upload_time"])
-                        ),
-                    },
-                    "entities": {
-                        "direct": [
-                            {"name": e["name"], "type": e["type"]}
-                            for e in direct_ents if e is not None
-                        ],
-                        "expanded": [
-                            {"name": e["name"], "type": e["type"]}
-                            for e in expanded_ents if e is not None
-                        ],
-                    },
-                    "score": record["direct_score"],
-                })
+    async def aquery(self, user_id: str, query_text: str, executor=None,
+                     timings: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+        timings = {} if timings is None else timings
+        with span("graph_entities") as s:
+            query_entities = await run_in_executor(
+                executor, self._extract_entities, query_text)
+        timings["graph_entities"] = s.duration_ms
+        statement, params = self._query_statement(
+            user_id, query_text, query_entities)
+        if statement is None:
+            return []
 
-            return results
+        with span("graph_search", entities=len(query_entities)) as s:
+            async with self.async_driver.session() as session:
+                result = await session.run(statement, **params)
+                records = [self._format_query_record(record) async for record in result]
+        timings["graph_search"] = s.duration_ms
+        return records
 
     # future work, when more information needed on subject
 
@@ -399,40 +1097,126 @@ class GraphStorage:
 
         return enriched
 
-    def list_documents(self, user_id: str) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _format_document_record(record) -> Dict[str, Any]:
+        doc = record["d"]
+        return {
+            "id": doc["id"],
+            "name": doc["name"],
+            "content_hash": doc.get("content_hash"),
+            "upload_time": _format_time(doc["upload_time"]),
+            "tags": doc.get("tags", []),
+            "description": doc.get("description", ""),
+            "char_count": doc.get("char_count", 0),
+            "chunk_count": record["chunk_count"],
+            "entity_count": record["entity_count"],
+        }
+
+    def list_documents(self, user_id: str, limit: Optional[int] = 50) -> List[Dict[str, Any]]:
+        # aggregates over every chunk and entity of the user, the document catalog serves listings
         with self.driver.session() as session:
-            result = session.run(
-                """
-                MATCH (u:User {id: $user_id})-[:UPLOADED]->(d:Document)
-                OPTIONAL MATCH (d)-[:HAS_CHUNK]->(c:Chunk)
-                OPTIONAL MATCH (d)-[:MENTIONS]->(e:Entity)
-                WITH d,
-                     COUNT(DISTINCT c) as chunk_count,
-                     COUNT(DISTINCT e) as entity_count
-                RETURN d, chunk_count, entity_count
-                ORDER BY d.upload_time DESC
-                LIMIT 50
-                """,
-                user_id=user_id,
-            )
-            documents = []
-            for record in result:
-                doc = record["d"]
-                documents.append({
-                    "id": doc["id"],
-                    "name": doc["name"],
-                    "upload_time": (
-                        doc["upload_time"].isoformat()
-                        if hasattr(doc["upload_time"], "isoformat")
-                        else str(doc["upload_time"])
-                    ),
-                    "tags": doc.get("tags", []),
-                    "description": doc.get("description", ""),
-                    "char_count": doc.get("char_count", 0),
-                    "chunk_count": record["chunk_count"],
-                    "entity_count": record["entity_count"],
-                })
-            return documents
+            result = session.run(LIST_DOCUMENTS, user_id=user_id, limit=limit)
+            return [self._format_document_record(record) for record in result]
+
+    async def alist_documents(self, user_id: str, limit: Optional[int] = 50) -> List[Dict[str, Any]]:
+        async with self.async_driver.session() as session:
+            result = await session.run(LIST_DOCUMENTS, user_id=user_id, limit=limit)
+            return [self._format_document_record(record) async for record in result]
+
+    def backfill_chunk_owners(self, batch_size: int = 10000) -> int:
+        """
+        Sets owner_key on chunks written before it was stored, batch_size
+        chunks per transaction. Until then such chunks are invisible to the
+        full-text fallback. Returns the number of chunks updated.
+        A one-off migration, run from the backfill endpoint.
+        """
+        updated = 0
+        with self.driver.session() as session:
+            while True:
+                rows = [{"chunk": record["chunk"], "owner_key": owner_key(record["user_id"])}
+                        for record in session.run(CHUNKS_WITHOUT_OWNER, batch_size=batch_size)]
+                if not rows:
+                    break
+                session.run(SET_CHUNK_OWNERS, rows=rows).consume()
+                updated += len(rows)
+        logger.info(f"Backfilled owner_key of {updated} chunks")
+        return updated
+
+    def backfill_adjacency(self, batch_size: int = 1000) -> int:
+        """
+        Computes the nbr_* adjacency lists of entities written before they
+        were maintained on ingest, batch_size entities per transaction.
+        Returns the number of entities updated.
+        """
+        updated = 0
+        with self.driver.session() as session:
+            while True:
+                record = session.run(BACKFILL_ADJACENCY, batch_size=batch_size,
+                                     size=self.adjacency_size).single()
+                if not record or not record["updated"]:
+                    break
+                updated += record["updated"]
+        logger.info(f"Backfilled adjacency lists of {updated} entities")
+        return updated
+
+    def migrate_entity_scope(self, user_id: str) -> Dict[str, int]:
+        """
+        Moves one user's documents from global entities to user-scoped ones.
+        Global co-occurrence counts cannot be split by tenant, so each document
+        still linked to a global entity has its stored chunk text re-extracted
+        and written with the user-scoped entity writes, in one transaction with
+        dropping its links to the global entities. Migrated documents have no
+        such links left, so an interrupted run can simply be repeated.
+        """
+        if self.entity_scope != "user":
+            raise ValueError("Entity scope migration needs GRAPH_ENTITY_SCOPE=user")
+        if self.model is None:
+            raise RuntimeError("Entity scope migration needs the spaCy model to re-extract entities")
+
+        with self.driver.session() as session:
+            document_ids = [record["document_id"] for record in session.run(
+                LEGACY_ENTITY_DOCUMENTS, user_id=user_id)]
+
+        write_mentions, write_co_occurrences, write_adjacency = self.entity_writes
+        migrated, mentions = 0, 0
+        for document_id in document_ids:
+            with self.driver.session() as session:
+                chunks = [dict(record, document_id=document_id) for record in session.run(
+                    DOCUMENT_CHUNKS, document_id=document_id)]
+            mention_rows, co_occurrences = [], Counter()
+            for chunk, (entities, relations) in zip(chunks, self._extract_from_chunks(chunks)):
+                mention_rows.extend(_mention_rows(user_id, chunk, entities))
+                _count_co_occurrences(co_occurrences, relations)
+            self._write_plan([
+                ("legacy_mentions", DELETE_LEGACY_MENTIONS, [{"document_id": document_id}]),
+                ("mentions", write_mentions, mention_rows),
+                ("co_occurrences", write_co_occurrences, _co_occurrence_rows(user_id, co_occurrences)),
+                ("adjacency", write_adjacency,
+                 _adjacency_rows(user_id, co_occurrences, self.adjacency_size)),
+            ], {})
+            migrated += 1
+            mentions += len(mention_rows)
+        logger.info(
+            f"Migrated {migrated} documents of user {user_id} to user-scoped entities, "
+            f"{mentions} entity links written")
+        return {"documents": migrated, "mentions": mentions}
+
+    def delete_orphaned_global_entities(self, batch_size: int = 1000) -> int:
+        # after every user is migrated, removes global entities and their shared co-occurrence edges
+        deleted = 0
+        with self.driver.session() as session:
+            while True:
+                record = session.run(
+                    DELETE_ORPHANED_GLOBAL_ENTITIES, batch_size=batch_size).single()
+                if not record or not record["deleted"]:
+                    break
+                deleted += record["deleted"]
+        logger.info(f"Deleted {deleted} global entities no document mentions")
+        return deleted
+
+    def list_user_ids(self) -> List[str]:
+        with self.driver.session() as session:
+            return [record["id"] for record in session.run("MATCH (u:User) RETURN u.id as id")]
 
     def get_entity_graph(self, user_id: str, entity_name: str, depth: int = 2) -> Dict[str, Any]:
         with self.driver.session() as session:
@@ -488,3 +1272,7 @@ class GraphStorage:
 
     def close(self):
         self.driver.close()
+
+    async def aclose(self):
+        self.driver.close()
+        await self.async_driver.close()
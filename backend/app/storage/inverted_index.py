@@ -0,0 +1,87 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import heapq
+import math
+import re
+
+# Lucene's BM25Similarity defaults, so local scores rank like the Neo4j full-text index
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    # close to Lucene's standard analyzer without stop words: unicode word runs, lowercased
+    return _TOKEN_RE.findall(text.lower())
+
+
+def bm25_idf(doc_count: int, doc_freq: int) -> float:
+    return math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def bm25_term(tf: int, length: int, avg_length: float, k1: float = BM25_K1, b: float = BM25_B) -> float:
+    return tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+
+
+class InvertedIndex:
+    """
+    In-memory BM25 inverted index over short texts keyed by id. A query only
+    walks the postings of its own terms, not every indexed text. Stands in
+    for the Neo4j full-text index where no database is available.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, key: str, text: str):
+        if key in self.lengths:
+            self.remove(key)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[key] = tf
+        length = sum(terms.values())
+        self.lengths[key] = length
+        self.total_length += length
+
+    def remove(self, key: str, text: Optional[str] = None):
+        # without the text every posting list is checked
+        length = self.lengths.pop(key, None)
+        if length is None:
+            return
+        self.total_length -= length
+        terms = set(tokenize(text)) if text is not None else list(self.postings)
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings and postings.pop(key, None) is not None and not postings:
+                del self.postings[term]
+
+    def search(self, query: str, limit: int = 10, keys: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Returns up to limit (key, score) pairs, best first. Any query term
+        matches (OR semantics, like Lucene's default operator); keys, when
+        given, restricts the hits to that set.
+        """
+        if not self.lengths:
+            return []
+        allowed = set(keys) if keys is not None else None
+        avg_length = self.total_length / len(self.lengths) or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = bm25_idf(len(self.lengths), len(postings))
+            for key, tf in postings.items():
+                if allowed is not None and key not in allowed:
+                    continue
+                scores[key] = scores.get(key, 0.0) + idf * bm25_term(
+                    tf, self.lengths[key], avg_length, self.k1, self.b)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
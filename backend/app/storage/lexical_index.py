@@ -0,0 +1,197 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import sqlite3
+import threading
+import os
+
+from logger import get_logger
+from storage.inverted_index import BM25_B, BM25_K1, bm25_idf, bm25_term, tokenize
+
+logger = get_logger("lexical_index")
+
+LEXICAL_INDEX_ENABLED = os.environ.get(
+    "LEXICAL_INDEX_ENABLED", "true").lower() == "true"
+LEXICAL_INDEX_PATH = os.environ.get(
+    "LEXICAL_INDEX_PATH", "./app_data/lexical.db")
+
+
+class LexicalIndex:
+    """
+    Per-user BM25 inverted index over vector store chunks, on disk in SQLite.
+    Postings are keyed (user_id, term, chunk_id), so a query reads only the
+    posting ranges of its own terms, and per-user chunk and length totals
+    give the BM25 document count and average length without a scan.
+    Chunk ids are the content-addressed ids Chroma stores, hits are
+    resolved to text and metadata there.
+    """
+
+    def __init__(self, db_path: str = LEXICAL_INDEX_PATH, k1: float = BM25_K1, b: float = BM25_B):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._init_schema()
+        logger.info(f"Lexical index ready at {db_path}")
+
+    def _init_schema(self):
+        with self.lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lexical_chunks (
+                    user_id TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    document_id TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, chunk_id)
+                ) WITHOUT ROWID
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lexical_postings (
+                    user_id TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, term, chunk_id)
+                ) WITHOUT ROWID
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lexical_stats (
+                    user_id TEXT PRIMARY KEY,
+                    chunk_count INTEGER NOT NULL,
+                    total_length INTEGER NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS lexical_chunks_document ON lexical_chunks (user_id, document_id)")
+
+    def _adjust_stats(self, user_id: str, chunks: int, length: int):
+        self.conn.execute(
+            """
+            INSERT INTO lexical_stats (user_id, chunk_count, total_length) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                chunk_count = chunk_count + excluded.chunk_count,
+                total_length = total_length + excluded.total_length
+            """,
+            (user_id, chunks, length),
+        )
+
+    def add(self, user_id: str, document_id: str, chunks: Iterable[Tuple[str, str]]) -> int:
+        """
+        Indexes (chunk_id, text) pairs of one document in one transaction.
+        Chunks already indexed are left alone, so replaying a write is a no-op.
+        Returns the number of chunks added.
+        """
+        added, added_length = 0, 0
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for chunk_id, text in chunks:
+                    terms = Counter(tokenize(text))
+                    length = sum(terms.values())
+                    inserted = self.conn.execute(
+                        "INSERT OR IGNORE INTO lexical_chunks (user_id, chunk_id, document_id, length) "
+                        "VALUES (?, ?, ?, ?)",
+                        (user_id, chunk_id, document_id, length)).rowcount
+                    if not inserted:
+                        continue
+                    self.conn.executemany(
+                        "INSERT INTO lexical_postings (user_id, term, chunk_id, tf) VALUES (?, ?, ?, ?)",
+                        [(user_id, term, chunk_id, tf) for term, tf in terms.items()])
+                    added += 1
+                    added_length += length
+                if added:
+                    self._adjust_stats(user_id, added, added_length)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def delete_document(self, user_id: str, document_id: str) -> int:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                removed, removed_length = self.conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM lexical_chunks "
+                    "WHERE user_id = ? AND document_id = ?",
+                    (user_id, document_id)).fetchone()
+                if removed:
+                    self.conn.execute(
+                        """
+                        DELETE FROM lexical_postings
+                        WHERE user_id = ? AND chunk_id IN (
+                            SELECT chunk_id FROM lexical_chunks WHERE user_id = ? AND document_id = ?
+                        )
+                        """,
+                        (user_id, user_id, document_id))
+                    self.conn.execute(
+                        "DELETE FROM lexical_chunks WHERE user_id = ? AND document_id = ?",
+                        (user_id, document_id))
+                    self._adjust_stats(user_id, -removed, -removed_length)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return removed
+
+    def clear(self, user_id: str):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("lexical_postings", "lexical_chunks", "lexical_stats"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def chunk_count(self, user_id: str) -> int:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT chunk_count FROM lexical_stats WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def search(self, user_id: str, terms: List[str], limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        BM25 over the user's chunks for the given (already tokenized) terms,
+        any term matches. Returns up to limit (chunk_id, score) pairs, best first.
+        """
+        terms = list(dict.fromkeys(terms))
+        if not terms:
+            return []
+        placeholders = ", ".join("?" * len(terms))
+        with self.lock:
+            stats = self.conn.execute(
+                "SELECT chunk_count, total_length FROM lexical_stats WHERE user_id = ?",
+                (user_id,)).fetchone()
+            if not stats or not stats[0]:
+                return []
+            rows = self.conn.execute(
+                f"""
+                SELECT p.term, p.chunk_id, p.tf, c.length
+                FROM lexical_postings p
+                JOIN lexical_chunks c ON c.user_id = p.user_id AND c.chunk_id = p.chunk_id
+                WHERE p.user_id = ? AND p.term IN ({placeholders})
+                """,
+                (user_id, *terms)).fetchall()
+
+        chunk_count, total_length = stats
+        avg_length = total_length / chunk_count or 1.0
+        doc_freq = Counter(term for term, _, _, _ in rows)
+        scores: Dict[str, float] = {}
+        for term, chunk_id, tf, length in rows:
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + bm25_idf(chunk_count, doc_freq[term]) * bm25_term(
+                tf, length, avg_length, self.k1, self.b)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
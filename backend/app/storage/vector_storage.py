@@ -1,13 +1,30 @@
 import chromadb
 from chromadb.config import Settings
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
+import hashlib
 import uuid
+import time
 import os
 from logger import get_logger
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from storage.chunking import split_text, assign_chunk_ids
+from storage.fusion import rrf_score
+from storage.embedding_cache import CachedEmbeddingFunction, EMBEDDING_CACHE_ENABLED
+from storage.inverted_index import tokenize
+from storage.lexical_index import LEXICAL_INDEX_ENABLED, LexicalIndex
+from metrics import CHUNKS_INGESTED, span
 
 logger = get_logger("vector_storage")
 
+# batched: one encoder call and one multi-vector search for all terms
+# per_term: one embedding and one search per term
+# lexical: BM25 over the local inverted index, no embedding
+# fused: the whole query embedded once, reciprocal-rank fused with the lexical hits
+QUERY_MODES = ("batched", "per_term", "lexical", "fused")
+QUERY_MODE = os.environ.get("VECTOR_QUERY_MODE", "batched")
+# chunks per collection.add call in bulk ingestion, each call embeds its chunks in one encoder pass
+ADD_BATCH_SIZE = int(os.environ.get("VECTOR_ADD_BATCH_SIZE", 1024))
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
 
 class VectorStorage:
     _embedding_function = None
@@ -16,7 +33,8 @@ class VectorStorage:
                   'such', 'both', 'through', 'about', 'for', 'is', 'of', 'while', 'during',
                   'to', 'from', 'in', 'on', 'at', 'by', 'with', 'without', 'after', 'before'}
 
-    def __init__(self, persist_directory: str = None):
+    def __init__(self, persist_directory: str = None, add_batch_size: int = ADD_BATCH_SIZE,
+                 lexical_index: Optional[LexicalIndex] = None):
         if persist_directory is None:
             persist_directory = os.environ.get("VECTOR_DB_PATH", "./vector_db")
 
@@ -24,24 +42,27 @@ class VectorStorage:
 
         if VectorStorage._embedding_function is None:
             logger.info(
-                "Loading embedding model 'all-MiniLM-L6-v2' into memory...")
+                f"Loading embedding model '{EMBEDDING_MODEL}' into memory...")
             from chromadb.utils import embedding_functions
-            VectorStorage._embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name="all-MiniLM-L6-v2"
+            embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+                model_name=EMBEDDING_MODEL
             )
+            if EMBEDDING_CACHE_ENABLED:
+                # document chunks and query terms both go through the cache
+                embedding_function = CachedEmbeddingFunction(
+                    embedding_function, EMBEDDING_MODEL)
+            VectorStorage._embedding_function = embedding_function
             logger.info("Embedding model loaded")
 
         self.embedding_function = VectorStorage._embedding_function
+        self.add_batch_size = add_batch_size
         self.client = chromadb.PersistentClient(
             path=persist_directory,
             settings=Settings(anonymized_telemetry=False)
         )
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50,
-            length_function=len,
-            separators=["\n\n", "\n", ".", " ", ""]
-        )
+        if lexical_index is None and LEXICAL_INDEX_ENABLED:
+            lexical_index = LexicalIndex()
+        self.lexical = lexical_index
 
     def create_collection(self, user_id: str):
         name = f"user_{user_id}_docs"
@@ -51,8 +72,9 @@ class VectorStorage:
         )
 
     def document_exists(self, user_id: str, content: str) -> bool:
-        import hashlib
-        content_hash = hashlib.sha256(content.encode()).hexdigest()
+        return self.hash_exists(user_id, hashlib.sha256(content.encode()).hexdigest())
+
+    def hash_exists(self, user_id: str, content_hash: str) -> bool:
         try:
             collection = self.create_collection(user_id)
             results = collection.get(
@@ -70,48 +92,191 @@ class VectorStorage:
             logger.error(f"Error checking for duplicates: {e}")
         return False
 
-    def add_document(self, user_id: str, document_name: str, content: str, metadata: Dict[str, Any]):
-        import hashlib
-        content_hash = hashlib.sha256(content.encode()).hexdigest()
+    def _chunk_records(self, user_id: str, document_id: str, document_name: str,
+                       chunks: List[Dict[str, Any]], content_hash: str, metadata: Dict[str, Any],
+                       uploaded_at: Optional[float] = None):
+        # chunks come from storage.chunking with their content-addressed ids,
+        # the graph store keys its Chunk nodes by the same ids
+        uploaded_at = uploaded_at or time.time()
+        ids, docs, metas = [], [], []
+        for chunk in chunks:
+            ids.append(chunk["id"])
+            docs.append(chunk["text"])
+            metas.append({
+                "document_id": document_id,
+                "document_name": document_name,
+                "user_id": user_id,
+                "chunk_id": chunk["id"],
+                "chunk_index": chunk["index"],
+                "content_hash": content_hash,
+                "tags": ", ".join(metadata.get("tags") or []),
+                "description": metadata.get("description") or "",
+                "original_filename": metadata.get("original_filename") or document_name,
+                "content_type": metadata.get("content_type") or "text/plain",
+                "uploaded_at": uploaded_at,
+            })
+        return ids, docs, metas
+
+    @staticmethod
+    def _prepared_chunks(user_id: str, content: str, content_hash: str,
+                         chunks: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        if chunks is not None:
+            return chunks
+        return assign_chunk_ids(split_text(content), user_id, content_hash)
+
+    def _index_lexical(self, user_id: str, ids: List[str], docs: List[str], metas: List[Dict[str, Any]]):
+        # after the Chroma write, a failure here leaves the chunks searchable by embedding only
+        # until rebuild_lexical_index runs
+        if self.lexical is None or not ids:
+            return
+        by_document: Dict[str, List] = {}
+        for chunk_id, text, meta in zip(ids, docs, metas):
+            by_document.setdefault(meta["document_id"], []).append((chunk_id, text))
+        try:
+            with span("lexical_write", chunks=len(ids)):
+                for document_id, chunks in by_document.items():
+                    self.lexical.add(user_id, document_id, chunks)
+        except Exception as e:
+            logger.error(f"Lexical index write failed for user {user_id}: {e}")
+
+    def _unindex_lexical(self, user_id: str, document_id: str):
+        if self.lexical is None:
+            return
+        try:
+            self.lexical.delete_document(user_id, document_id)
+        except Exception as e:
+            logger.error(
+                f"Lexical index delete failed for document {document_id}: {e}")
+
+    def add_document(self, user_id: str, document_name: str, content: str, metadata: Dict[str, Any],
+                     prepared: Optional[Dict[str, Any]] = None):
+        # prepared carries document_id, content_hash and chunks shared with the graph store
+        prepared = prepared or {}
+        content_hash = prepared.get("content_hash") or hashlib.sha256(
+            content.encode()).hexdigest()
 
         logger.info(
             f"Adding document '{document_name}' for user {user_id} | content_hash: {content_hash[:12]}...")
 
-        if self.document_exists(user_id, content):
+        # the repository's duplicate index has already been consulted for prepared uploads
+        if not prepared.get("deduplicated") and self.hash_exists(user_id, content_hash):
             logger.warning(
                 f"Skipping '{document_name}' (duplicate)")
             return {"document_id": None, "chunks_processed": 0, "skipped": True, "reason": "duplicate"}
 
         collection = self.create_collection(user_id)
-        document_id = str(uuid.uuid4())
-        chunks = self.text_splitter.split_text(content)
+        document_id = prepared.get("document_id") or str(uuid.uuid4())
+        chunks = self._prepared_chunks(
+            user_id, content, content_hash, prepared.get("chunks"))
+        ids, docs, metas = self._chunk_records(
+            user_id, document_id, document_name, chunks, content_hash, metadata)
+
+        logger.info(
+            f"Chunked '{document_name}' into {len(docs)} chunks — vectorizing with {EMBEDDING_MODEL}...")
 
+        with span("vector_write", chunks=len(docs)):
+            collection.add(ids=ids, documents=docs, metadatas=metas)
+        self._index_lexical(user_id, ids, docs, metas)
+        CHUNKS_INGESTED.labels("vector").inc(len(docs))
         logger.info(
-            f"Chunked '{document_name}' into {len(chunks)} chunks — vectorizing with all-MiniLM-L6-v2...")
+            f"Vectorized and stored '{document_name}', {len(docs)} chunks written")
+
+        return {"document_id": document_id, "chunks_processed": len(docs), "skipped": False}
+
+    def open_writer(self, user_id: str, document_id: str, document_name: str, content_hash: str,
+                    metadata: Dict[str, Any]) -> "VectorDocumentWriter":
+        return VectorDocumentWriter(self, user_id, document_id, document_name, content_hash, metadata)
+
+    def add_documents(self, user_id: str, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Bulk ingest of already deduplicated documents (each with document_name,
+        content, metadata and content_hash, optionally document_id and chunks
+        from the shared chunker). Chunks of all documents are embedded
+        and written with one collection.add per add_batch_size chunks.
+        A failed add fails only the documents with chunks in it, their chunks
+        already written by other adds are deleted again and their results
+        carry the error; the other documents are stored and reported normally.
+        """
+        started = time.perf_counter()
+        collection = self.create_collection(user_id)
 
+        results = []
         ids, docs, metas = [], [], []
-        for i, chunk in enumerate(chunks):
-            ids.append(f"{document_id}_{i}")
-            docs.append(chunk)
-            metas.append({
+        for document in documents:
+            document_id = document.get("document_id") or str(uuid.uuid4())
+            chunks = self._prepared_chunks(
+                user_id, document["content"], document["content_hash"], document.get("chunks"))
+            doc_ids, doc_chunks, doc_metas = self._chunk_records(
+                user_id, document_id, document["document_name"], chunks,
+                document["content_hash"], document["metadata"])
+            ids.extend(doc_ids)
+            docs.extend(doc_chunks)
+            metas.extend(doc_metas)
+            results.append({
+                "document_name": document["document_name"],
                 "document_id": document_id,
-                "document_name": document_name,
-                "user_id": user_id,
-                "chunk_index": i,
-                "content_hash": content_hash,
-                "tags": ", ".join(metadata.get("tags") or []),
-                "description": metadata.get("description") or "",
-                "original_filename": metadata.get("original_filename") or document_name,
-                "content_type": metadata.get("content_type") or "text/plain",
+                "chunks_processed": len(doc_chunks),
+                "skipped": False,
             })
+        chunking_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        batch_size = min(self.add_batch_size, getattr(
+            self.client, "max_batch_size", self.add_batch_size))
+        failed: Dict[str, str] = {}
+        with span("vector_write", chunks=len(ids)) as s:
+            for i in range(0, len(ids), batch_size):
+                try:
+                    collection.add(
+                        ids=ids[i:i + batch_size],
+                        documents=docs[i:i + batch_size],
+                        metadatas=metas[i:i + batch_size]
+                    )
+                except Exception as e:
+                    logger.error(
+                        f"Vector write of chunks {i}-{i + batch_size} failed for user {user_id}: {e}")
+                    for meta in metas[i:i + batch_size]:
+                        failed.setdefault(meta["document_id"], str(e))
+            if failed:
+                self._delete_documents(collection, list(failed))
+        write_ms = s.duration_ms
+
+        if failed:
+            for result in results:
+                if result["document_id"] in failed:
+                    result.update(chunks_processed=0, error=failed[result["document_id"]])
+            kept = [i for i, meta in enumerate(metas) if meta["document_id"] not in failed]
+            ids, docs, metas = ([values[i] for i in kept] for values in (ids, docs, metas))
+        self._index_lexical(user_id, ids, docs, metas)
+        CHUNKS_INGESTED.labels("vector").inc(len(ids))
 
-        collection.add(ids=ids, documents=docs, metadatas=metas)
         logger.info(
-            f"Vectorized and stored '{document_name}', {len(chunks)} chunks written")
+            f"Vectorized and stored {len(documents) - len(failed)} documents for user {user_id}, "
+            f"{len(ids)} chunks written in {write_ms:.1f}ms")
+        return {
+            "documents": results,
+            "timings_ms": {
+                "chunking": chunking_ms,
+                "embed_and_write": write_ms,
+                "total": round((time.perf_counter() - started) * 1000, 2),
+            },
+        }
+
+    @staticmethod
+    def _delete_documents(collection, document_ids: List[str]):
+        # takes the chunks of documents whose batch write failed part way back out
+        try:
+            collection.delete(where={"document_id": {"$in": document_ids}})
+        except Exception as e:
+            logger.error(
+                f"Failed to delete partially written documents {document_ids}: {e}")
 
-        return {"document_id": document_id, "chunks_processed": len(chunks), "skipped": False}
+    def embedding_cache_stats(self) -> Optional[Dict[str, Any]]:
+        if isinstance(self.embedding_function, CachedEmbeddingFunction):
+            return self.embedding_function.stats()
+        return None
 
     def list_documents(self, user_id: str) -> List[Dict[str, Any]]:
+        # reads the metadata of every chunk, the document catalog serves listings
         try:
             collection = self.create_collection(user_id)
             all_items = collection.get(include=["metadatas"])
@@ -129,19 +294,108 @@ class VectorStorage:
                     "document_name": meta.get("document_name"),
                     "original_filename": meta.get("original_filename"),
                     "content_hash": meta.get("content_hash"),
+                    "tags": [tag for tag in (meta.get("tags") or "").split(", ") if tag],
+                    "description": meta.get("description") or "",
+                    "content_type": meta.get("content_type"),
+                    # chunks written before upload times were stored have none
+                    "uploaded_at": meta.get("uploaded_at"),
+                    "chunk_count": 0,
                 }
+            if doc_id:
+                seen[doc_id]["chunk_count"] += 1
 
         documents = list(seen.values())
         logger.info(
             f"Listed {len(documents)} unique documents from vector store for user {user_id}")
         return documents
 
-    def query(self, user_id: str, query_text: str, top_k: int = 5):
+    def delete_document(self, user_id: str, document_id: str) -> bool:
+        collection = self.create_collection(user_id)
+        existing = collection.get(
+            where={"document_id": document_id}, include=[])
+        if not existing["ids"]:
+            return False
+        collection.delete(ids=existing["ids"])
+        self._unindex_lexical(user_id, document_id)
         logger.info(
-            f"Querying vector store for user {user_id}, query: '{query_text}', top_k: {top_k}")
-
+            f"Deleted document {document_id} ({len(existing['ids'])} chunks) from vector store")
+        return True
+
+    def rebuild_lexical_index(self, user_id: str, page_size: int = 5000) -> int:
+        """
+        Re-indexes every chunk of the user's collection, for chunks written
+        before the lexical index existed or after a failed index write.
+        Returns the number of chunks indexed.
+        """
+        if self.lexical is None:
+            return 0
         collection = self.create_collection(user_id)
-
+        self.lexical.clear(user_id)
+        indexed, offset = 0, 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            self._index_lexical(user_id, page["ids"], page["documents"], page["metadatas"])
+            indexed += len(page["ids"])
+            offset += len(page["ids"])
+        logger.info(f"Rebuilt lexical index for user {user_id}, {indexed} chunks")
+        return indexed
+
+    def _lexical_terms(self, query_text: str) -> List[str]:
+        return [term for term in tokenize(query_text) if term not in self.stop_words]
+
+    def _lexical_hits(self, user_id: str, collection, query_text: str, top_k: int,
+                      timings: Dict[str, float]) -> List[Dict[str, Any]]:
+        # BM25 ranks chunk ids, Chroma returns their text and metadata by id without embedding anything
+        if self.lexical is None:
+            raise ValueError("Lexical index is disabled (LEXICAL_INDEX_ENABLED=false)")
+        with span("lexical_search") as s:
+            ranked = self.lexical.search(
+                user_id, self._lexical_terms(query_text), top_k)
+            found = collection.get(
+                ids=[chunk_id for chunk_id, _ in ranked],
+                include=["documents", "metadatas"]) if ranked else {"ids": []}
+        timings["lexical_search"] = s.duration_ms
+
+        by_id = {chunk_id: (content, metadata) for chunk_id, content, metadata in zip(
+            found["ids"], found.get("documents") or [], found.get("metadatas") or [])}
+        top = ranked[0][1] if ranked else 0
+        hits = []
+        for chunk_id, score in ranked:
+            if chunk_id not in by_id:
+                continue
+            content, metadata = by_id[chunk_id]
+            hits.append({
+                "content": content,
+                "metadata": metadata,
+                "term": query_text,
+                "bm25": round(score, 4),
+                # share of the best hit's BM25, 0..1
+                "relevance": round(score / top, 4) if top else 0.0,
+            })
+        return hits
+
+    @staticmethod
+    def _fuse_hits(dense: List[Dict[str, Any]], lexical: List[Dict[str, Any]], top_k: int):
+        # reciprocal-rank fusion by chunk id, a dense hit keeps its embedding distance
+        fused: Dict[str, Dict[str, Any]] = {}
+        ranks: Dict[str, List[Tuple[float, int]]] = {}
+        for hits in (dense, lexical):
+            for rank, hit in enumerate(hits):
+                metadata = hit["metadata"] or {}
+                key = metadata.get("chunk_id") or f"{metadata.get('document_id')}_{metadata.get('chunk_index')}"
+                entry = fused.setdefault(key, dict(hit))
+                for field in ("bm25", "relevance"):
+                    if field in hit:
+                        entry[field] = hit[field]
+                ranks.setdefault(key, []).append((1.0, rank))
+        for key, entry in fused.items():
+            entry["rrf_score"] = round(rrf_score(ranks[key]), 6)
+        output = sorted(fused.values(), key=lambda hit: hit["rrf_score"], reverse=True)
+        return output[:top_k]
+
+    def _search_terms(self, query_text: str) -> List[str]:
         words = [word.lower() for word in query_text.split()
                  if word.lower() not in self.stop_words and len(word) > 2]
 
@@ -152,42 +406,108 @@ class VectorStorage:
             if all(word.lower() not in self.stop_words for word in [word_list[i], word_list[i+1]]):
                 phrases.append(phrase)
 
-        search_terms = words + phrases
-        logger.debug(f"search terms: {search_terms}")
+        return words + phrases
 
-        unique_results = {}
+    @staticmethod
+    def _merge_hits(unique_results: Dict[str, Dict[str, Any]], results, row: int, term: str):
+        # keeps the closest hit per chunk across all search terms
+        if not (results and results["documents"] and results["documents"][row]):
+            return
+
+        for i in range(len(results["documents"][row])):
+            content = results["documents"][row][i]
+            metadata = results["metadatas"][row][i] if results["metadatas"] else {
+            }
+
+            doc_id = metadata.get('document_id', 'unknown')
+            chunk_index = metadata.get('chunk_index', i)
+            unique_key = f"{doc_id}_{chunk_index}"
 
-        for term in search_terms:
-            logger.debug(f"Searching with term: '{term}'")
+            distance = results["distances"][row][i] if results["distances"] else 1.0
 
+            if unique_key not in unique_results or distance < unique_results[unique_key]["distance"]:
+                unique_results[unique_key] = {
+                    "content": content,
+                    "metadata": metadata,
+                    "distance": distance,
+                    "term": term
+                }
+
+    def query(self, user_id: str, query_text: str, top_k: int = 5, mode: str = None,
+              timings: Optional[Dict[str, float]] = None):
+        # timings (if given) gets embed, vector_search and lexical_search in ms, as far as the mode runs them
+        timings = {} if timings is None else timings
+        mode = mode or QUERY_MODE
+        if mode not in QUERY_MODES:
+            raise ValueError(
+                f"Unknown vector query mode '{mode}', expected one of {QUERY_MODES}")
+
+        logger.info(
+            f"Querying vector store for user {user_id}, query: '{query_text}', top_k: {top_k}, mode: {mode}")
+
+        collection = self.create_collection(user_id)
+
+        if mode == "lexical":
+            output = self._lexical_hits(user_id, collection, query_text, top_k, timings)
+            logger.info(f"Lexical query returned {len(output)} results")
+            return output
+        if mode == "fused":
+            dense = {}
             try:
-                results = collection.query(
-                    query_texts=[term],
-                    n_results=top_k
-                )
+                with span("embed", terms=1) as s:
+                    embeddings = self.embedding_function([query_text])
+                timings["embed"] = s.duration_ms
+                with span("vector_search") as s:
+                    results = collection.query(query_embeddings=embeddings, n_results=top_k)
+                timings["vector_search"] = s.duration_ms
+                self._merge_hits(dense, results, 0, query_text)
+            except Exception as e:
+                logger.error(f"Error querying with the full query: {e}")
+            output = self._fuse_hits(
+                list(dense.values()),
+                self._lexical_hits(user_id, collection, query_text, top_k, timings),
+                top_k)
+            logger.info(f"Fused dense and lexical query returned {len(output)} results")
+            return output
+
+        search_terms = self._search_terms(query_text)
+        logger.debug(f"search terms: {search_terms}")
+
+        unique_results = {}
 
-                if results and results["documents"] and results["documents"][0]:
-                    for i in range(len(results["documents"][0])):
-                        content = results["documents"][0][i]
-                        metadata = results["metadatas"][0][i] if results["metadatas"] else {
-                        }
-
-                        doc_id = metadata.get('document_id', 'unknown')
-                        chunk_index = metadata.get('chunk_index', i)
-                        unique_key = f"{doc_id}_{chunk_index}"
-
-                        distance = results["distances"][0][i] if results["distances"] else 1.0
-
-                        if unique_key not in unique_results or distance < unique_results[unique_key]["distance"]:
-                            unique_results[unique_key] = {
-                                "content": content,
-                                "metadata": metadata,
-                                "distance": distance,
-                                "term": term
-                            }
+        if mode == "batched":
+            # every term plus the full query in one encoder call and one multi-vector search
+            search_terms = list(dict.fromkeys(search_terms + [query_text]))
+            try:
+                with span("embed", terms=len(search_terms)) as s:
+                    embeddings = self.embedding_function(search_terms)
+                timings["embed"] = s.duration_ms
+                with span("vector_search") as s:
+                    results = collection.query(
+                        query_embeddings=embeddings,
+                        n_results=top_k
+                    )
+                timings["vector_search"] = s.duration_ms
+                for row, term in enumerate(search_terms):
+                    self._merge_hits(unique_results, results, row, term)
             except Exception as e:
-                logger.error(f"Error querying with term '{term}': {e}")
-                continue
+                logger.error(f"Error querying with batched terms: {e}")
+        else:
+            with span("vector_search", terms=len(search_terms)) as s:
+                for term in search_terms:
+                    logger.debug(f"Searching with term: '{term}'")
+
+                    try:
+                        results = collection.query(
+                            query_texts=[term],
+                            n_results=top_k
+                        )
+                        self._merge_hits(unique_results, results, 0, term)
+                    except Exception as e:
+                        logger.error(f"Error querying with term '{term}': {e}")
+                        continue
+            timings["vector_search"] = s.duration_ms
+
         output = list(unique_results.values())
         output.sort(key=lambda x: x["distance"])
 
@@ -196,3 +516,46 @@ class VectorStorage:
         logger.info(
             f"Vector query returned {len(output)} unique results (from {len(search_terms)} search terms)")
         return output
+
+
+class VectorDocumentWriter:
+    """
+    Streams one document into its collection: chunks handed to write() by
+    the shared chunker are added right away, so only one window of chunks
+    and embeddings is held at a time. Chroma has no transactions, abort() deletes
+    whatever was already written.
+    """
+
+    def __init__(self, storage: VectorStorage, user_id: str, document_id: str, document_name: str,
+                 content_hash: str, metadata: Dict[str, Any]):
+        self.storage = storage
+        self.user_id = user_id
+        self.document_id = document_id
+        self.document_name = document_name
+        self.content_hash = content_hash
+        self.metadata = metadata
+        self.collection = storage.create_collection(user_id)
+        self.uploaded_at = time.time()
+        self.chunks_processed = 0
+
+    def write(self, chunks: List[Dict[str, Any]]):
+        if not chunks:
+            return
+        ids, docs, metas = self.storage._chunk_records(
+            self.user_id, self.document_id, self.document_name, chunks,
+            self.content_hash, self.metadata, self.uploaded_at)
+        with span("vector_write", chunks=len(ids)):
+            self.collection.add(ids=ids, documents=docs, metadatas=metas)
+        self.storage._index_lexical(self.user_id, ids, docs, metas)
+        self.chunks_processed += len(chunks)
+
+    def close(self) -> Dict[str, Any]:
+        # counted on close, abort() takes partial writes back out
+        CHUNKS_INGESTED.labels("vector").inc(self.chunks_processed)
+        logger.info(
+            f"Streamed '{self.document_name}' into vector store, {self.chunks_processed} chunks written")
+        return {"document_id": self.document_id, "chunks_processed": self.chunks_processed, "skipped": False}
+
+    def abort(self):
+        self.collection.delete(where={"document_id": self.document_id})
+        self.storage._unindex_lexical(self.user_id, self.document_id)
@@ -1,35 +1,675 @@
-from storage.vector_storage import VectorStorage
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional
+import asyncio
+import hashlib
+import sqlite3
+import time
+import uuid
+import os
+
+from logger import get_logger
+
+from storage.vector_storage import VectorStorage, QUERY_MODE
 from storage.graph_storage import GraphStorage
+from storage.chunking import assign_chunk_ids, make_chunk_stream, split_text
+from upload_stream import hash_stream, iter_text, iter_windows, UPLOAD_MAX_BUFFER_BYTES
+from query_cache import QueryCache
+from document_catalog import DocumentCatalog, SimHasher, simhash
+from metrics import register_pool, run_in_executor, span
+from context_packer import HYBRID_FUSION, fuse_results
+
+# chroma and sentence-transformers calls (embedding + I/O) run in the vector pool,
+# spaCy NER runs in the ner pool, Cypher goes through the async neo4j driver
+VECTOR_POOL_SIZE = int(os.environ.get("VECTOR_POOL_SIZE", 4))
+NER_POOL_SIZE = int(os.environ.get("NER_POOL_SIZE", 2))
+# finished background graph ingests kept around for status polling
+MAX_TRACKED_INGESTS = int(os.environ.get("MAX_TRACKED_INGESTS", 1000))
+# hybrid retrieval asks the vector store for top_k times this many hits, so fusion has overlap to work with
+HYBRID_CANDIDATE_MULTIPLIER = int(
+    os.environ.get("HYBRID_CANDIDATE_MULTIPLIER", 3))
+
+logger = get_logger("storage_repository")
 
 
 class StorageRepository:
-    def __init__(self):
+    def __init__(self, vector_pool_size: int = VECTOR_POOL_SIZE, ner_pool_size: int = NER_POOL_SIZE):
         self.vector = VectorStorage()
         _ = self.vector.embedding_function
 
         self.graph = GraphStorage()
 
-    def add_to_vector(self, user_id, document_name, content, metadata):
-        return self.vector.add_document(
-            user_id=user_id,
-            document_name=document_name,
-            content=content,
-            metadata=metadata
-        )
+        self.vector_pool = ThreadPoolExecutor(
+            max_workers=vector_pool_size, thread_name_prefix="vector")
+        self.ner_pool = ThreadPoolExecutor(
+            max_workers=ner_pool_size, thread_name_prefix="ner")
+        register_pool("vector", self.vector_pool, vector_pool_size)
+        register_pool("ner", self.ner_pool, ner_pool_size)
+
+        self.graph_ingests: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._background_tasks = set()
+        # every write and delete below invalidates the user's cached query results
+        self.query_cache = QueryCache()
+        # per-document listing state, written after each store's ingest and on delete,
+        # doubles as the duplicate index consulted once per upload
+        self.catalog = DocumentCatalog()
+
+    def prepare_document(self, user_id, content, document_id=None) -> Dict[str, Any]:
+        """
+        Fingerprints the upload and looks it up in the duplicate index once,
+        then chunks it once for both stores (same chunks under the same ids).
+        Chunking is skipped when every store already holds the document.
+        prepared["duplicates"] tells each store whether to skip, and
+        "deduplicated" tells the stores their own hash lookup is not needed.
+        """
+        with span("dedup"):
+            content_hash = hashlib.sha256(content.encode()).hexdigest()
+            signature = simhash(content)
+            duplicates = self.find_duplicates(user_id, content_hash, signature)
+        prepared = {
+            "document_id": document_id or str(uuid.uuid4()),
+            "content_hash": content_hash,
+            "simhash": signature,
+            "duplicates": duplicates,
+            "deduplicated": True,
+            "chunks": None,
+        }
+        if all(duplicates.values()):
+            return prepared
+        with span("chunking"):
+            prepared["chunks"] = assign_chunk_ids(split_text(content), user_id, content_hash)
+        return prepared
+
+    def find_duplicates(self, user_id, content_hash, signature=None) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Duplicate index lookup. The first upload of a user the catalog has
+        never seen backfills it from both stores. If that fails, each store
+        is asked for the exact hash itself, so documents ingested before the
+        catalog are still never written twice.
+        """
+        if not self.catalog.is_backfilled(user_id):
+            try:
+                self.backfill_catalog(user_id)
+            except Exception as e:
+                logger.warning(f"Catalog backfill failed for user {user_id}, checking the stores: {e}")
+                return self._store_duplicates(user_id, content_hash, signature)
+        return self.catalog.find_duplicates(user_id, content_hash, signature)
+
+    def _store_duplicates(self, user_id, content_hash, signature):
+        duplicates = self.catalog.find_duplicates(user_id, content_hash, signature)
+        for store, exists in (("vector", self.vector.hash_exists), ("graph", self.graph.document_exists)):
+            if duplicates[store] is None and exists(user_id, content_hash):
+                duplicates[store] = {"reason": "duplicate", "document_id": None}
+        return duplicates
+
+    @staticmethod
+    def _duplicate_result(store, document_name, prepared) -> Optional[Dict[str, Any]]:
+        duplicate = ((prepared or {}).get("duplicates") or {}).get(store)
+        if duplicate is None:
+            return None
+        logger.info(
+            f"Skipping {store} ingest of '{document_name}', {duplicate['reason']} of {duplicate['document_id']}")
+        return {
+            "document_id": None,
+            "chunks_processed": 0,
+            "chunks_stored": 0,
+            "entities_extracted": 0,
+            "skipped": True,
+            "reason": duplicate["reason"],
+            "duplicate_of": duplicate["document_id"],
+        }
+
+    def _catalog_stored(self, user_id, store, document_name, content_hash, metadata, char_count, result,
+                        signature=None):
+        # the store write already committed, a catalog failure is logged rather than failing the upload
+        if not result or result.get("skipped") or result.get("error"):
+            return
+        try:
+            self.catalog.record(
+                user_id, store, result["document_id"], document_name, content_hash, metadata,
+                char_count=char_count,
+                chunk_count=result.get("chunks_processed") or result.get("chunks_stored") or 0,
+                entity_count=result.get("entity_count") or 0,
+                simhash=signature)
+        except sqlite3.Error as e:
+            logger.error(
+                f"Failed to catalog {store} document {result['document_id']} for user {user_id}: {e}")
+
+    def _catalog_document(self, user_id, store, document_name, content, metadata, prepared, result):
+        if prepared and prepared.get("content_hash"):
+            content_hash, signature = prepared["content_hash"], prepared.get("simhash")
+        else:
+            content_hash, signature = hashlib.sha256(content.encode()).hexdigest(), simhash(content)
+        self._catalog_stored(user_id, store, document_name, content_hash,
+                             metadata, len(content), result, signature)
+
+    def _invalidate(self, user_id, graph=True):
+        self.query_cache.invalidate(user_id)
+        # global entities are shared, a graph write changes the expansions of every user's queries
+        if graph and self.graph.entity_scope == "global":
+            self.query_cache.invalidate_store("graph")
+
+    @contextmanager
+    def _ingesting(self, user_id, store):
+        # cached results are dropped whether or not the write went through, a failed one may be partial
+        try:
+            with span(f"{store}_ingest"):
+                yield
+        finally:
+            self._invalidate(user_id, graph=store == "graph")
+
+    def add_to_vector(self, user_id, document_name, content, metadata, prepared=None):
+        skipped = self._duplicate_result("vector", document_name, prepared)
+        if skipped:
+            return skipped
+        with self._ingesting(user_id, "vector"):
+            result = self.vector.add_document(
+                user_id=user_id,
+                document_name=document_name,
+                content=content,
+                metadata=metadata,
+                prepared=prepared
+            )
+        self._catalog_document(user_id, "vector", document_name, content, metadata, prepared, result)
+        return result
+
+    def add_to_graph(self, user_id, document_name, content, metadata, prepared=None):
+        skipped = self._duplicate_result("graph", document_name, prepared)
+        if skipped:
+            return skipped
+        with self._ingesting(user_id, "graph"):
+            result = self.graph.add_document(
+                user_id=user_id,
+                document_name=document_name,
+                content=content,
+                metadata=metadata,
+                prepared=prepared
+            )
+        self._catalog_document(user_id, "graph", document_name, content, metadata, prepared, result)
+        return result
+
+    def delete_document(self, user_id, document_id) -> Dict[str, bool]:
+        try:
+            with span("delete"):
+                return {
+                    "vector": self.vector.delete_document(user_id, document_id),
+                    "graph": self.graph.delete_document(user_id, document_id),
+                    "catalog": self.catalog.delete(user_id, document_id),
+                }
+        finally:
+            self._invalidate(user_id)
+
+    def _cache_lookup(self, key, query_span, cache_hits):
+        """
+        Cached results for key, or None along with the cache version to store
+        fresh results under (read before the query runs). cache_hits, if
+        given, gets the key's store: whether the results came from the cache.
+        """
+        cached = self.query_cache.get(key)
+        query_span.attrs["cached"] = cached is not None
+        if cache_hits is not None:
+            cache_hits[key[1]] = cached is not None
+        return cached, None if cached is not None else self.query_cache.version(key)
+
+    def query_vector(self, user_id, query_text, top_k=5, mode=None, timings=None, cache_hits=None):
+        key = self.query_cache.key(
+            user_id, "vector", query_text, top_k=top_k, mode=mode or QUERY_MODE)
+        with span("vector_query") as s:
+            cached, version = self._cache_lookup(key, s, cache_hits)
+            if cached is not None:
+                return cached
+            results = self.vector.query(
+                user_id, query_text, top_k, mode=mode, timings=timings)
+            self.query_cache.put(key, version, results)
+            return results
+
+    def query_graph(self, user_id, query_text, timings=None, cache_hits=None):
+        key = self.query_cache.key(user_id, "graph", query_text)
+        with span("graph_query") as s:
+            cached, version = self._cache_lookup(key, s, cache_hits)
+            if cached is not None:
+                return cached
+            results = self.graph.query(user_id, query_text, timings=timings)
+            self.query_cache.put(key, version, results)
+            return results
+
+    async def _run_in_pool(self, pool, fn, *args, **kwargs):
+        return await run_in_executor(pool, fn, *args, **kwargs)
+
+    async def aprepare_document(self, user_id, content, document_id=None):
+        return await self._run_in_pool(self.ner_pool, self.prepare_document, user_id, content, document_id)
+
+    async def aadd_to_vector(self, user_id, document_name, content, metadata, prepared=None):
+        return await self._run_in_pool(
+            self.vector_pool, self.add_to_vector, user_id, document_name, content, metadata, prepared)
+
+    async def aadd_to_graph(self, user_id, document_name, content, metadata, prepared=None):
+        # add_to_graph on the async driver, NER runs in the ner pool
+        skipped = self._duplicate_result("graph", document_name, prepared)
+        if skipped:
+            return skipped
+        with self._ingesting(user_id, "graph"):
+            result = await self.graph.aadd_document(
+                user_id=user_id,
+                document_name=document_name,
+                content=content,
+                metadata=metadata,
+                executor=self.ner_pool,
+                prepared=prepared
+            )
+        await asyncio.to_thread(
+            self._catalog_document, user_id, "graph", document_name, content, metadata, prepared, result)
+        return result
+
+    def add_stream(self, user_id, document_name, fileobj, metadata, max_buffer_bytes=UPLOAD_MAX_BUFFER_BYTES):
+        """
+        Streaming ingest of an uploaded file object: one pass hashes the raw
+        bytes for the duplicate check, a second pass decodes incrementally and
+        feeds bounded text windows to one shared chunker whose chunks go to
+        both stores' writers. Each store gets its own result or exception, a
+        failing writer is aborted without stopping the other. Only exact
+        duplicates are caught here, the SimHash is known once the last window
+        is written and is recorded for later uploads.
+        """
+        content_hash, size = hash_stream(fileobj)
+        document_id = str(uuid.uuid4())
+        logger.info(
+            f"Streaming '{document_name}' ({size} bytes) for user {user_id}, hash: {content_hash[:12]}")
+
+        results, writers = {}, {}
+        try:
+            duplicates = self.find_duplicates(user_id, content_hash)
+        except Exception as e:
+            duplicates, results = {}, {"vector": e, "graph": e}
+        for store, storage in (("vector", self.vector), ("graph", self.graph)):
+            if store in results:
+                continue
+            skipped = self._duplicate_result(store, document_name, {"duplicates": duplicates})
+            if skipped:
+                results[store] = skipped
+                continue
+            try:
+                writers[store] = storage.open_writer(
+                    user_id, document_id, document_name, content_hash, metadata)
+            except Exception as e:
+                results[store] = e
+
+        def write(chunks):
+            assign_chunk_ids(chunks, user_id, content_hash)
+            for store, writer in list(writers.items()):
+                try:
+                    writer.write(chunks)
+                except Exception as e:
+                    results[store] = e
+                    self._abort_writer(store, writers.pop(store))
+
+        chunker, hasher, char_count = make_chunk_stream(), SimHasher(), 0
+        try:
+            for window in iter_windows(iter_text(fileobj), max_buffer_bytes):
+                if not writers:
+                    break
+                char_count += len(window)
+                hasher.feed(window)
+                write(chunker.feed(window))
+            write(chunker.finish())
+        except Exception as e:
+            # decoding, chunking or hashing failed, nothing half-written is left behind
+            for store, writer in writers.items():
+                results[store] = e
+                self._abort_writer(store, writer)
+            writers = {}
+
+        signature = hasher.digest() if writers else None
+        for store, writer in writers.items():
+            try:
+                results[store] = writer.close(char_count) if store == "graph" else writer.close()
+            except Exception as e:
+                results[store] = e
+                self._abort_writer(store, writer)
+                continue
+            self._catalog_stored(user_id, store, document_name, content_hash,
+                                 metadata, char_count, results[store], signature)
+        self._invalidate(user_id)
+        return results
+
+    @staticmethod
+    def _abort_writer(store, writer):
+        try:
+            writer.abort()
+        except Exception as e:
+            logger.error(f"Failed to roll back partial {store} write: {e}")
 
-    def add_to_graph(self, user_id, document_name, content, metadata):
-        return self.graph.add_document(
-            user_id=user_id,
-            document_name=document_name,
-            content=content,
-            metadata=metadata
+    async def aadd_stream(self, user_id, document_name, fileobj, metadata):
+        with span("stream_ingest"):
+            return await self._run_in_pool(
+                self.ner_pool, self.add_stream, user_id, document_name, fileobj, metadata)
+
+    def start_graph_ingest(self, user_id, document_name, content, metadata, prepared=None) -> str:
+        ingest_id = str(uuid.uuid4())
+        self.graph_ingests[ingest_id] = {
+            "ingest_id": ingest_id,
+            "user_id": user_id,
+            "document_name": document_name,
+            "status": "pending",
+            "submitted_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        self._evict_finished_ingests()
+
+        task = asyncio.create_task(self._run_graph_ingest(
+            ingest_id, user_id, document_name, content, metadata, prepared))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return ingest_id
+
+    async def _run_graph_ingest(self, ingest_id, user_id, document_name, content, metadata, prepared=None):
+        status = self.graph_ingests[ingest_id]
+        status["status"] = "running"
+        try:
+            result = await self.aadd_to_graph(user_id, document_name, content, metadata, prepared)
+            status["result"] = result
+            status["status"] = "skipped" if result.get("skipped") else "success"
+        except Exception as e:
+            logger.error(
+                f"background graph ingest {ingest_id} failed for '{document_name}': {e}", exc_info=True)
+            status["status"] = "error"
+            status["error"] = str(e)
+        status["finished_at"] = datetime.now().isoformat()
+
+    def _evict_finished_ingests(self):
+        finished = [ingest_id for ingest_id, status in self.graph_ingests.items()
+                    if status["finished_at"] is not None]
+        for ingest_id in finished[:max(0, len(self.graph_ingests) - MAX_TRACKED_INGESTS)]:
+            del self.graph_ingests[ingest_id]
+
+    def graph_ingest_status(self, ingest_id) -> Optional[Dict[str, Any]]:
+        return self.graph_ingests.get(ingest_id)
+
+    async def aadd_batch(self, user_id, documents):
+        """
+        Bulk ingest for one user. documents carry document_name, content and
+        metadata. The batch is deduplicated against itself, then each document
+        against the duplicate index, and both stores ingest concurrently.
+        """
+        started = time.perf_counter()
+        results, unique = [], {}
+        for document in documents:
+            content_hash = hashlib.sha256(
+                document["content"].encode()).hexdigest()
+            result = {
+                "document_name": document["document_name"],
+                "content_hash": content_hash,
+                "vector": None,
+                "graph": None,
+            }
+            results.append(result)
+            if content_hash in unique:
+                result["vector"] = result["graph"] = {
+                    "skipped": True, "reason": "duplicate in batch"}
+                continue
+            unique[content_hash] = {**document, "content_hash": content_hash}
+
+        # one index lookup per document, chunked once unless both stores already hold it
+        prepared = await asyncio.gather(*(
+            self.aprepare_document(user_id, doc["content"]) for doc in unique.values()))
+        vector_existing, graph_existing = {}, {}
+        for (content_hash, doc), prep in zip(unique.items(), prepared):
+            doc.update(document_id=prep["document_id"], chunks=prep["chunks"], simhash=prep["simhash"])
+            for store, existing in (("vector", vector_existing), ("graph", graph_existing)):
+                if prep["duplicates"][store]:
+                    existing[content_hash] = prep["duplicates"][store]
+
+        vector_docs = [doc for h, doc in unique.items()
+                       if h not in vector_existing]
+        graph_docs = [doc for h, doc in unique.items()
+                      if h not in graph_existing]
+
+        with span("batch_ingest", documents=len(unique)):
+            vector_out, graph_out = await asyncio.gather(
+                self._run_in_pool(self.vector_pool,
+                                  self.vector.add_documents, user_id, vector_docs),
+                self.graph.aadd_documents(
+                    user_id, graph_docs, executor=self.ner_pool),
+                return_exceptions=True,
+            )
+        self._invalidate(user_id)
+
+        by_hash = {result["content_hash"]: result for result in reversed(results)}
+        for store, docs, existing, out in (
+            ("vector", vector_docs, vector_existing, vector_out),
+            ("graph", graph_docs, graph_existing, graph_out),
+        ):
+            for content_hash, duplicate in existing.items():
+                by_hash[content_hash][store] = {
+                    "skipped": True, "reason": duplicate["reason"], "duplicate_of": duplicate["document_id"]}
+            if isinstance(out, Exception):
+                logger.error(
+                    f"{store} batch ingest failed for user {user_id}: {out}",
+                    exc_info=(type(out), out, out.__traceback__))
+                for doc in docs:
+                    by_hash[doc["content_hash"]][store] = {"error": str(out)}
+                continue
+            for doc, stored in zip(docs, out["documents"]):
+                by_hash[doc["content_hash"]][store] = stored
+            await asyncio.to_thread(self._catalog_batch, user_id, store, docs, out["documents"])
+
+        return {
+            "results": results,
+            "timings_ms": {
+                "vector": None if isinstance(vector_out, Exception) else vector_out["timings_ms"],
+                "graph": None if isinstance(graph_out, Exception) else graph_out["timings_ms"],
+                "total": round((time.perf_counter() - started) * 1000, 2),
+            },
+        }
+
+    def _catalog_batch(self, user_id, store, docs, stored):
+        for doc, result in zip(docs, stored):
+            self._catalog_stored(user_id, store, doc["document_name"], doc["content_hash"],
+                                 doc["metadata"], len(doc["content"]), result, doc.get("simhash"))
+
+    async def aquery_vector(self, user_id, query_text, top_k=5, mode=None, timings=None, cache_hits=None):
+        return await self._run_in_pool(
+            self.vector_pool, self.query_vector, user_id, query_text, top_k, mode, timings, cache_hits)
+
+    async def aquery_graph(self, user_id, query_text, timings=None, cache_hits=None):
+        # query_graph on the async driver, NER runs in the ner pool
+        key = self.query_cache.key(user_id, "graph", query_text)
+        with span("graph_query") as s:
+            cached, version = self._cache_lookup(key, s, cache_hits)
+            if cached is not None:
+                return cached
+            results = await self.graph.aquery(
+                user_id, query_text, executor=self.ner_pool, timings=timings)
+            self.query_cache.put(key, version, results)
+            return results
+
+    async def aretrieve(self, user_id, query_text, top_k=5, mode=None, use_vector=True, use_graph=True):
+        """
+        Vector and graph retrieval run concurrently for one question. A failing
+        store is logged and contributes no results instead of failing the
+        whole retrieval. Stage timings are missing for cached results.
+        """
+        started = time.perf_counter()
+        vector_timings, graph_timings, cache_hits = {}, {}, {}
+
+        async def skipped():
+            return []
+
+        with span("retrieve"):
+            vector_out, graph_out = await asyncio.gather(
+                self.aquery_vector(user_id, query_text, top_k, mode, vector_timings, cache_hits)
+                if use_vector else skipped(),
+                self.aquery_graph(user_id, query_text, graph_timings, cache_hits) if use_graph else skipped(),
+                return_exceptions=True,
+            )
+
+        errors = {}
+        for store, out in (("vector", vector_out), ("graph", graph_out)):
+            if isinstance(out, Exception):
+                logger.error(
+                    f"{store} retrieval failed for user {user_id}: {out}",
+                    exc_info=(type(out), out, out.__traceback__))
+                errors[store] = str(out)
+
+        return {
+            "vector_results": [] if "vector" in errors else vector_out,
+            "graph_results": [] if "graph" in errors else graph_out,
+            "errors": errors,
+            "cached": {
+                "vector": cache_hits.get("vector", False),
+                "graph": cache_hits.get("graph", False),
+            },
+            "timings_ms": {
+                "embed": vector_timings.get("embed"),
+                "vector_search": vector_timings.get("vector_search"),
+                "lexical_search": vector_timings.get("lexical_search"),
+                "graph_entities": graph_timings.get("graph_entities"),
+                "graph_search": graph_timings.get("graph_search"),
+                "retrieval": round((time.perf_counter() - started) * 1000, 2),
+            },
+        }
+
+    async def ahybrid_retrieve(self, user_id, query_text, top_k=5, mode=None, fusion=None,
+                               use_vector=True, use_graph=True):
+        """
+        Server-side hybrid retrieval: both stores are queried concurrently
+        (aretrieve) for a wider candidate set, and their hits are fused per
+        shared chunk id into a single top_k list. fusion is "rrf" or
+        "weighted", HYBRID_FUSION by default.
+        """
+        fusion = fusion or HYBRID_FUSION
+        retrieved = await self.aretrieve(
+            user_id, query_text, top_k=top_k * HYBRID_CANDIDATE_MULTIPLIER, mode=mode,
+            use_vector=use_vector, use_graph=use_graph)
+        with span("fusion") as s:
+            results = fuse_results(
+                retrieved["vector_results"], retrieved["graph_results"], top_k, method=fusion)
+        retrieved["results"] = results
+        retrieved["fusion"] = fusion
+        retrieved["timings_ms"]["fusion"] = s.duration_ms
+        return retrieved
+
+    async def adelete_document(self, user_id, document_id):
+        return await self._run_in_pool(self.vector_pool, self.delete_document, user_id, document_id)
+
+    async def alist_documents(self, user_id, limit=None, offset=0, tags=None,
+                              uploaded_after=None, uploaded_before=None):
+        # served from the catalog, returns the number of matching documents and one page
+        kwargs = {} if limit is None else {"limit": limit}
+        return await asyncio.to_thread(
+            self.catalog.list, user_id, offset=offset, tags=tags,
+            uploaded_after=uploaded_after, uploaded_before=uploaded_before, **kwargs)
+
+    def backfill_catalog(self, user_id):
+        vector_docs = self.vector.list_documents(user_id)
+        graph_docs = self.graph.list_documents(user_id, limit=None)
+        self._record_listings(user_id, vector_docs, graph_docs)
+        logger.info(
+            f"Backfilled catalog of user {user_id}: {len(vector_docs)} vector, {len(graph_docs)} graph documents")
+
+    def _record_listings(self, user_id, vector_docs, graph_docs):
+        graph_times = {}
+        for doc in graph_docs:
+            try:
+                uploaded_at = datetime.fromisoformat(doc["upload_time"]).timestamp()
+            except (TypeError, ValueError):
+                uploaded_at = None
+            graph_times[doc["id"]] = uploaded_at
+            if doc["content_hash"]:
+                graph_times[doc["content_hash"]] = uploaded_at
+            self.catalog.record(
+                user_id, "graph", doc["id"], doc["name"], doc["content_hash"] or "", doc,
+                char_count=doc["char_count"] or 0, chunk_count=doc["chunk_count"],
+                entity_count=doc["entity_count"], uploaded_at=uploaded_at)
+        for doc in vector_docs:
+            # older chunks carry no upload time, the graph copy's is used when there is one,
+            # otherwise 0 (unknown) so the document sorts last instead of as the newest
+            uploaded_at = (doc.get("uploaded_at") or graph_times.get(doc["document_id"])
+                           or graph_times.get(doc["content_hash"] or "") or 0.0)
+            self.catalog.record(
+                user_id, "vector", doc["document_id"], doc["document_name"] or doc["document_id"],
+                doc["content_hash"] or "", doc, chunk_count=doc["chunk_count"], uploaded_at=uploaded_at)
+        # every document the stores held is in, later ingests record themselves
+        self.catalog.mark_backfilled(user_id)
+
+    async def arebuild_catalog(self, user_id):
+        """
+        Backfills the catalog for one user from full listings of both stores,
+        for documents ingested before the catalog existed. Costs one scan of
+        each store, like the old listing did on every call. Also runs on
+        the first upload of a user the catalog has never seen.
+        """
+        vector_docs, graph_docs = await asyncio.gather(
+            self._run_in_pool(self.vector_pool,
+                              self.vector.list_documents, user_id),
+            self.graph.alist_documents(user_id, limit=None),
         )
+        await asyncio.to_thread(self._record_listings, user_id, vector_docs, graph_docs)
+        return {"vector": len(vector_docs), "graph": len(graph_docs)}
+
+    async def arebuild_lexical_index(self, user_id):
+        # re-indexes the user's Chroma chunks, for collections written before the lexical index existed
+        try:
+            return await self._run_in_pool(
+                self.vector_pool, self.vector.rebuild_lexical_index, user_id)
+        finally:
+            self.query_cache.invalidate(user_id)
 
-    def query_vector(self, user_id, query_text, top_k=5):
-        return self.vector.query(user_id, query_text, top_k)
+    async def abackfill_adjacency(self):
+        # entity adjacency lists for graphs ingested before they were maintained on write
+        try:
+            return await asyncio.to_thread(self.graph.backfill_adjacency)
+        finally:
+            self.query_cache.invalidate_store("graph")
 
-    def query_graph(self, user_id, query_text):
-        return self.graph.query(user_id, query_text)
+    async def abackfill_chunk_owners(self):
+        # owner keys for chunks written before the full-text index was scoped per user
+        try:
+            return await asyncio.to_thread(self.graph.backfill_chunk_owners)
+        finally:
+            self.query_cache.invalidate_store("graph")
+
+    async def amigrate_entity_scope(self, user_id=None):
+        """
+        Re-extracts one user's documents (every user's without user_id) into
+        user-scoped entities, see GraphStorage.migrate_entity_scope. A run over
+        all users also deletes the global entities nothing mentions anymore.
+        """
+        user_ids = [user_id] if user_id else await asyncio.to_thread(self.graph.list_user_ids)
+        migrated = {}
+        for uid in user_ids:
+            try:
+                migrated[uid] = await asyncio.to_thread(self.graph.migrate_entity_scope, uid)
+            finally:
+                self.query_cache.invalidate(uid)
+        deleted = 0 if user_id else await asyncio.to_thread(self.graph.delete_orphaned_global_entities)
+        return {"users": migrated, "global_entities_deleted": deleted}
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            "embeddings": self.vector.embedding_cache_stats(),
+            "queries": self.query_cache.stats(),
+        }
 
     def close(self):
+        self.vector_pool.shutdown(wait=False)
+        self.ner_pool.shutdown(wait=False)
         self.graph.close()
+        self.catalog.close()
+        if self.vector.lexical is not None:
+            self.vector.lexical.close()
+
+    async def aclose(self):
+        # let background graph writes finish before the pools go away
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self.vector_pool.shutdown(wait=False)
+        self.ner_pool.shutdown(wait=False)
+        await self.graph.aclose()
+        self.catalog.close()
+        if self.vector.lexical is not None:
+            self.vector.lexical.close()
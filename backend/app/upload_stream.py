@@ -0,0 +1,64 @@
+from typing import BinaryIO, Iterable, Iterator, Tuple
+import codecs
+import hashlib
+import os
+
+UPLOAD_READ_SIZE = int(os.environ.get("UPLOAD_READ_SIZE", 64 * 1024))
+# upper bound on decoded text held per upload, utf-8 chars take up to 4 bytes
+UPLOAD_MAX_BUFFER_BYTES = int(
+    os.environ.get("UPLOAD_MAX_BUFFER_BYTES", 1024 * 1024))
+# uploads larger than this take the streaming path even when not asked to
+UPLOAD_STREAM_THRESHOLD_BYTES = int(
+    os.environ.get("UPLOAD_STREAM_THRESHOLD_BYTES", 4 * 1024 * 1024))
+
+
+def hash_stream(fileobj: BinaryIO, read_size: int = UPLOAD_READ_SIZE) -> Tuple[str, int]:
+    # sha256 of the raw bytes, same value as hashing the decoded text re-encoded as utf-8
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        block = fileobj.read(read_size)
+        if not block:
+            break
+        digest.update(block)
+        size += len(block)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+def iter_text(fileobj: BinaryIO, read_size: int = UPLOAD_READ_SIZE) -> Iterator[str]:
+    # multi-byte characters split across reads are held back by the incremental decoder
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    fileobj.seek(0)
+    while True:
+        block = fileobj.read(read_size)
+        if not block:
+            break
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_windows(pieces: Iterable[str], max_buffer_bytes: int = UPLOAD_MAX_BUFFER_BYTES) -> Iterator[str]:
+    """
+    Regroups decoded pieces into windows of at most max_buffer_bytes // 4
+    characters, cut at the last paragraph, line or word break so the stores
+    never see a word split across two windows.
+    """
+    max_chars = max(max_buffer_bytes // 4, 1)
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= max_chars:
+            window = buffer[:max_chars]
+            cut = max(window.rfind("\n\n"), window.rfind("\n"), window.rfind(" "))
+            if cut <= 0:
+                cut = max_chars
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if buffer:
+        yield buffer
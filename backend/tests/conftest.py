@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the app modules import each other flat, from backend/app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from storage.chunking import TokenChunkStream
+
+TEXT = (
+    "The quick brown fox jumps over the lazy dog. Pack my box with five dozen liquor jugs! "
+    "How vexingly quick daft zebras jump? "
+    + " ".join(f"word{i}" for i in range(60))
+    + ". Sphinx of black quartz, judge my vow. The end."
+)
+
+
+def _whole(text, **kwargs):
+    stream = TokenChunkStream(**kwargs)
+    return stream.feed(text) + stream.finish()
+
+
+def _streamed(text, sizes, **kwargs):
+    stream = TokenChunkStream(**kwargs)
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = next(sizes)
+        chunks.extend(stream.feed(text[pos:pos + size]))
+        pos += size
+    return chunks + stream.finish()
+
+
+@pytest.mark.parametrize("piece", [1, 3, 7, 16, 64, 1000])
+def test_streaming_matches_whole_text(piece):
+    def sizes():
+        while True:
+            yield piece
+
+    expected = _whole(TEXT, chunk_tokens=12, overlap_tokens=4)
+    assert _streamed(TEXT, sizes(), chunk_tokens=12, overlap_tokens=4) == expected
+
+
+def test_streaming_matches_whole_text_for_random_pieces():
+    rng = random.Random(7)
+
+    def sizes():
+        while True:
+            yield rng.randint(1, 40)
+
+    expected = _whole(TEXT, chunk_tokens=10, overlap_tokens=3)
+    assert _streamed(TEXT, sizes(), chunk_tokens=10, overlap_tokens=3) == expected
+
+
+def test_chunks_point_back_into_the_text():
+    for chunk in _whole(TEXT, chunk_tokens=12, overlap_tokens=4):
+        assert TEXT[chunk["start_char"]:chunk["end_char"]].split() == chunk["text"].split()
+
+
+def test_unfinished_sentence_is_not_buffered_whole():
+    stream = TokenChunkStream(chunk_tokens=8, overlap_tokens=0)
+    chunks = []
+    for i in range(200):
+        chunks.extend(stream.feed(f"word{i} "))
+        assert len(stream.buffer) < 100
+    assert chunks
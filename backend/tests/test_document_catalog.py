@@ -0,0 +1,63 @@
+import pytest
+
+from document_catalog import DocumentCatalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = DocumentCatalog(str(tmp_path / "catalog.db"))
+    yield catalog
+    catalog.close()
+
+
+def test_near_duplicates_at_equal_distance(catalog):
+    signature = 0x0123456789ABCDEF
+    catalog.record("u1", "vector", "a", "a.txt", "hash-a", {}, simhash=signature ^ 0b01)
+    catalog.record("u1", "vector", "b", "b.txt", "hash-b", {}, simhash=signature ^ 0b10)
+
+    found = catalog.find_duplicates("u1", "hash-new", signature)
+
+    assert found["vector"]["reason"] == "near_duplicate"
+    assert found["vector"]["distance"] == 1
+    assert found["vector"]["document_id"] in ("a", "b")
+    assert found["graph"] is None
+
+
+def test_exact_duplicate_per_store(catalog):
+    catalog.record("u1", "vector", "a", "a.txt", "hash-a", {})
+    catalog.record("u1", "graph", "a", "a.txt", "hash-a", {})
+    catalog.record("u2", "vector", "b", "b.txt", "hash-b", {})
+
+    found = catalog.find_duplicates("u1", "hash-a")
+    assert found["vector"] == {"reason": "duplicate", "document_id": "a"}
+    assert found["graph"] == {"reason": "duplicate", "document_id": "a"}
+    # another user's copy is not a duplicate
+    assert catalog.find_duplicates("u1", "hash-b") == {"vector": None, "graph": None}
+
+
+def test_list_pages_newest_first(catalog):
+    for i in range(5):
+        catalog.record("u1", "vector", f"doc-{i}", f"{i}.txt", f"hash-{i}", {}, uploaded_at=1000.0 + i)
+    catalog.record("u2", "vector", "other", "other.txt", "hash-x", {}, uploaded_at=2000.0)
+
+    total, first = catalog.list("u1", limit=2)
+    _, second = catalog.list("u1", limit=2, offset=2)
+    _, last = catalog.list("u1", limit=2, offset=4)
+
+    assert total == 5
+    assert [d["document_id"] for d in first + second + last] == [f"doc-{i}" for i in range(4, -1, -1)]
+    assert catalog.list("u1", uploaded_after=1002.0, uploaded_before=1004.0)[0] == 2
+
+
+def test_list_requires_every_tag(catalog):
+    catalog.record("u1", "vector", "a", "a.txt", "hash-a", {"tags": ["x", "y"]})
+    catalog.record("u1", "vector", "b", "b.txt", "hash-b", {"tags": ["x"]})
+    catalog.record("u1", "graph", "a", "a.txt", "hash-a", {"tags": ["x", "y"]})
+
+    total, docs = catalog.list("u1", tags=["x", "y"])
+
+    assert total == 1
+    assert docs[0]["document_id"] == "a"
+    assert docs[0]["tags"] == ["x", "y"]
+    assert docs[0]["stores"] == ["vector", "graph"]
+    assert catalog.list("u1", tags=["x"])[0] == 2
@@ -0,0 +1,84 @@
+import pytest
+
+import job_queue
+from job_queue import JobQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = JobQueue(str(tmp_path / "jobs.db"), max_attempts=2, retry_delay=5, lease_seconds=60)
+    yield queue
+    queue.close()
+
+
+def test_expired_lease_is_claimed_again(queue, clock):
+    job_id = queue.enqueue("u1", "a.txt", "some text", {})
+    assert queue.claim("w1")["id"] == job_id
+    assert queue.claim("w2") is None
+
+    clock.now += 61
+    job = queue.claim("w2")
+
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+    assert job["content"] == "some text"
+    # the crashed worker no longer owns the job
+    assert not queue.extend_lease(job_id, "w1")
+    assert queue.extend_lease(job_id, "w2")
+
+
+def test_extended_lease_is_not_claimed(queue, clock):
+    job_id = queue.enqueue("u1", "a.txt", "some text", {})
+    queue.claim("w1")
+
+    clock.now += 50
+    assert queue.extend_lease(job_id, "w1")
+    clock.now += 50
+    assert queue.claim("w2") is None
+
+
+def test_lease_expiry_on_the_last_attempt_fails_the_job(queue, clock):
+    job_id = queue.enqueue("u1", "a.txt", "some text", {})
+    queue.claim("w1")
+    clock.now += 61
+    queue.claim("w2")
+    clock.now += 61
+
+    assert queue.claim("w3") is None
+    job = queue.get(job_id, include_content=True)
+    assert job["status"] == "failed"
+    assert job["last_error"] == "worker lost on the last attempt"
+    assert job["content"] == ""
+
+
+def test_failures_retry_with_backoff_until_attempts_run_out(queue, clock):
+    job_id = queue.enqueue("u1", "a.txt", "some text", {})
+    queue.claim("w1")
+
+    assert queue.fail(job_id, "boom") == "queued"
+    assert queue.claim("w1") is None
+    clock.now += 5
+    assert queue.claim("w1")["attempts"] == 2
+
+    assert queue.fail(job_id, "boom again") == "failed"
+    job = queue.get(job_id, include_content=True)
+    assert job["status"] == "failed"
+    assert job["last_error"] == "boom again"
+    assert job["content"] == ""
+    clock.now += 1000
+    assert queue.claim("w1") is None
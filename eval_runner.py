@@ -0,0 +1,363 @@
+"""
+Concurrent evaluation runner for the RAG API, the scriptable version of
+rag_evaluation.ipynb.
+
+    python eval_runner.py --questions-from eval_results_v1 --concurrency 8
+    python eval_runner.py --sample-size 50 --upload --compare eval_results_v1
+
+Writes <mode>.json and full_comparison.json in the notebook's schema (each
+record gains a latency_ms section), summary.json with accuracy and
+p50/p95/p99 latency per mode and stage, and regression.json when a
+previous run directory is given with --compare. Results go to a new
+eval_results_<timestamp> directory unless --results-dir is given, an
+existing non-empty directory is only overwritten with --force.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import io
+import json
+import os
+import time
+
+import requests
+
+API_URL = os.environ.get("EVAL_API_URL", "http://127.0.0.1:8000")
+USER_ID = "eval_user_001"
+MODES = {
+    "baseline": None,
+    "vector_only": (True, False),
+    "graph_only": (False, True),
+    "hybrid": (True, True),
+}
+LATENCY_STAGES = ("retrieval", "generation", "judge", "total")
+PERCENTILES = (50, 95, 99)
+
+JUDGE_PROMPT = """You are an answer evaluator.
+Given a question, a ground truth answer, and a model answer,
+respond with ONLY a JSON object, nothing else:
+{{"score": <0 or 1>, "reason": "<one sentence>"}}
+Score 1 if the model answer is factually correct and addresses the question.
+Score 0 if it is wrong, hallucinated, or says it does not know.
+
+Question: {question}
+Ground truth: {ground_truth}
+Model answer: {model_answer}"""
+
+
+def edit_prompt(question) -> str:
+    return f"Answer the question without additional sentences. Question: {question}"
+
+
+def timed_request(method, url, **kwargs):
+    # (json or None, client-side latency in ms)
+    start = time.perf_counter()
+    try:
+        r = requests.request(method, url, timeout=120, **kwargs)
+        if not r.ok:
+            print(f"[HTTP {r.status_code}] {url} — {r.text[:200]}")
+            result = None
+        else:
+            result = r.json()
+    except Exception as e:
+        print(f"[ERROR] {url}: {e}")
+        result = None
+    return result, round((time.perf_counter() - start) * 1000, 2)
+
+
+def call_no_context(args, question: str):
+    result, ms = timed_request(
+        "post",
+        f"{args.api_url}/query",
+        json={"query": edit_prompt(question=question), "max_tokens": 300, "temperature": 0.1}
+    )
+    return (result.get("response", "") if result else "ERROR: no response"), ms
+
+
+def call_rag(args, question: str, use_vector: bool, use_graph: bool):
+    # retrieval and generation in one round-trip, the server reports both stage timings
+    return timed_request(
+        "post",
+        f"{args.api_url}/rag/ask",
+        json={
+            "user_id": args.user_id,
+            "query": edit_prompt(question=question),
+            "top_k": args.top_k,
+            "use_vector": use_vector,
+            "use_graph": use_graph,
+            "max_tokens": 300,
+            "temperature": 0.1
+        }
+    )
+
+
+def judge_answer(args, question: str, ground_truth: str, model_answer: str):
+    prompt = JUDGE_PROMPT.format(
+        question=question,
+        ground_truth=ground_truth,
+        model_answer=model_answer
+    )
+    raw, ms = call_no_context(args, prompt)
+    try:
+        clean = raw.strip().strip("```json").strip("```").strip()
+        return json.loads(clean), ms
+    except Exception as e:
+        return {"score": 0, "reason": f"Judge parse failed: {e} | raw: {raw[:100]}"}, ms
+
+
+def evaluate_one(args, mode: str, row: dict) -> dict:
+    started = time.perf_counter()
+    if MODES[mode] is None:
+        model_answer, generation_ms = call_no_context(args, row["question"])
+        record = {"index": row["index"]}
+        latency = {"retrieval": None, "generation": generation_ms}
+    else:
+        use_vector, use_graph = MODES[mode]
+        result, ms = call_rag(args, row["question"], use_vector, use_graph)
+        result = result or {}
+        model_answer = result.get("response", "ERROR: no response")
+        timings = result.get("timings_ms", {})
+        record = {"index": row["index"], "mode": mode}
+        latency = {"retrieval": timings.get("retrieval"), "generation": timings.get("llm", ms)}
+
+    judgment, judge_ms = judge_answer(
+        args, row["question"], row["ground_truth"], model_answer)
+    latency["judge"] = judge_ms
+    latency["total"] = round((time.perf_counter() - started) * 1000, 2)
+
+    record.update({
+        "question": row["question"],
+        "ground_truth": row["ground_truth"],
+        "model_answer": model_answer,
+    })
+    if mode != "baseline":
+        record["context_used"] = result.get("context_used", {})
+    record.update({
+        "score": judgment.get("score", 0),
+        "reason": judgment.get("reason", ""),
+        "latency_ms": latency,
+    })
+    return record
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return round(values[low] + (values[high] - values[low]) * (rank - low), 2)
+
+
+def latency_summary(records: list) -> dict:
+    summary = {}
+    for stage in LATENCY_STAGES:
+        values = [r["latency_ms"][stage] for r in records
+                  if r.get("latency_ms", {}).get(stage) is not None]
+        summary[stage] = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+        summary[stage]["count"] = len(values)
+    return summary
+
+
+def score_summary(results: list) -> dict:
+    scores = [r["score"] for r in results if "score" in r]
+    if not scores:
+        return {"total": 0, "correct": 0, "accuracy": 0.0}
+    return {
+        "total": len(scores),
+        "correct": sum(scores),
+        "accuracy": round(sum(scores) / len(scores), 3)
+    }
+
+
+def run_mode(args, mode: str, rows: list) -> tuple:
+    print(f"  {mode.upper()}  ({len(rows)} questions, concurrency {args.concurrency})")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda row: evaluate_one(args, mode, row), rows))
+    wall = time.perf_counter() - started
+
+    summary = score_summary(results)
+    summary["wall_seconds"] = round(wall, 2)
+    summary["questions_per_second"] = round(len(results) / wall, 3) if wall else None
+    summary["latency_ms"] = latency_summary(results)
+    print(f"{mode} summary: accuracy {summary['accuracy']:.1%}, "
+          f"total p50 {summary['latency_ms']['total']['p50']}ms, p95 {summary['latency_ms']['total']['p95']}ms")
+    return results, summary
+
+
+def load_questions(args) -> list:
+    if args.questions_from:
+        # questions and ground truths of an earlier run, no dataset download needed
+        for mode in MODES:
+            path = os.path.join(args.questions_from, f"{mode}.json")
+            if os.path.exists(path):
+                with open(path) as f:
+                    records = json.load(f)
+                return [{"index": r["index"], "question": r["question"], "ground_truth": r["ground_truth"]}
+                        for r in records][:args.sample_size]
+        raise SystemExit(f"no <mode>.json found in {args.questions_from}")
+
+    from datasets import load_dataset
+    raw = load_dataset("neural-bridge/rag-dataset-1200", split="train")
+    rows = []
+    for i, row in enumerate(raw.select(range(args.sample_size))):
+        context = row["context"]
+        rows.append({
+            "index": i,
+            "question": row["question"],
+            "ground_truth": row["answer"],
+            "context": " ".join(context) if isinstance(context, list) else context,
+        })
+    return rows
+
+
+def upload_contexts(args, rows: list, batch_size: int = 25):
+    rows = [row for row in rows if row.get("context")]
+    if not rows:
+        print("no contexts to upload (questions loaded from a previous run)")
+        return
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        response = requests.post(
+            f"{args.api_url}/upload/batch",
+            data={"user_id": args.user_id},
+            files=[("files", (f"doc_{row['index']:04d}.txt", io.BytesIO(row["context"].encode("utf-8")), "text/plain"))
+                   for row in batch],
+            timeout=600
+        )
+        if response.status_code == 200:
+            result = response.json()
+            print(f"batch uploaded: {result['documents_stored']} stored, "
+                  f"{result['documents_skipped']} skipped, {result['documents_failed']} failed")
+        else:
+            print(f"batch upload failed: {response.text[:200]}")
+
+
+def regression_diff(runs: dict, summaries: dict, previous_dir: str) -> dict:
+    previous_summary = {}
+    summary_path = os.path.join(previous_dir, "summary.json")
+    if os.path.exists(summary_path):
+        with open(summary_path) as f:
+            previous_summary = json.load(f).get("modes", {})
+
+    diff = {"previous": previous_dir, "modes": {}}
+    for mode, results in runs.items():
+        path = os.path.join(previous_dir, f"{mode}.json")
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            previous = {r["question"]: r for r in json.load(f)}
+        matched = [(previous[r["question"]], r) for r in results if r["question"] in previous]
+        before = score_summary([old for old, _ in matched])
+        after = score_summary([new for _, new in matched])
+
+        entry = {
+            "compared": len(matched),
+            "accuracy_before": before["accuracy"],
+            "accuracy_after": after["accuracy"],
+            "accuracy_delta": round(after["accuracy"] - before["accuracy"], 3),
+            "fixed": [new["index"] for old, new in matched if new["score"] > old["score"]],
+            "broken": [new["index"] for old, new in matched if new["score"] < old["score"]],
+        }
+        old_latency = previous_summary.get(mode, {}).get("latency_ms")
+        if old_latency:
+            entry["latency_delta_ms"] = {
+                stage: {
+                    key: round(summaries[mode]["latency_ms"][stage][key] - old_latency[stage][key], 2)
+                    for key in (f"p{p}" for p in PERCENTILES)
+                    if summaries[mode]["latency_ms"][stage].get(key) is not None
+                    and old_latency.get(stage, {}).get(key) is not None
+                }
+                for stage in LATENCY_STAGES
+            }
+        diff["modes"][mode] = entry
+    return diff
+
+
+def save_json(results_dir: str, filename: str, data):
+    path = os.path.join(results_dir, filename)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"Saved → {path}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate the RAG API across retrieval modes")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--user-id", default=USER_ID)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--sample-size", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--questions-from", help="reuse questions from a previous results directory")
+    parser.add_argument("--upload", action="store_true", help="upload the dataset contexts first")
+    parser.add_argument("--results-dir", help="defaults to a new eval_results_<timestamp> directory")
+    parser.add_argument("--force", action="store_true", help="overwrite a non-empty --results-dir")
+    parser.add_argument("--compare", help="previous results directory to diff against, e.g. eval_results_v1")
+    args = parser.parse_args()
+    if args.results_dir is None:
+        args.results_dir = f"eval_results_{datetime.now():%Y%m%d_%H%M%S}"
+    elif os.path.isdir(args.results_dir) and os.listdir(args.results_dir) and not args.force:
+        # keeps committed baselines like eval_results/ from being overwritten by a plain run
+        parser.error(f"{args.results_dir} is not empty, pass --force to overwrite it")
+    return args
+
+
+def main():
+    args = parse_args()
+    health, _ = timed_request("get", f"{args.api_url}/health")
+    if not health:
+        raise SystemExit("server not responding.")
+
+    rows = load_questions(args)
+    print(f"Loaded {len(rows)} questions")
+    if args.upload:
+        upload_contexts(args, rows)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    runs, summaries = {}, {}
+    for mode in args.modes:
+        runs[mode], summaries[mode] = run_mode(args, mode, rows)
+        save_json(args.results_dir, f"{mode}.json", runs[mode])
+
+    if set(runs) == set(MODES):
+        comparison = [
+            {
+                "index": rows[i]["index"],
+                "question": rows[i]["question"],
+                "ground_truth": rows[i]["ground_truth"],
+                **{mode: {"answer": runs[mode][i]["model_answer"], "score": runs[mode][i]["score"]}
+                   for mode in MODES},
+            }
+            for i in range(len(rows))
+        ]
+        save_json(args.results_dir, "full_comparison.json", comparison)
+
+    save_json(args.results_dir, "summary.json", {
+        "generated_at": datetime.now().isoformat(),
+        "api_url": args.api_url,
+        "questions": len(rows),
+        "concurrency": args.concurrency,
+        "top_k": args.top_k,
+        "modes": summaries,
+    })
+
+    print(f"\n{'Mode':<15} {'Total':>7} {'Correct':>9} {'Accuracy':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for mode, s in summaries.items():
+        total = s["latency_ms"]["total"]
+        print(f"{mode:<15} {s['total']:>7} {s['correct']:>9} {s['accuracy']:>10.1%} "
+              f"{total['p50']:>9} {total['p95']:>9} {total['p99']:>9}")
+
+    if args.compare:
+        diff = regression_diff(runs, summaries, args.compare)
+        save_json(args.results_dir, "regression.json", diff)
+        print(f"\nRegression vs {args.compare}")
+        for mode, entry in diff["modes"].items():
+            print(f"{mode:<15} accuracy {entry['accuracy_before']:.1%} → {entry['accuracy_after']:.1%} "
+                  f"({entry['accuracy_delta']:+.3f}), fixed {len(entry['fixed'])}, broken {len(entry['broken'])}")
+
+
+if __name__ == "__main__":
+    main()
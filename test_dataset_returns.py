@@ -55,7 +55,10 @@ def test_vector_query(query):
         print(f"{i}. {res.get('metadata', {}).get('document_name', 'unknown')}")
         content = res.get("content", "")
         print(f"content: {content[:150]}...")
-        print(f"distance: {res.get('distance', 0):.4f}")
+        if "distance" in res:
+            print(f"distance: {res['distance']:.4f}")
+        else:
+            print(f"bm25: {res.get('bm25', 0):.4f}")
 
     print("thats all folks from test vector query\n")
 
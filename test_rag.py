@@ -69,6 +69,26 @@ def query_graph_db(query):
     return result.get("results", [])
 
 
+def query_hybrid(query, top_k=3, fusion="rrf"):
+    print(f"HYBRID ({fusion}): '{query}'")
+
+    result = safe_request(
+        "get",
+        f"{BASE_URL}/query/hybrid",
+        params={"user_id": USER_ID, "query": query, "top_k": top_k, "fusion": fusion}
+    )
+
+    if result is None:
+        return []
+
+    print(f"found {result.get('results_count', 0)} results")
+    for item in result.get("results", []):
+        score = item.get("score")
+        score = f"{score:.4f}" if isinstance(score, (int, float)) else "n/a"
+        print(f"  {score} {item.get('sources')} {item.get('text', '')[:80]}")
+    return result.get("results", [])
+
+
 def rag_query(query, use_vector=True, use_graph=True, top_k=3):
     print(f"RAG QUERY: '{query}'")
 
@@ -93,9 +113,39 @@ def rag_query(query, use_vector=True, use_graph=True, top_k=3):
     )
 
     if result:
-        print(f"ANSWER:")
+        print("ANSWER:")
+        print(result.get("response"))
+        print(f"Context used: {result.get('context_used', {})}")
+
+    print("\n\n")
+
+    return result
+
+
+def rag_ask(query, use_vector=True, use_graph=True, top_k=3):
+    print(f"RAG ASK: '{query}'")
+
+    payload = {
+        "user_id": USER_ID,
+        "query": query,
+        "top_k": top_k,
+        "use_vector": use_vector,
+        "use_graph": use_graph,
+        "max_tokens": 500,
+        "temperature": 0.3
+    }
+
+    result = safe_request(
+        "post",
+        f"{BASE_URL}/rag/ask",
+        json=payload
+    )
+
+    if result:
+        print("ANSWER:")
         print(result.get("response"))
         print(f"Context used: {result.get('context_used', {})}")
+        print(f"Timings (ms): {result.get('timings_ms', {})}")
 
     print("\n\n")
 
@@ -112,6 +162,9 @@ def test_single_queries():
     query_graph_db("synthesizer")
     query_graph_db("maple sapling")
 
+    query_hybrid("Where did Sara go?")
+    query_hybrid("What did Michael buy?", fusion="weighted")
+
 
 def test_rag_queries():
     print("TESTING RAG WITH BOTH DATABASES")
@@ -130,6 +183,13 @@ def test_rag_queries():
     rag_query("How much money did each person spend?")
 
 
+def test_rag_ask():
+    print("TESTING SERVER-SIDE RAG (ONE ROUND-TRIP)")
+    rag_ask("Where did Sara go on Saturday and what did she buy?")
+    rag_ask("What did Michael buy from Leo and how much did it cost?")
+    rag_ask("What kind of tree did Chloe buy and where did she plant it?")
+
+
 def test_vector_only():
     print("TESTING RAG WITH VECTOR ONLY")
     rag_query("What did Sara buy at the market?", use_graph=False)
@@ -149,6 +209,7 @@ if __name__ == "__main__":
     print("server is healthy. starting tests")
     test_single_queries()
     test_rag_queries()
+    test_rag_ask()
     test_vector_only()
     test_graph_only()
 
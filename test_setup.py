@@ -30,11 +30,25 @@ def upload_document(user_id: str, filename: str, content: str):
         print(f"{filename} upload failed: {response.text}")
 
 
+def upload_batch(user_id: str, documents: dict):
+    response = requests.post(
+        f"{API_URL}/upload/batch",
+        data={"user_id": user_id},
+        files=[("files", (filename, io.BytesIO(content.encode("utf-8")), "text/plain"))
+               for filename, content in documents.items()]
+    )
+    if response.status_code == 200:
+        result = response.json()
+        print(f"batch uploaded: {result['documents_stored']} stored, "
+              f"{result['documents_skipped']} skipped, {result['documents_failed']} failed")
+    else:
+        print(f"batch upload failed: {response.text}")
+
+
 def preprocess_samples():
     test_user_id = "test_user_001"
-    for filename, content in SAMPLE_DOCS.items():
-        print(f"processing {filename}")
-        upload_document(test_user_id, filename, content)
+    print(f"processing {', '.join(SAMPLE_DOCS)}")
+    upload_batch(test_user_id, SAMPLE_DOCS)
     print("preprocessing complete")
 
 